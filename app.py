@@ -1,19 +1,30 @@
 import json
+import subprocess
+import sys
+
 import streamlit as st
 
-from backend.storage import (
-    load_emails, load_prompts, save_prompts,
-    load_processed, save_processed,
-    load_drafts, add_draft
-)
-from backend.agent import (
-    categorize_email, extract_action_items,
-    chat_about_email, draft_reply
+from backend.storage import save_prompts, upsert_processed, add_draft, storage_engine
+from backend.data_layer import (
+    get_inbox, get_processed, get_prompts,
+    get_draft_count, get_indexes,
 )
-from backend.models import Prompts, ProcessedEmail
+from backend.agent import draft_reply_stream
+from backend.chat_session import load_chat_session
+from backend.json_stream import PartialJsonObject
+from backend.ingest import process_email, fused_triage_enabled
+from backend.job_queue import get_job_queue, run_in_process
+from backend.metrics import shared_metrics
+from backend.predraft import claim_pending_draft
+from backend.rate_governor import LLMDeferred, LLMRejected
+from backend.models import Prompts
 
 st.set_page_config(page_title="Email Productivity Agent", layout="wide")
 
+DEFERRED_MESSAGE = "The LLM provider is not taking requests right now ({reason}). Try again in a moment."
+REJECTED_MESSAGE = "The LLM provider rejected the request ({reason}). Check the API key, model and prompt settings."
+INBOX_PAGE_SIZE = 50
+
 st.title("📧 Prompt-Driven Email Productivity Agent")
 
 # Visible debug banner (timezone-aware) to help identify which source file is running in Streamlit
@@ -35,9 +46,9 @@ with st.container():
         # a small stats card
         st.subheader("Quick stats")
         try:
-            total = len(load_emails())
-            processed_count = len(load_processed())
-            drafts_count = len(load_drafts())
+            total = len(get_inbox())
+            processed_count = len(get_processed())
+            drafts_count = get_draft_count()
         except Exception:
             total, processed_count, drafts_count = 0, 0, 0
 
@@ -48,7 +59,7 @@ with st.container():
 
 # Sidebar: Prompt Brain
 st.sidebar.header("🧠 Prompt Brain")
-prompts = load_prompts()
+prompts = get_prompts()
 
 cat_prompt = st.sidebar.text_area("Categorization Prompt", prompts.categorization_prompt, height=150)
 action_prompt = st.sidebar.text_area("Action Item Prompt", prompts.action_item_prompt, height=150)
@@ -63,78 +74,125 @@ if st.sidebar.button("Save Prompts"):
     save_prompts(new_prompts)
     st.sidebar.success("Prompts saved!")
 
+fused = st.sidebar.checkbox(
+    "Fused triage (one LLM call per email)", value=fused_triage_enabled(),
+    help="Categorize and extract action items with a single combined prompt.",
+)
+
+# LLM call metrics; filled in at the end of the run so this run's calls are included
+metrics_slot = st.sidebar.empty()
+
 # Main layout
 col_inbox, col_detail = st.columns([1, 2])
 
-emails = load_emails()
-processed = load_processed()
-prompts = load_prompts()  # reload after save
+# Shared, memoized snapshots: only re-read when a store changes.
+# The inbox holds headers only; a body is read when its email is opened.
+inbox = get_inbox()
+processed = get_processed()
+prompts = get_prompts()  # reload after save
+
+# Full-text and thread indexes, kept in line with the inbox and processed categories
+search_index, thread_index = get_indexes()
 
 with col_inbox:
     st.subheader("📥 Inbox")
 
     # Search/filter and selection helpers
-    query = st.text_input("Search subjects or senders", value="")
+    query = st.text_input(
+        "Search subjects, senders, bodies and categories",
+        value="",
+        help="Ranked full-text search. Filters: `category:To-Do`, `from:hr@`.",
+    )
 
-    # build display labels for selection
-    display_items = [f"{e.id} — {e.subject} ({e.sender})" for e in emails]
-    filtered = [e for e in emails if query.lower() in e.subject.lower() or query.lower() in e.sender.lower()]
+    if query.strip():
+        hits = search_index.search(query, limit=len(inbox))
+        matches = [h.email_id for h in hits if h.email_id in inbox]
+    else:
+        matches = inbox.ids  # a view over the index, not a copy
 
-    all_ids = [e.id for e in filtered]
-    selected_ids = st.multiselect("Select one or more emails (multi-select)", all_ids, default=[all_ids[0]] if all_ids else [])
+    # Only one page of ids is materialized per rerun
+    pages = max(1, -(-len(matches) // INBOX_PAGE_SIZE))
+    page = st.number_input("Page", min_value=1, max_value=pages, value=1, step=1) if pages > 1 else 1
+    page_ids = matches[(page - 1) * INBOX_PAGE_SIZE:page * INBOX_PAGE_SIZE]
+    selected_ids = st.multiselect("Select one or more emails (multi-select)", page_ids, default=page_ids[:1])
 
+    force_full = st.checkbox(
+        "Force full re-process", value=False,
+        help="By default, Ingest only re-runs emails or stages whose content or prompt changed.",
+    )
     col_btns = st.columns([1, 1])
+    jobs = get_job_queue()
+    # The worker only runs on the SQLite store; otherwise jobs run right here
+    run_here = storage_engine() != "sqlite" or not jobs.live_workers()
+
+    def run_job_here(job):
+        progress = st.progress(0, text=f"Running {job.kind} job {job.id}")
+        job = run_in_process(jobs, job, on_progress=lambda j: progress.progress(int(j.progress * 100)))
+        progress.progress(100)
+        (st.error if job.status == "failed" else st.success)(f"Job {job.id} {job.status}: {job.message}")
+
     with col_btns[0]:
         if st.button("Process Selected"):
             if not selected_ids:
                 st.warning("Select at least one email to process.")
             else:
-                progress = st.progress(0)
-                new_processed = processed.copy()
-                for i, eid in enumerate(selected_ids, start=1):
-                    e = next(x for x in emails if x.id == eid)
-                    category = categorize_email(e, prompts)
-                    actions = extract_action_items(e, prompts)
-                    new_processed[e.id] = ProcessedEmail(
-                        email_id=e.id,
-                        category=category,
-                        action_items=actions,
-                        summary=None
-                    )
-                    progress.progress(int(i / len(selected_ids) * 100))
-                save_processed(new_processed)
-                processed = new_processed
-                st.success(f"Processed {len(selected_ids)} email(s)")
+                job = jobs.submit("process", {"email_ids": list(selected_ids), "fused": fused})
+                if run_here:
+                    run_job_here(job)
+                else:
+                    st.success(f"Queued {len(selected_ids)} email(s) as job {job.id}")
 
     with col_btns[1]:
         if st.button("Ingest / Re-process Inbox"):
-            new_processed = processed.copy()
-            progress = st.progress(0)
-            for i, e in enumerate(emails, start=1):
-                category = categorize_email(e, prompts)
-                actions = extract_action_items(e, prompts)
-                new_processed[e.id] = ProcessedEmail(
-                    email_id=e.id,
-                    category=category,
-                    action_items=actions,
-                    summary=None
-                )
-                progress.progress(int(i / len(emails) * 100))
-            save_processed(new_processed)
-            processed = new_processed
-            st.success("Inbox processed using current prompts!")
+            job = jobs.submit("ingest", {"incremental": not force_full, "fused": fused})
+            if run_here:
+                run_job_here(job)
+            else:
+                st.success(f"Queued inbox ingest as job {job.id}")
+    processed = get_processed()
+
+    # Background jobs run in scripts/ingest_worker.py; show their progress here
+    active_jobs = jobs.active()
+    if active_jobs:
+        st.markdown("#### ⏳ Background jobs")
+        if storage_engine() != "sqlite":
+            st.info("Jobs run inside the app on the JSON store. For a background worker, run "
+                    "`python scripts/migrate_storage.py` and restart with `EMAIL_AGENT_STORAGE=sqlite`.")
+        elif not jobs.live_workers():
+            st.warning("No ingestion worker is running. Start one with `python scripts/ingest_worker.py`.")
+            if st.button("Start worker"):
+                subprocess.Popen([sys.executable, "scripts/ingest_worker.py"], start_new_session=True)
+                st.success("Worker started.")
+        if run_here and st.button("Run queued jobs here"):
+            for job in active_jobs:
+                run_job_here(job)
+            active_jobs = jobs.active()
+        for job in active_jobs:
+            label = f"{job.kind} {job.id}: {job.status}"
+            if job.total:
+                label += f" ({job.done}/{job.total})"
+            st.progress(int(job.progress * 100), text=label)
+            if st.button("Cancel", key=f"cancel-{job.id}"):
+                jobs.cancel(job.id)
+        st.button("Refresh progress")
+    else:
+        finished = jobs.recent(limit=1)
+        if finished and finished[0].message:
+            (st.error if finished[0].status == "failed" else st.caption)(
+                f"Last job {finished[0].id} {finished[0].status}: {finished[0].message}"
+            )
 
     # Show a compact visual list
     st.markdown("### Email List")
-    # We'll map id->email for quick lookup
-    id_to_email = {e.id: e for e in emails}
 
     # Use a radio if single-selection preferred; default to the first selected_id or first email
-    default_single = selected_ids[0] if selected_ids else (emails[0].id if emails else None)
-    selected_id = st.radio("Choose an email to view details", options=[e.id for e in emails], index=[e.id for e in emails].index(default_single) if default_single else 0) if emails else None
-    selected_email = id_to_email[selected_id] if selected_id else None
+    default_single = selected_ids[0] if selected_ids else (page_ids[0] if page_ids else None)
+    selected_id = st.radio("Choose an email to view details", options=page_ids,
+                           index=page_ids.index(default_single) if default_single in page_ids else 0) if page_ids else None
+    selected_email = inbox.get(selected_id) if selected_id else None
 
-    for e in emails:
+    for email_id in page_ids:
+        e = inbox.ref(inbox.position(email_id))
         cat = processed.get(e.id).category if e.id in processed else "Not processed"
         st.write(f"**[{cat}]** {e.subject}")
         st.caption(f"{e.sender} • {e.timestamp}")
@@ -149,15 +207,10 @@ with col_detail:
         st.markdown("---")
         st.text_area("Body", selected_email.body, height=200)
 
-        # Threaded view (emails with the same subject or same sender are shown as a thread)
+        # Threaded view (Message-ID/In-Reply-To links and normalized subjects, oldest first)
         st.markdown("---")
         st.markdown("### 📎 Thread / Related messages")
-        thread = [x for x in emails if (x.subject == selected_email.subject or x.sender == selected_email.sender)]
-        # Sort thread by timestamp if possible
-        try:
-            thread = sorted(thread, key=lambda x: x.timestamp)
-        except Exception:
-            pass
+        thread = [t for t in map(inbox.get, thread_index.thread_of(selected_email.id)) if t is not None]
         for t in thread:
             st.markdown(f"**{t.sender}** — {t.timestamp}")
             st.write(t.body)
@@ -165,53 +218,135 @@ with col_detail:
 
         # Allow single-email processing from detail view
         if st.button("Process this email"):
-            with st.spinner("Processing email..."):
-                category = categorize_email(selected_email, prompts)
-                actions = extract_action_items(selected_email, prompts)
-                processed[selected_email.id] = ProcessedEmail(
-                    email_id=selected_email.id,
-                    category=category,
-                    action_items=actions,
-                    summary=None
-                )
-                save_processed(processed)
-            st.success("Email processed!")
+            try:
+                with st.spinner("Processing email..."):
+                    result = process_email(selected_email, prompts, fused=fused)
+                    upsert_processed([result])
+                    processed = {**processed, result.email_id: result}
+                    search_index.update_category(selected_email, result.category)
+                    search_index.save_if_due()
+                st.success("Email processed!")
+            except LLMDeferred as exc:
+                st.warning(DEFERRED_MESSAGE.format(reason=exc.reason))
+            except LLMRejected as exc:
+                st.error(REJECTED_MESSAGE.format(reason=exc))
     else:
         st.write("No email selected")
 
     if selected_id in processed:
         st.markdown("**Category:** " + processed[selected_id].category)
+        source = processed[selected_id].provenance.get("category")
+        if source and source.get("source") == "rule":
+            st.caption(f"Set by rule `{source['rule']}` ({', '.join(source.get('matched', []))}); no LLM call.")
+        elif source and source.get("source") == "duplicate":
+            st.caption(f"Copied from near-duplicate email {source['of']} "
+                       f"({source['similarity']:.0%} similar); no LLM call.")
+        elif source and source.get("source") == "classifier":
+            st.caption(f"Set by the local classifier ({source['confidence']:.0%} confident); no LLM call.")
         st.markdown("**Action Items:**")
         st.json(processed[selected_id].action_items)
 
     st.markdown("### 💬 Email Agent Chat")
+    chat = load_chat_session(selected_email, prompts) if selected_email is not None else None
+    if chat is not None and (chat.summary or chat.turns):
+        if chat.summary:
+            st.caption(f"Earlier conversation (summarized): {chat.summary}")
+        for asked, answered in chat.turns:
+            st.markdown(f"**You:** {asked}")
+            st.markdown(f"**Agent:** {answered}")
+        if st.button("Clear chat"):
+            chat.reset()
+            st.rerun()
     user_query = st.text_input("Ask the agent about this email (e.g., 'Summarize this email')")
-    if st.button("Ask"):
-        answer = chat_about_email(selected_email, prompts, user_query)
+    if st.button("Ask") and chat is not None and user_query.strip():
+        st.markdown(f"**You:** {user_query}")
         st.markdown("**Agent Response:**")
-        st.write(answer)
+        try:
+            st.write_stream(chat.ask_stream(user_query))
+        except LLMDeferred as exc:
+            st.warning(DEFERRED_MESSAGE.format(reason=exc.reason))
+        except LLMRejected as exc:
+            st.error(REJECTED_MESSAGE.format(reason=exc))
 
     st.markdown("### ✍️ Draft Reply")
     extra_instruction = st.text_input("Optional: Describe your tone (e.g., 'friendly and concise')")
     if st.button("Generate Reply Draft"):
-        raw = draft_reply(selected_email, prompts, extra_instruction)
-        try:
-            data = json.loads(raw)
-            draft = add_draft(
-                related_email_id=selected_email.id,
-                subject=data.get("subject", f"Re: {selected_email.subject}"),
-                body=data.get("body", ""),
-                metadata={
-                    "suggested_followups": data.get("suggested_followups", []),
-                    "category": processed[selected_id].category if selected_id in processed else None,
-                    "action_items": processed[selected_id].action_items if selected_id in processed else []
-                }
-            )
-            st.success("Draft generated and saved (not sent).")
+        # Replies pre-drafted in the background are used when the email, prompt and tone still match
+        draft = claim_pending_draft(selected_email, prompts, extra_instruction)
+        if draft is not None:
+            st.success("Draft prepared in the background and saved (not sent).")
+        else:
+            # Render the subject/body while the JSON is still streaming in
+            subject_slot = st.empty()
+            body_slot = st.empty()
+            partial = PartialJsonObject()
+            deferred = rejected = None
+            try:
+                for chunk in draft_reply_stream(selected_email, prompts, extra_instruction):
+                    fields = partial.feed(chunk)
+                    if isinstance(fields.get("subject"), str):
+                        subject_slot.markdown(f"**Subject:** {fields['subject']}")
+                    if isinstance(fields.get("body"), str):
+                        body_slot.markdown(fields["body"] + ("" if partial.complete else " ▌"))
+            except LLMDeferred as exc:
+                deferred = exc
+            except LLMRejected as exc:
+                rejected = exc
+            raw = partial.text
+            subject_slot.empty()
+            body_slot.empty()
+            if deferred is not None:
+                st.warning(DEFERRED_MESSAGE.format(reason=deferred.reason))
+            elif rejected is not None:
+                st.error(REJECTED_MESSAGE.format(reason=rejected))
+            else:
+                try:
+                    data = json.loads(raw)
+                    draft = add_draft(
+                        related_email_id=selected_email.id,
+                        subject=data.get("subject", f"Re: {selected_email.subject}"),
+                        body=data.get("body", ""),
+                        metadata={
+                            "suggested_followups": data.get("suggested_followups", []),
+                            "category": processed[selected_id].category if selected_id in processed else None,
+                            "action_items": processed[selected_id].action_items if selected_id in processed else []
+                        }
+                    )
+                    st.success("Draft generated and saved (not sent).")
+                except Exception:
+                    st.error("Failed to parse draft reply JSON. Check LLM output.")
+                    st.code(raw)
+        if draft is not None:
             st.text_input("Draft Subject", value=draft.subject)
             st.text_area("Draft Body", value=draft.body, height=200)
             st.markdown("**Suggested follow-ups:**")
             st.json(draft.metadata.get("suggested_followups", []))
-        except Exception:
-            st.error("Failed to parse draft reply JSON. Check LLM output.")
-            st.code(raw)
+
+# Live LLM metrics panel (per calling function)
+with metrics_slot.container():
+    st.subheader("📈 LLM calls")
+    # This process's calls plus those exported by the ingestion worker and scripts
+    metrics = shared_metrics()
+    rows = metrics.summary()
+    if not rows:
+        st.caption("No LLM calls yet.")
+    else:
+        st.dataframe(
+            [
+                {
+                    "caller": r["caller"],
+                    "calls": r["calls"],
+                    "cache hit %": round(100 * r["cache_hit_rate"]),
+                    "mock": r["mock"],
+                    "deferred": r["deferred"],
+                    "rejected": r["rejected"],
+                    "p50 s": round(r["p50_s"] or 0, 3),
+                    "p95 s": round(r["p95_s"] or 0, 3),
+                    "tokens": r["prompt_tokens"] + r["completion_tokens"],
+                }
+                for r in rows
+            ],
+            hide_index=True,
+        )
+        st.download_button("Prometheus metrics", metrics.to_prometheus(), file_name="llm_metrics.prom")
+        st.download_button("JSON metrics", metrics.to_json(), file_name="llm_metrics.json")
@@ -1,22 +1,41 @@
-﻿import json
-from typing import List, Dict, Any
-from .llm_client import run_llm
+﻿import asyncio
+import contextvars
+import json
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, List, Dict, Any, Iterator, Optional, Tuple
+from .llm_client import run_llm, run_llm_async, run_llm_stream
+from .metrics import track_caller
 from .models import Email, Prompts
+from .preprocess import PreparedBody, max_chunks, prepare_body
 
-def categorize_email(email: Email, prompts: Prompts) -> str:
-    system_prompt = prompts.categorization_prompt
-    user_prompt = f"Email subject: {email.subject}\nEmail body:\n{email.body}\n"
-    raw = run_llm(system_prompt, user_prompt)
+# Chunk calls of one map-reduce pass that may run at once
+MAP_CONCURRENCY = 4
+
+def _triage_user_prompt(email: Email) -> str:
+    return f"Email subject: {email.subject}\nEmail body:\n{prepare_body(email.body).text}\n"
+
+def _chunk_prompts(email: Email, prepared: PreparedBody) -> List[str]:
+    """User prompts for the map step over a body that exceeds the token budget."""
+    chunks = prepared.chunks[:max_chunks()]
+    return [
+        f"Email subject: {email.subject}\nEmail body (part {i} of {len(chunks)}):\n{chunk}\n"
+        for i, chunk in enumerate(chunks, 1)
+    ]
+
+def _map_llm(system_prompt: str, user_prompts: List[str]) -> List[str]:
+    """Run ``system_prompt`` over every user prompt, a few at a time."""
+    with ThreadPoolExecutor(max_workers=min(MAP_CONCURRENCY, len(user_prompts))) as pool:
+        futures = [pool.submit(contextvars.copy_context().run, run_llm, system_prompt, u) for u in user_prompts]
+        return [f.result() for f in futures]
+
+def _parse_category(raw: str) -> str:
     try:
         data = json.loads(raw)
         return data.get("category", "Uncategorized")
     except Exception:
         return "Uncategorized"
 
-def extract_action_items(email: Email, prompts: Prompts) -> List[Dict[str, Any]]:
-    system_prompt = prompts.action_item_prompt
-    user_prompt = f"Email subject: {email.subject}\nEmail body:\n{email.body}\n"
-    raw = run_llm(system_prompt, user_prompt)
+def _parse_action_items(raw: str) -> List[Dict[str, Any]]:
     try:
         data = json.loads(raw)
         if isinstance(data, list):
@@ -25,27 +44,172 @@ def extract_action_items(email: Email, prompts: Prompts) -> List[Dict[str, Any]]
     except Exception:
         return []
 
-def chat_about_email(email: Email, prompts: Prompts, user_query: str) -> str:
-    system_prompt = (
+def _merge_action_items(lists: Iterable[List[Dict[str, Any]]]) -> List[Dict[str, Any]]:
+    """Reduce step: concatenate per-chunk action items, dropping repeated tasks."""
+    merged, seen = [], set()
+    for items in lists:
+        for item in items:
+            task = item.get("task") if isinstance(item, dict) else item
+            key = " ".join(str(task).lower().split())
+            if key not in seen:
+                seen.add(key)
+                merged.append(item)
+    return merged
+
+@track_caller()
+def categorize_email(email: Email, prompts: Prompts) -> str:
+    raw = run_llm(prompts.categorization_prompt, _triage_user_prompt(email))
+    return _parse_category(raw)
+
+@track_caller()
+def extract_action_items(email: Email, prompts: Prompts) -> List[Dict[str, Any]]:
+    """Extract action items; a body over the token budget is read chunk by chunk."""
+    prepared = prepare_body(email.body)
+    if prepared.over_budget:
+        raws = _map_llm(prompts.action_item_prompt, _chunk_prompts(email, prepared))
+        return _merge_action_items(_parse_action_items(raw) for raw in raws)
+    raw = run_llm(prompts.action_item_prompt, _triage_user_prompt(email))
+    return _parse_action_items(raw)
+
+@track_caller("categorize_email")
+async def categorize_email_async(email: Email, prompts: Prompts) -> str:
+    raw = await run_llm_async(prompts.categorization_prompt, _triage_user_prompt(email))
+    return _parse_category(raw)
+
+@track_caller("extract_action_items")
+async def extract_action_items_async(email: Email, prompts: Prompts) -> List[Dict[str, Any]]:
+    prepared = prepare_body(email.body)
+    if prepared.over_budget:
+        raws = await asyncio.gather(*(
+            run_llm_async(prompts.action_item_prompt, u) for u in _chunk_prompts(email, prepared)
+        ))
+        return _merge_action_items(_parse_action_items(raw) for raw in raws)
+    raw = await run_llm_async(prompts.action_item_prompt, _triage_user_prompt(email))
+    return _parse_action_items(raw)
+
+def _fused_triage_prompt(prompts: Prompts) -> str:
+    return (
+        "You triage emails. Apply both sets of instructions below to the same email "
+        "and respond with a single JSON object of the form "
+        "{\"category\": \"...\", \"action_items\": [{\"task\": \"...\", \"deadline\": \"...\"}]}.\n\n"
+        f"Categorization instructions:\n{prompts.categorization_prompt}\n\n"
+        f"Action item instructions:\n{prompts.action_item_prompt}\n"
+    )
+
+def _parse_fused(raw: str) -> Tuple[Optional[str], Optional[List[Dict[str, Any]]]]:
+    """Return (category, action_items); a field is None when it failed to parse."""
+    try:
+        data = json.loads(raw)
+    except Exception:
+        return None, None
+    if not isinstance(data, dict):
+        return None, None
+    category = data.get("category")
+    actions = data.get("action_items")
+    return (
+        category if isinstance(category, str) and category else None,
+        actions if isinstance(actions, list) else None,
+    )
+
+@track_caller()
+def triage_email(email: Email, prompts: Prompts) -> Tuple[str, List[Dict[str, Any]]]:
+    """Categorize and extract action items with a single LLM call.
+
+    Any field missing from the fused response is recovered with the matching
+    single-purpose call (``categorize_email`` / ``extract_action_items``).
+    A body over the token budget skips the fused call, since extraction
+    needs its map-reduce pass.
+    """
+    if prepare_body(email.body).over_budget:
+        return categorize_email(email, prompts), extract_action_items(email, prompts)
+    raw = run_llm(_fused_triage_prompt(prompts), _triage_user_prompt(email))
+    category, actions = _parse_fused(raw)
+    if category is None:
+        category = categorize_email(email, prompts)
+    if actions is None:
+        actions = extract_action_items(email, prompts)
+    return category, actions
+
+@track_caller("triage_email")
+async def triage_email_async(email: Email, prompts: Prompts) -> Tuple[str, List[Dict[str, Any]]]:
+    if prepare_body(email.body).over_budget:
+        category, actions = await asyncio.gather(
+            categorize_email_async(email, prompts), extract_action_items_async(email, prompts)
+        )
+        return category, actions
+    raw = await run_llm_async(_fused_triage_prompt(prompts), _triage_user_prompt(email))
+    category, actions = _parse_fused(raw)
+    if category is None:
+        category = await categorize_email_async(email, prompts)
+    if actions is None:
+        actions = await extract_action_items_async(email, prompts)
+    return category, actions
+
+_CHAT_MAP_PROMPT = (
+    "You read one part of a long email. Note everything in it that helps answer the user's "
+    "question: facts, requests, dates, names and figures. Reply with short notes, or NONE if "
+    "nothing in this part is relevant."
+)
+
+def _chat_body(email: Email, user_query: str) -> str:
+    """The email body for a chat prompt.
+
+    A body over the token budget is replaced by notes taken from each chunk
+    with the question in mind (the map step; the answer is the reduce step).
+    """
+    prepared = prepare_body(email.body)
+    if not prepared.over_budget:
+        return prepared.text
+    notes = _map_llm(_CHAT_MAP_PROMPT, [f"USER QUESTION:\n{user_query}\n\n{u}" for u in _chunk_prompts(email, prepared)])
+    relevant = [n.strip() for n in notes if n.strip() and n.strip().upper() != "NONE"]
+    return "[Notes on the relevant parts of a long email]\n" + "\n\n".join(relevant)
+
+def _chat_system_prompt(prompts: Prompts) -> str:
+    return (
         "You are an email productivity assistant. "
         "Use the user's prompt brain instructions when relevant.\n\n"
         f"Categorization instructions:\n{prompts.categorization_prompt}\n\n"
         f"Action item instructions:\n{prompts.action_item_prompt}\n\n"
         f"Auto-reply instructions:\n{prompts.auto_reply_prompt}\n"
     )
+
+def _chat_prompts(email: Email, prompts: Prompts, user_query: str) -> Tuple[str, str]:
+    system_prompt = _chat_system_prompt(prompts)
     user_prompt = (
-        f"EMAIL CONTENT:\nSubject: {email.subject}\nBody:\n{email.body}\n\n"
+        f"EMAIL CONTENT:\nSubject: {email.subject}\nBody:\n{_chat_body(email, user_query)}\n\n"
         f"USER QUESTION:\n{user_query}"
     )
-    return run_llm(system_prompt, user_prompt)
+    return system_prompt, user_prompt
 
-def draft_reply(email: Email, prompts: Prompts, extra_instruction: str = "") -> str:
+def _draft_prompts(email: Email, prompts: Prompts, extra_instruction: str) -> Tuple[str, str]:
     system_prompt = prompts.auto_reply_prompt
     user_prompt = (
         f"Original email subject: {email.subject}\n"
-        f"Original email body:\n{email.body}\n\n"
+        f"Original email body:\n{prepare_body(email.body).text}\n\n"
         f"User preferences: {extra_instruction}\n\n"
         "Draft a reply email with a subject and body. "
         "Respond in JSON: {\"subject\": \"...\", \"body\": \"...\", \"suggested_followups\": [\"...\"]}."
     )
-    return run_llm(system_prompt, user_prompt)
+    return system_prompt, user_prompt
+
+@track_caller()
+def chat_about_email(email: Email, prompts: Prompts, user_query: str) -> str:
+    return run_llm(*_chat_prompts(email, prompts, user_query))
+
+@track_caller("chat_about_email")
+def chat_about_email_stream(email: Email, prompts: Prompts, user_query: str) -> Iterator[str]:
+    """Like :func:`chat_about_email` but yields the answer as it is generated."""
+    return run_llm_stream(*_chat_prompts(email, prompts, user_query))
+
+@track_caller()
+def draft_reply(email: Email, prompts: Prompts, extra_instruction: str = "") -> str:
+    return run_llm(*_draft_prompts(email, prompts, extra_instruction))
+
+@track_caller("draft_reply")
+def draft_reply_stream(email: Email, prompts: Prompts, extra_instruction: str = "") -> Iterator[str]:
+    """Like :func:`draft_reply` but yields the raw JSON text as it is generated.
+
+    Feed the chunks to ``backend.json_stream.PartialJsonObject`` to read the
+    subject and body before the response is complete.
+    """
+    return run_llm_stream(*_draft_prompts(email, prompts, extra_instruction))
@@ -0,0 +1,452 @@
+"""Offline batch-job mode for bulk triage.
+
+Instead of one synchronous call per email, a batch job writes every
+categorization and extraction request to a JSONL file in the OpenAI batch
+format, hands the file to a :class:`BatchBackend`, and later merges the
+results into the processed store. Every request is keyed by
+``<email id>::<stage>``.
+
+Jobs live in ``data/batch_jobs/<job id>/``:
+  - ``requests.jsonl``: one chat-completion request per line
+  - ``manifest.json``: job state, backend handle, email hashes and prompt fingerprints
+  - ``results.jsonl``: the backend's output, once downloaded
+  - ``errors.jsonl``: the backend's per-request errors, when it reports them
+    separately (the OpenAI error file)
+
+Each step records its progress in the manifest, so an interrupted job can be
+resumed by running the same step again. Emails decided by a triage rule
+(``backend.rules``) get no requests; their results are kept in the manifest
+and merged with the rest.
+
+Merging records every failed request in the manifest (``errors``, keyed by
+custom id) with its status, code and message, including requests the
+backend returned nothing for. A failed stage stays stale, so the next job
+retries it, unless the provider rejected the request itself (HTTP 400 or
+422): such a stage is left out of later jobs until the email or the prompt
+changes.
+
+Backends:
+  - ``local``: runs each request through ``run_llm`` (mock, cache or network);
+    a stand-in for tests and small runs. It resumes where it stopped: when
+    the provider defers calls it stops, leaving the job unsubmitted, and a
+    request the provider rejects is written as an error result.
+  - ``openai``: the provider Batch API (files + batches endpoints).
+"""
+
+import itertools
+import json
+import logging
+import uuid
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, Optional, Tuple
+
+from .agent import _parse_action_items, _parse_category, _triage_user_prompt
+from .fingerprints import STAGES, email_fingerprint, stage_fingerprints, stale_stages
+from .llm_client import get_client, model_settings, run_llm
+from .metrics import llm_caller
+from .models import Email, Prompts, ProcessedEmail
+from .rate_governor import LLMDeferred, LLMRejected
+from .rules import get_rule_engine
+
+log = logging.getLogger(__name__)
+
+DEFAULT_JOBS_DIR = Path("data") / "batch_jobs"
+# Statuses that mean the request itself is bad; sending it again won't help
+_REJECTED_STATUS = (400, 422)
+
+
+def _custom_id(email_id: str, stage: str) -> str:
+    return f"{email_id}::{stage}"
+
+
+def _split_custom_id(custom_id: str) -> Tuple[str, str]:
+    email_id, _sep, stage = custom_id.rpartition("::")
+    return email_id, stage
+
+
+def _stage_prompt(prompts: Prompts, stage: str) -> str:
+    return prompts.categorization_prompt if stage == "category" else prompts.action_item_prompt
+
+
+def _iter_jsonl(path: Path) -> Iterator[dict]:
+    if not path.exists():
+        return
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def _response_content(result: dict) -> Optional[str]:
+    """Extract the completion text from one line of a batch output file."""
+    if result.get("error"):
+        return None
+    response = result.get("response") or {}
+    if response.get("status_code", 200) != 200:
+        return None
+    try:
+        return response["body"]["choices"][0]["message"]["content"]
+    except (KeyError, IndexError, TypeError):
+        return None
+
+
+def _request_error(result: dict) -> dict:
+    """Status, code and message of a failed line of a batch output or error file."""
+    response = result.get("response") or {}
+    status = response.get("status_code")
+    body = response.get("body")
+    error = result.get("error") or (body.get("error") if isinstance(body, dict) else None) or {}
+    if not isinstance(error, dict):
+        error = {"message": str(error)}
+    code = error.get("code") or error.get("type") or ("unparseable_response" if status == 200 else None)
+    return {
+        "status": status,
+        "code": code,
+        "message": error.get("message"),
+        "retry": status not in _REJECTED_STATUS,
+    }
+
+
+def _rejected_stages(jobs_dir: Path) -> Dict[Tuple[str, str], Tuple[str, str]]:
+    """(email id, stage) -> (email hash, prompt fingerprint) of requests earlier jobs had rejected."""
+    rejected = {}
+    for job in list_jobs(jobs_dir):
+        hashes = job.manifest.get("email_hashes", {})
+        fingerprints = job.manifest.get("prompt_fingerprints", {})
+        for custom_id, error in job.manifest.get("errors", {}).items():
+            email_id, stage = _split_custom_id(custom_id)
+            if not error.get("retry", True) and email_id in hashes:
+                rejected[(email_id, stage)] = (hashes[email_id], fingerprints.get(stage))
+    return rejected
+
+
+class BatchJob:
+    """A batch job directory and its manifest."""
+
+    def __init__(self, job_dir: Path):
+        self.dir = Path(job_dir)
+        self.requests_path = self.dir / "requests.jsonl"
+        self.results_path = self.dir / "results.jsonl"
+        self.errors_path = self.dir / "errors.jsonl"
+        self.manifest_path = self.dir / "manifest.json"
+        self.manifest = json.loads(self.manifest_path.read_text(encoding="utf-8")) \
+            if self.manifest_path.exists() else {}
+
+    @property
+    def id(self) -> str:
+        return self.dir.name
+
+    @property
+    def status(self) -> str:
+        return self.manifest.get("status", "new")
+
+    def save(self) -> None:
+        self.manifest["updated_at"] = datetime.utcnow().isoformat()
+        tmp = self.manifest_path.with_suffix(".json.tmp")
+        tmp.write_text(json.dumps(self.manifest, indent=2), encoding="utf-8")
+        tmp.replace(self.manifest_path)
+
+
+def create_batch_job(emails: Iterable[Email], prompts: Prompts,
+                     processed: Optional[Dict[str, ProcessedEmail]] = None,
+                     jobs_dir: Path = DEFAULT_JOBS_DIR) -> BatchJob:
+    """Write the requests for every stale stage of ``emails`` to a new job.
+
+    With ``processed`` given, stages whose stored result is still current
+    (same email hash and prompt fingerprint) are left out, as are stages an
+    earlier job in ``jobs_dir`` had rejected for the same content and prompt.
+    """
+    processed = processed or {}
+    current = stage_fingerprints(prompts)
+    rejected = _rejected_stages(jobs_dir)
+    engine = get_rule_engine()
+    rules_fingerprint = engine.fingerprint if engine is not None else None
+    model, temperature = model_settings()
+    job = BatchJob(Path(jobs_dir) / datetime.utcnow().strftime(f"%Y%m%dT%H%M%S-{uuid.uuid4().hex[:8]}"))
+    job.dir.mkdir(parents=True, exist_ok=True)
+
+    email_hashes: Dict[str, str] = {}
+    ruled: Dict[str, dict] = {}
+    count = skipped = 0
+    with open(job.requests_path, "w", encoding="utf-8") as f:
+        for email in emails:
+            stages = stale_stages(email, current, processed.get(email.id), rules_fingerprint)
+            if not stages:
+                continue
+            email_hash = email_fingerprint(email)
+            match = engine.match(email) if engine is not None else None
+            if match is None:
+                retry = {s for s in stages if rejected.get((email.id, s)) != (email_hash, current[s])}
+                previous = processed.get(email.id)
+                if retry != stages and (previous is None or previous.email_hash != email_hash):
+                    retry = set()  # the other stages alone could not be merged
+                skipped += len(stages) - len(retry)
+                if not retry:
+                    continue
+                stages = retry
+            email_hashes[email.id] = email_hash
+            if match is not None:
+                ruled[email.id] = {"category": match.category, "provenance": match.provenance()}
+                continue
+            for stage in STAGES:
+                if stage not in stages:
+                    continue
+                f.write(json.dumps({
+                    "custom_id": _custom_id(email.id, stage),
+                    "method": "POST",
+                    "url": "/v1/chat/completions",
+                    "body": {
+                        "model": model,
+                        "temperature": temperature,
+                        "messages": [
+                            {"role": "system", "content": _stage_prompt(prompts, stage)},
+                            {"role": "user", "content": _triage_user_prompt(email)},
+                        ],
+                    },
+                }) + "\n")
+                count += 1
+
+    job.manifest = {
+        "status": "created",
+        "created_at": datetime.utcnow().isoformat(),
+        "requests": count,
+        "rejected_skipped": skipped,
+        "prompt_fingerprints": current,
+        "email_hashes": email_hashes,
+        "rule_results": ruled,
+        "merged": [],
+    }
+    job.save()
+    return job
+
+
+class BatchBackend:
+    """Executes a requests file and produces an output file in the same format as OpenAI."""
+
+    name = "base"
+
+    def submit(self, job: BatchJob) -> str:
+        """Start processing ``job.requests_path``; return a backend handle."""
+        raise NotImplementedError
+
+    def poll(self, job: BatchJob) -> str:
+        """Return ``in_progress``, ``completed`` or ``failed``."""
+        raise NotImplementedError
+
+    def download(self, job: BatchJob) -> None:
+        """Write the output to ``job.results_path`` (and any separate error file to ``job.errors_path``)."""
+        raise NotImplementedError
+
+
+class LocalBatchBackend(BatchBackend):
+    """Runs requests in-process through ``run_llm``, resuming from ``results.jsonl``."""
+
+    name = "local"
+
+    def submit(self, job: BatchJob) -> str:
+        done = {r["custom_id"] for r in _iter_jsonl(job.results_path)}
+        with open(job.results_path, "a", encoding="utf-8") as out, llm_caller("batch_triage"):
+            for request in _iter_jsonl(job.requests_path):
+                if request["custom_id"] in done:
+                    continue
+                system, user = (m["content"] for m in request["body"]["messages"])
+                try:
+                    content = run_llm(system, user)
+                except LLMDeferred as exc:
+                    log.warning("Provider deferred batch job %s (%s); submit it again to resume", job.id, exc.reason)
+                    raise
+                except LLMRejected as exc:
+                    out.write(json.dumps({
+                        "custom_id": request["custom_id"],
+                        "response": {"status_code": exc.status or 400, "body": None},
+                        "error": {"code": exc.reason, "message": str(exc)},
+                    }) + "\n")
+                    out.flush()
+                    continue
+                out.write(json.dumps({
+                    "custom_id": request["custom_id"],
+                    "response": {"status_code": 200, "body": {"choices": [{"message": {"content": content}}]}},
+                    "error": None,
+                }) + "\n")
+                out.flush()
+        return str(job.results_path)
+
+    def poll(self, job: BatchJob) -> str:
+        return "completed"
+
+    def download(self, job: BatchJob) -> None:
+        pass  # results are written in place by submit()
+
+
+class OpenAIBatchBackend(BatchBackend):
+    """The provider Batch API: upload the file, create a batch, fetch the output file."""
+
+    name = "openai"
+
+    def __init__(self, client=None):
+        self.client = client or get_client()
+        if self.client is None:
+            raise RuntimeError("The OpenAI batch backend needs OPENAI_API_KEY and the openai SDK")
+
+    def submit(self, job: BatchJob) -> str:
+        with open(job.requests_path, "rb") as f:
+            uploaded = self.client.files.create(file=f, purpose="batch")
+        batch = self.client.batches.create(
+            input_file_id=uploaded.id,
+            endpoint="/v1/chat/completions",
+            completion_window="24h",
+            metadata={"email_agent_job": job.id},
+        )
+        return batch.id
+
+    def poll(self, job: BatchJob) -> str:
+        batch = self.client.batches.retrieve(job.manifest["remote_id"])
+        job.manifest["output_file_id"] = batch.output_file_id
+        job.manifest["error_file_id"] = batch.error_file_id
+        if batch.status == "completed":
+            return "completed"
+        if batch.status in ("failed", "expired", "cancelled"):
+            return "failed"
+        return "in_progress"
+
+    def download(self, job: BatchJob) -> None:
+        # A batch where every request failed has no output file, only errors
+        for key, path in (("output_file_id", job.results_path), ("error_file_id", job.errors_path)):
+            file_id = job.manifest.get(key)
+            if file_id:
+                path.write_text(self.client.files.content(file_id).text, encoding="utf-8")
+
+
+BACKENDS = {"local": LocalBatchBackend, "openai": OpenAIBatchBackend}
+
+
+def get_backend(name: str) -> BatchBackend:
+    try:
+        return BACKENDS[name]()
+    except KeyError:
+        raise ValueError(f"Unknown batch backend {name!r}; choose from {sorted(BACKENDS)}") from None
+
+
+def submit_job(job: BatchJob, backend: BatchBackend) -> None:
+    """Submit a job unless it was already submitted (safe to repeat)."""
+    if job.status in ("submitted", "completed", "merged") and job.manifest.get("backend") == backend.name:
+        return
+    if not job.manifest.get("requests"):
+        # Every email was decided by a rule; there is nothing to send
+        job.manifest.update(backend=backend.name, remote_id=None, status="completed")
+        job.save()
+        return
+    job.manifest["backend"] = backend.name
+    job.manifest["remote_id"] = backend.submit(job)
+    job.manifest["status"] = "submitted"
+    job.save()
+
+
+def poll_job(job: BatchJob, backend: BatchBackend) -> str:
+    """Check a submitted job and download its output once it has completed."""
+    if job.status in ("completed", "merged"):
+        return job.status
+    state = backend.poll(job)
+    if state == "completed":
+        backend.download(job)
+        job.manifest["status"] = "completed"
+    elif state == "failed":
+        job.manifest["status"] = "failed"
+    job.save()
+    return job.manifest["status"]
+
+
+def merge_job(job: BatchJob, processed: Dict[str, ProcessedEmail]) -> Dict[str, int]:
+    """Merge a completed job's results into ``processed`` (modified in place).
+
+    Results that fail to parse, that errored or that are missing are
+    recorded in the manifest's ``errors`` and skipped, so those stages stay
+    stale and will be picked up by the next job unless they were rejected;
+    ``failed`` counts the emails with such a result or that could not be
+    merged, each once, and ``rejected`` the requests that won't be retried.
+    Emails already merged by an earlier run of this function are not merged
+    twice.
+    """
+    if job.status not in ("completed", "merged"):
+        raise RuntimeError(f"Batch job {job.id} is {job.status}, not completed")
+    fingerprints = job.manifest["prompt_fingerprints"]
+    already = set(job.manifest.get("merged", []))
+    outputs: Dict[str, Dict[str, str]] = {}
+    errors: Dict[str, dict] = {}
+    failed_ids = set()
+    for result in itertools.chain(_iter_jsonl(job.results_path), _iter_jsonl(job.errors_path)):
+        email_id, stage = _split_custom_id(result["custom_id"])
+        content = _response_content(result)
+        if content is None:
+            errors[result["custom_id"]] = _request_error(result)
+            failed_ids.add(email_id)
+            continue
+        outputs.setdefault(email_id, {})[stage] = content
+    for request in _iter_jsonl(job.requests_path):
+        email_id, stage = _split_custom_id(request["custom_id"])
+        if request["custom_id"] not in errors and stage not in outputs.get(email_id, {}):
+            errors[request["custom_id"]] = {"status": None, "code": "missing",
+                                            "message": "no result from the backend", "retry": True}
+            failed_ids.add(email_id)
+    for custom_id, error in errors.items():
+        log.warning("Batch job %s: %s failed (%s %s: %s)%s", job.id, custom_id, error["status"], error["code"],
+                    error["message"], "" if error["retry"] else "; rejected, not retrying")
+
+    merged = 0
+    for email_id, decided in job.manifest.get("rule_results", {}).items():
+        if email_id in already:
+            continue
+        processed[email_id] = ProcessedEmail(
+            email_id=email_id,
+            category=decided["category"],
+            action_items=[],
+            summary=None,
+            email_hash=job.manifest["email_hashes"][email_id],
+            prompt_fingerprints=dict(fingerprints),
+            provenance={s: decided["provenance"] for s in STAGES},
+        )
+        already.add(email_id)
+        merged += 1
+
+    for email_id, stage_outputs in outputs.items():
+        if email_id in already:
+            continue
+        previous = processed.get(email_id)
+        email_hash = job.manifest["email_hashes"].get(email_id)
+        # Fields not in this job come from the stored result, which must
+        # describe the same email content to be reused.
+        keep = previous if previous is not None and previous.email_hash == email_hash else None
+        if keep is None and set(stage_outputs) != set(STAGES):
+            failed_ids.add(email_id)
+            continue
+        prompt_fps = dict(keep.prompt_fingerprints) if keep is not None else {}
+        prompt_fps.update({s: fingerprints[s] for s in stage_outputs})
+        sources = {s: p for s, p in keep.provenance.items() if s not in stage_outputs} if keep is not None else {}
+        processed[email_id] = ProcessedEmail(
+            email_id=email_id,
+            category=_parse_category(stage_outputs["category"]) if "category" in stage_outputs else keep.category,
+            action_items=_parse_action_items(stage_outputs["action_items"])
+            if "action_items" in stage_outputs else keep.action_items,
+            summary=None,
+            email_hash=email_hash,
+            prompt_fingerprints=prompt_fps,
+            provenance=sources,
+        )
+        already.add(email_id)
+        merged += 1
+
+    job.manifest["merged"] = sorted(already)
+    job.manifest["errors"] = errors
+    job.manifest["status"] = "merged"
+    job.save()
+    return {"merged": merged, "failed": len(failed_ids), "rejected": sum(not e["retry"] for e in errors.values())}
+
+
+def list_jobs(jobs_dir: Path = DEFAULT_JOBS_DIR) -> Iterator[BatchJob]:
+    jobs_dir = Path(jobs_dir)
+    if not jobs_dir.exists():
+        return
+    for path in sorted(jobs_dir.iterdir()):
+        if (path / "manifest.json").exists():
+            yield BatchJob(path)
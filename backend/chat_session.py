@@ -0,0 +1,178 @@
+"""Multi-turn chat about one email.
+
+A :class:`ChatSession` keeps the conversation about an email so follow-up
+questions have context. Every request is laid out the same way:
+
+  1. a system message with the Prompt Brain instructions and the email
+     (the stable prefix: identical on every turn, so the provider's prompt
+     cache can skip reprocessing it)
+  2. a summary of older turns, if any (changes only when history is compacted)
+  3. the recent turns verbatim
+  4. the new question
+
+History is bounded: once there are more than ``EMAIL_AGENT_CHAT_MAX_TURNS``
+(6) turns or they exceed ``EMAIL_AGENT_CHAT_HISTORY_TOKENS`` (1500) tokens,
+the oldest turns are folded into the summary with one LLM call. Half the
+turns are folded at a time, so compaction (and the prefix change it causes)
+is rare.
+
+Sessions persist to ``data/chat_sessions/`` and continue across app reruns
+and restarts. A session is started afresh when the email's content changes.
+"""
+
+import hashlib
+import json
+import os
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from .agent import _chat_body, _chat_system_prompt
+from .fingerprints import email_fingerprint
+from .llm_client import run_chat, run_chat_stream, run_llm
+from .metrics import llm_caller, track_caller
+from .models import Email, Prompts
+from .preprocess import count_tokens, prepare_body
+
+DEFAULT_SESSIONS_DIR = Path("data") / "chat_sessions"
+DEFAULT_MAX_TURNS = 6
+DEFAULT_HISTORY_TOKENS = 1500
+
+_COMPACT_PROMPT = (
+    "You maintain a running summary of a conversation between a user and an email assistant "
+    "about one email. Merge the earlier summary and the new turns into one concise summary. "
+    "Keep facts, decisions, open questions and anything the user asked to remember. "
+    "Reply with the summary only."
+)
+
+
+def max_turns() -> int:
+    return max(1, int(os.getenv("EMAIL_AGENT_CHAT_MAX_TURNS", DEFAULT_MAX_TURNS)))
+
+
+def history_tokens() -> int:
+    return max(1, int(os.getenv("EMAIL_AGENT_CHAT_HISTORY_TOKENS", DEFAULT_HISTORY_TOKENS)))
+
+
+def _session_file(sessions_dir: Path, email_id: str) -> Path:
+    # Email ids come from mail sources and may not be valid file names
+    return Path(sessions_dir) / f"{hashlib.sha256(email_id.encode('utf-8')).hexdigest()[:24]}.json"
+
+
+def _turn_tokens(turn: Tuple[str, str]) -> int:
+    return count_tokens(turn[0]) + count_tokens(turn[1])
+
+
+class ChatSession:
+    """The conversation about ``email``; call :meth:`ask` or :meth:`ask_stream`."""
+
+    def __init__(self, email: Email, prompts: Prompts, path: Optional[Path] = None,
+                 summary: str = "", turns: Optional[List[Tuple[str, str]]] = None):
+        self.email = email
+        self.prompts = prompts
+        self.path = Path(path) if path is not None else None
+        self.summary = summary
+        self.turns: List[Tuple[str, str]] = list(turns or [])
+
+    def prefix(self) -> str:
+        """The stable system message: instructions plus the (capped) email."""
+        return (
+            f"{_chat_system_prompt(self.prompts)}\n"
+            f"EMAIL CONTENT:\nSubject: {self.email.subject}\nFrom: {self.email.sender}\n"
+            f"Body:\n{prepare_body(self.email.body).text}\n"
+        )
+
+    def messages(self, question: str) -> List[Dict[str, str]]:
+        """The request for ``question`` given the current history."""
+        messages = [{"role": "system", "content": self.prefix()}]
+        if self.summary:
+            messages.append({"role": "system", "content": f"Summary of the earlier conversation:\n{self.summary}"})
+        for asked, answered in self.turns:
+            messages.append({"role": "user", "content": asked})
+            messages.append({"role": "assistant", "content": answered})
+        content = question
+        if prepare_body(self.email.body).over_budget:
+            # The prefix only holds the start of a long email; add what the
+            # rest of it says about this question
+            content = f"{_chat_body(self.email, question)}\n\nUSER QUESTION:\n{question}"
+        messages.append({"role": "user", "content": content})
+        return messages
+
+    @track_caller("chat_session")
+    def ask(self, question: str) -> str:
+        answer = run_chat(self.messages(question))
+        self._record(question, answer)
+        return answer
+
+    @track_caller("chat_session")
+    def ask_stream(self, question: str) -> Iterator[str]:
+        """Yield the answer as it is generated; the turn is recorded once it completes."""
+        stream = run_chat_stream(self.messages(question))
+        return self._stream(question, stream)
+
+    def _stream(self, question: str, stream: Iterator[str]) -> Iterator[str]:
+        parts = []
+        for chunk in stream:
+            parts.append(chunk)
+            yield chunk
+        with llm_caller("chat_session"):
+            self._record(question, "".join(parts))
+
+    def _record(self, question: str, answer: str) -> None:
+        self.turns.append((question, answer))
+        self.compact()
+        if self.path is not None:
+            self.save()
+
+    def compact(self) -> bool:
+        """Fold the oldest turns into the summary if the history is over its bounds."""
+        limit, budget = max_turns(), history_tokens()
+        sizes = [_turn_tokens(t) for t in self.turns]
+        if len(self.turns) <= limit and sum(sizes) <= budget:
+            return False
+        keep = max(1, limit // 2)
+        while keep > 1 and sum(sizes[-keep:]) > budget:
+            keep -= 1
+        folded, self.turns = self.turns[:-keep], self.turns[-keep:]
+        if not folded:
+            return False
+        transcript = "\n".join(f"User: {q}\nAssistant: {a}" for q, a in folded)
+        with_summary = f"Earlier summary:\n{self.summary}\n\n" if self.summary else ""
+        self.summary = run_llm(_COMPACT_PROMPT, f"{with_summary}New turns:\n{transcript}").strip()
+        return True
+
+    def reset(self) -> None:
+        self.summary = ""
+        self.turns = []
+        if self.path is not None:
+            self.save()
+
+    def save(self) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        payload = {
+            "version": 1,
+            "email_id": self.email.id,
+            "email_hash": email_fingerprint(self.email),
+            "summary": self.summary,
+            "turns": [list(t) for t in self.turns],
+            "updated_at": datetime.utcnow().isoformat(),
+        }
+        tmp = self.path.with_suffix(".json.tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(payload, f, ensure_ascii=False, indent=2)
+        os.replace(tmp, self.path)
+
+
+def load_chat_session(email: Email, prompts: Prompts,
+                      sessions_dir: Path = DEFAULT_SESSIONS_DIR) -> ChatSession:
+    """The saved session for ``email``, or a new one if there is none or the email changed."""
+    path = _session_file(sessions_dir, email.id)
+    session = ChatSession(email, prompts, path)
+    if not path.exists():
+        return session
+    with open(path, "r", encoding="utf-8") as f:
+        payload = json.load(f)
+    if payload.get("version") == 1 and payload.get("email_hash") == email_fingerprint(email):
+        session.summary = payload.get("summary", "")
+        session.turns = [tuple(t) for t in payload.get("turns", [])]
+    return session
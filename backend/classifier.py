@@ -0,0 +1,270 @@
+"""Local category classifier trained on past LLM triage results.
+
+A multinomial naive Bayes model over hashed features (subject and body word
+unigrams and bigrams, plus the sender domain) learns the categories the LLM
+assigned under the current categorization prompt. During ingestion it answers
+categorization itself when its confidence reaches
+``EMAIL_AGENT_CLASSIFIER_THRESHOLD`` (0.9), and ``categorize_email`` is only
+called when it is unsure.
+
+Training data is every processed email whose category came from the LLM
+(no ``provenance`` entry) and whose category prompt fingerprint matches the
+current prompt. Rule- and classifier-derived labels are never learned from.
+:meth:`LocalClassifier.sync` adds new examples incrementally and retrains
+from scratch only when an already learned label changes.
+
+Every example is scored before it is learned (progressive validation), and
+the scores are kept per predicted category in confidence bins. That gives a
+precision estimate for any threshold without a separate test set; see
+:meth:`LocalClassifier.precision_report`.
+
+The model persists to ``data/classifier.json``. It stays inactive until it
+has seen ``EMAIL_AGENT_CLASSIFIER_MIN_EXAMPLES`` (50) examples. Set
+``EMAIL_AGENT_CLASSIFIER=0`` to turn it off.
+"""
+
+import json
+import math
+import os
+import re
+import threading
+import zlib
+from collections import Counter
+from pathlib import Path
+from typing import Dict, Iterable, List, Mapping, Optional, Tuple
+
+from .fingerprints import email_fingerprint, stage_fingerprints
+from .models import Email, ProcessedEmail, Prompts
+
+DEFAULT_CLASSIFIER_PATH = Path("data") / "classifier.json"
+DEFAULT_THRESHOLD = 0.9
+DEFAULT_MIN_EXAMPLES = 50
+
+NUM_FEATURES = 1 << 18
+CONFIDENCE_BINS = 20
+_ALPHA = 0.1  # additive smoothing
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+
+def classifier_enabled() -> bool:
+    return os.getenv("EMAIL_AGENT_CLASSIFIER", "1").strip().lower() not in ("0", "false", "no", "off")
+
+
+def classifier_threshold() -> float:
+    return float(os.getenv("EMAIL_AGENT_CLASSIFIER_THRESHOLD", DEFAULT_THRESHOLD))
+
+
+def min_examples() -> int:
+    return int(os.getenv("EMAIL_AGENT_CLASSIFIER_MIN_EXAMPLES", DEFAULT_MIN_EXAMPLES))
+
+
+def _hash(token: str) -> int:
+    # crc32 rather than hash(): it must be stable across processes
+    return zlib.crc32(token.encode("utf-8")) & (NUM_FEATURES - 1)
+
+
+def features(email: Email) -> Counter:
+    """Hashed feature counts for ``email``."""
+    counts: Counter = Counter()
+    for prefix, text in (("s", email.subject or ""), ("b", email.body or "")):
+        tokens = _TOKEN_RE.findall(text.lower())
+        counts.update(_hash(f"{prefix}:{t}") for t in tokens)
+        counts.update(_hash(f"{prefix}:{a} {b}") for a, b in zip(tokens, tokens[1:]))
+    domain = (email.sender or "").lower().rpartition("@")[2].strip("> ")
+    if domain:
+        counts[_hash(f"d:{domain}")] += 1
+    return counts
+
+
+def _bin(confidence: float) -> int:
+    return min(CONFIDENCE_BINS - 1, int(confidence * CONFIDENCE_BINS))
+
+
+def llm_label(result: ProcessedEmail, prompt_fingerprint: str) -> Optional[str]:
+    """The category of ``result`` if it is usable as a training label."""
+    if "category" in result.provenance or not result.category:
+        return None
+    if result.prompt_fingerprints.get("category") != prompt_fingerprint:
+        return None
+    return result.category
+
+
+class LocalClassifier:
+    """Incrementally trained naive Bayes category model."""
+
+    def __init__(self, prompt_fingerprint: str = ""):
+        self._lock = threading.RLock()
+        self._reset_locked(prompt_fingerprint)
+
+    def _reset_locked(self, prompt_fingerprint: str) -> None:
+        self.prompt_fingerprint = prompt_fingerprint
+        self._docs: Dict[str, int] = {}
+        self._tokens: Dict[str, int] = {}
+        self._counts: Dict[str, Dict[int, int]] = {}
+        self._vocab: set = set()
+        # email id -> (email hash, label) for every learned example
+        self._trained: Dict[str, Tuple[str, str]] = {}
+        # predicted category -> [[scored, correct] per confidence bin]
+        self._calibration: Dict[str, List[List[int]]] = {}
+
+    def __len__(self) -> int:
+        return len(self._trained)
+
+    def _scores_locked(self, feats: Counter) -> Dict[str, float]:
+        total_docs = sum(self._docs.values())
+        vocab = len(self._vocab) + 1
+        log_probs = {}
+        for label, docs in self._docs.items():
+            counts = self._counts[label]
+            denom = math.log(self._tokens[label] + _ALPHA * vocab)
+            score = math.log(docs / total_docs)
+            for f, n in feats.items():
+                score += n * (math.log(counts.get(f, 0) + _ALPHA) - denom)
+            log_probs[label] = score
+        top = max(log_probs.values())
+        exp = {label: math.exp(s - top) for label, s in log_probs.items()}
+        norm = sum(exp.values())
+        return {label: v / norm for label, v in exp.items()}
+
+    def _learn_locked(self, email_id: str, email_hash: str, feats: Counter, label: str) -> None:
+        if self._docs:
+            probs = self._scores_locked(feats)
+            predicted = max(probs, key=probs.get)
+            bins = self._calibration.setdefault(predicted, [[0, 0] for _ in range(CONFIDENCE_BINS)])
+            cell = bins[_bin(probs[predicted])]
+            cell[0] += 1
+            cell[1] += predicted == label
+        counts = self._counts.setdefault(label, {})
+        for f, n in feats.items():
+            counts[f] = counts.get(f, 0) + n
+        self._vocab.update(feats)
+        self._docs[label] = self._docs.get(label, 0) + 1
+        self._tokens[label] = self._tokens.get(label, 0) + sum(feats.values())
+        self._trained[email_id] = (email_hash, label)
+
+    def sync(self, emails: Iterable[Email], processed: Mapping[str, ProcessedEmail],
+             prompt_fingerprint: str) -> int:
+        """Learn every new usable label; returns the number of examples learned.
+
+        Retrains from scratch when the category prompt changed or a learned
+        example was edited or relabelled. Examples missing from ``emails``
+        are kept.
+        """
+        with self._lock:
+            examples = {}
+            for email in emails:
+                result = processed.get(email.id)
+                label = llm_label(result, prompt_fingerprint) if result is not None else None
+                if label is not None:
+                    examples[email.id] = (email, email_fingerprint(email), label)
+            stale = prompt_fingerprint != self.prompt_fingerprint or any(
+                i in examples and examples[i][1:] != key for i, key in self._trained.items()
+            )
+            if stale:
+                self._reset_locked(prompt_fingerprint)
+            learned = 0
+            for email_id, (email, email_hash, label) in examples.items():
+                if email_id not in self._trained:
+                    self._learn_locked(email_id, email_hash, features(email), label)
+                    learned += 1
+            return learned
+
+    def predict(self, email: Email) -> Optional[Tuple[str, float]]:
+        """(category, confidence) or None while the model has too few examples."""
+        with self._lock:
+            if len(self._trained) < min_examples() or len(self._docs) < 2:
+                return None
+            probs = self._scores_locked(features(email))
+        label = max(probs, key=probs.get)
+        return label, probs[label]
+
+    def precision_report(self, threshold: Optional[float] = None) -> Dict[str, Dict[str, float]]:
+        """Per predicted category: how often it was right at ``threshold``.
+
+        ``answered`` counts validation predictions at or above the threshold,
+        ``coverage`` is their share of all predictions of that category.
+        """
+        threshold = classifier_threshold() if threshold is None else threshold
+        first = _bin(threshold) if threshold < 1 else CONFIDENCE_BINS - 1
+        report = {}
+        with self._lock:
+            for label, bins in sorted(self._calibration.items()):
+                answered = sum(b[0] for b in bins[first:])
+                correct = sum(b[1] for b in bins[first:])
+                total = sum(b[0] for b in bins)
+                report[label] = {
+                    "answered": answered,
+                    "correct": correct,
+                    "precision": correct / answered if answered else None,
+                    "coverage": answered / total if total else 0.0,
+                    "examples": self._docs.get(label, 0),
+                }
+        return report
+
+    def save(self, path: Path = DEFAULT_CLASSIFIER_PATH) -> None:
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix(path.suffix + ".tmp")
+        with self._lock:
+            payload = {
+                "version": 1,
+                "prompt_fingerprint": self.prompt_fingerprint,
+                "classes": {
+                    label: {"docs": self._docs[label], "tokens": self._tokens[label],
+                            "counts": {str(f): n for f, n in self._counts[label].items()}}
+                    for label in self._docs
+                },
+                "trained": {i: list(key) for i, key in self._trained.items()},
+                "calibration": self._calibration,
+            }
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(payload, f)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: Path = DEFAULT_CLASSIFIER_PATH) -> "LocalClassifier":
+        path = Path(path)
+        if not path.exists():
+            return cls()
+        with open(path, "r", encoding="utf-8") as f:
+            payload = json.load(f)
+        if payload.get("version") != 1:
+            return cls()
+        model = cls(payload.get("prompt_fingerprint", ""))
+        for label, data in payload.get("classes", {}).items():
+            model._docs[label] = data["docs"]
+            model._tokens[label] = data["tokens"]
+            model._counts[label] = {int(f): n for f, n in data["counts"].items()}
+            model._vocab.update(model._counts[label])
+        model._trained = {i: tuple(key) for i, key in payload.get("trained", {}).items()}
+        model._calibration = payload.get("calibration", {})
+        return model
+
+
+_classifier: Optional[LocalClassifier] = None
+_classifier_lock = threading.Lock()
+
+
+def get_classifier(path: Path = DEFAULT_CLASSIFIER_PATH) -> Optional[LocalClassifier]:
+    """Return the process-wide classifier (None when disabled), loading it on first use."""
+    global _classifier
+    if not classifier_enabled():
+        return None
+    with _classifier_lock:
+        if _classifier is None:
+            _classifier = LocalClassifier.load(path)
+        return _classifier
+
+
+def update_classifier(emails: Iterable[Email], processed: Mapping[str, ProcessedEmail],
+                      prompts: Prompts, path: Path = DEFAULT_CLASSIFIER_PATH) -> int:
+    """Sync the shared classifier with the processed store and save it if it changed."""
+    model = get_classifier(path)
+    if model is None:
+        return 0
+    before = (len(model), model.prompt_fingerprint)
+    learned = model.sync(emails, processed, stage_fingerprints(prompts)["category"])
+    if learned or (len(model), model.prompt_fingerprint) != before:
+        model.save(path)
+    return learned
@@ -0,0 +1,136 @@
+"""Memoized, read-only views of the stores for the Streamlit app.
+
+Streamlit re-runs ``app.py`` top to bottom on every interaction, and every
+session runs in the same process. The getters here parse each store once and
+hand every rerun and every session the same immutable snapshot (the inbox
+index, a read-only mapping of processed results) until the store changes.
+The app reads the inbox through :func:`get_inbox`, which keeps headers in
+compact columns and loads bodies on demand; :func:`get_emails` holds every
+email in full and is meant for small inboxes and scripts.
+
+A snapshot is invalidated when either
+  - a write goes through ``backend.storage`` in this process (its version
+    counter moves), or
+  - one of the store's backing files changes on disk (mtime/size), which
+    covers writes from other processes such as the ingestion scripts.
+"""
+
+import threading
+from pathlib import Path
+from types import MappingProxyType
+from typing import Any, Callable, Dict, Mapping, Tuple
+
+from . import storage
+from .inbox_index import InboxIndex
+from .models import Email, ProcessedEmail, Prompts
+from .search_index import SearchIndex, get_search_index
+from .threads import ThreadIndex, get_thread_index
+
+
+def _file_stamp(path: Path) -> Tuple:
+    try:
+        st = path.stat()
+    except OSError:
+        return (str(path), None)
+    stamp = (str(path), st.st_mtime_ns, st.st_size)
+    if path.is_dir():
+        # Maildir: delivering or removing a message touches cur/ or new/
+        for sub in ("cur", "new"):
+            stamp += _file_stamp(path / sub)
+    return stamp
+
+
+def stamp(name: str) -> Tuple:
+    """Current version key of store ``name`` (emails, prompts, processed, drafts)."""
+    version = storage.store_version(name) if name != "emails" else 0
+    return (version,) + tuple(_file_stamp(p) for p in storage.backing_files(name))
+
+
+class _Memo:
+    def __init__(self):
+        # Re-entrant: a loader may read another memoized slot (see get_email_map)
+        self._lock = threading.RLock()
+        self._entries: Dict[str, Tuple[Tuple, Any]] = {}
+
+    def get(self, name: str, loader: Callable[[], Any], slot: str = "") -> Any:
+        """Return the value memoized under ``slot`` while store ``name`` is unchanged."""
+        slot = slot or name
+        key = stamp(name)
+        entry = self._entries.get(slot)
+        if entry is not None and entry[0] == key:
+            return entry[1]
+        with self._lock:
+            entry = self._entries.get(slot)
+            if entry is None or entry[0] != key:
+                entry = (key, loader())
+                self._entries[slot] = entry
+            return entry[1]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+_memo = _Memo()
+
+
+def get_emails() -> Tuple[Email, ...]:
+    return _memo.get("emails", lambda: tuple(storage.load_emails()))
+
+
+def get_email_map() -> Mapping[str, Email]:
+    """Read-only id -> Email lookup over :func:`get_emails`."""
+    return _memo.get("emails", lambda: MappingProxyType({e.id: e for e in get_emails()}), slot="email_map")
+
+
+def get_inbox() -> InboxIndex:
+    """Columnar index of the inbox; message bodies are read from the source on demand."""
+    return _memo.get("emails", lambda: InboxIndex.open(storage.inbox_path()), slot="inbox")
+
+
+def get_processed() -> Mapping[str, ProcessedEmail]:
+    return _memo.get("processed", lambda: MappingProxyType(storage.load_processed()))
+
+
+def get_prompts() -> Prompts:
+    return _memo.get("prompts", storage.load_prompts)
+
+
+def get_draft_count() -> int:
+    return _memo.get("drafts", storage.count_drafts)
+
+
+# Store stamps the indexes were last synced to
+_indexed: Dict[str, Tuple] = {}
+_indexed_lock = threading.Lock()
+
+
+def get_indexes() -> Tuple[SearchIndex, ThreadIndex]:
+    """Return the search and thread indexes, synced to the current snapshots.
+
+    When the inbox changed, its refs are walked and only new or changed
+    messages are read from the source. When only the processed results
+    changed, the new categories are applied without reading any body. The
+    search index is saved at most every ``EMAIL_AGENT_INDEX_SAVE_SECONDS``.
+    """
+    search_index, thread_index = get_search_index(), get_thread_index()
+    emails_key, processed_key = stamp("emails"), stamp("processed")
+    if emails_key != _indexed.get("emails") or processed_key != _indexed.get("processed"):
+        with _indexed_lock:
+            processed = get_processed()
+            if emails_key != _indexed.get("emails"):
+                inbox = get_inbox()
+                search_index.sync_refs(inbox.refs(), inbox.source.load, processed)
+                if thread_index.sync_refs(inbox.refs(), inbox.source.load):
+                    thread_index.save()
+            elif processed_key != _indexed.get("processed"):
+                search_index.sync_categories(processed)
+            _indexed.update(emails=emails_key, processed=processed_key)
+    search_index.save_if_due()
+    return search_index, thread_index
+
+
+def invalidate() -> None:
+    """Drop every memoized snapshot."""
+    _memo.clear()
+    _indexed.clear()
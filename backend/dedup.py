@@ -0,0 +1,300 @@
+"""Near-duplicate detection for templated mail.
+
+Notifications, newsletters and other automated mail arrive as many copies of
+one template. During ingestion every email's subject and body are reduced to
+word 3-gram shingles (digits folded, so order numbers and dates don't
+matter), and from those to
+
+  - a 64-bit SimHash, indexed with LSH banding: the hash is cut into
+    ``max_distance + 1`` bands, so any two emails within
+    ``EMAIL_AGENT_DEDUP_MAX_DISTANCE`` (6) differing bits share at least one
+    band bucket;
+  - a small MinHash signature, used to verify a candidate by its estimated
+    Jaccard similarity (at least ``EMAIL_AGENT_DEDUP_MIN_JACCARD``, 0.8; set
+    it to 0 to skip verification).
+
+A new email that matches an already processed one reuses its category, and
+the result's provenance names the email it was copied from. Its action items
+are reused too when both emails carry the same numbers (order numbers,
+amounts, dates); otherwise they are extracted afresh, since a deadline or an
+invoice number copied from another email would be wrong. Emails with fewer than ``MIN_SHINGLES`` shingles are too short to
+compare reliably and are never matched.
+
+The index persists to ``data/dedup_index.json``. Set ``EMAIL_AGENT_DEDUP=0``
+to turn reuse off.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, Iterable, List, Mapping, Optional, Set, Tuple
+
+from .fingerprints import email_fingerprint
+from .models import Email, ProcessedEmail
+
+log = logging.getLogger(__name__)
+
+DEFAULT_DEDUP_PATH = Path("data") / "dedup_index.json"
+# Emails have few shingles, so their SimHashes are coarser than those of web
+# pages (where 3 bits is usual); copies of a template differ by up to ~6.
+DEFAULT_MAX_DISTANCE = 6
+DEFAULT_MIN_JACCARD = 0.8
+MIN_SHINGLES = 8
+SIGNATURE_SIZE = 32
+# Bulk templates can fill a bucket with thousands of ids; near-identical
+# copies are found among the first few anyway.
+MAX_CANDIDATES = 64
+
+_TOKEN_RE = re.compile(r"[a-z0-9#]+")
+_DIGITS_RE = re.compile(r"\d+")
+_NUMBER_TOKEN_RE = re.compile(r"[a-z0-9]*\d[a-z0-9]*")
+_PRIME = (1 << 61) - 1
+_MASK32 = (1 << 32) - 1
+# Fixed MinHash permutations (a * x + b mod p), derived deterministically
+_PERMUTATIONS = [
+    (int.from_bytes(hashlib.blake2b(f"a{i}".encode(), digest_size=8).digest(), "big") % (_PRIME - 1) + 1,
+     int.from_bytes(hashlib.blake2b(f"b{i}".encode(), digest_size=8).digest(), "big") % _PRIME)
+    for i in range(SIGNATURE_SIZE)
+]
+
+
+def dedup_enabled() -> bool:
+    return os.getenv("EMAIL_AGENT_DEDUP", "1").strip().lower() not in ("0", "false", "no", "off")
+
+
+def max_distance() -> int:
+    return max(0, int(os.getenv("EMAIL_AGENT_DEDUP_MAX_DISTANCE", DEFAULT_MAX_DISTANCE)))
+
+
+def min_jaccard() -> float:
+    return float(os.getenv("EMAIL_AGENT_DEDUP_MIN_JACCARD", DEFAULT_MIN_JACCARD))
+
+
+def shingles(email: Email) -> Set[int]:
+    """64-bit hashes of the word 3-grams of subject and body, digits folded to ``#``."""
+    text = _DIGITS_RE.sub("#", f"{email.subject}\n{email.body}".lower())
+    tokens = _TOKEN_RE.findall(text)
+    grams = (" ".join(tokens[i:i + 3]) for i in range(max(1, len(tokens) - 2))) if tokens else ()
+    return {int.from_bytes(hashlib.blake2b(g.encode("utf-8"), digest_size=8).digest(), "big") for g in grams}
+
+
+def digits_key(email: Email) -> int:
+    """Hash of the digit-bearing tokens of subject and body, in order."""
+    tokens = _NUMBER_TOKEN_RE.findall(f"{email.subject}\n{email.body}".lower())
+    return int.from_bytes(hashlib.blake2b(" ".join(tokens).encode("utf-8"), digest_size=8).digest(), "big")
+
+
+def simhash(hashes: Iterable[int]) -> int:
+    # Count set bits column-wise over the binary strings (fast in CPython)
+    rows = [format(h, "064b") for h in hashes]
+    if not rows:
+        return 0
+    half = len(rows) / 2
+    value = 0
+    for column in zip(*rows):
+        value = (value << 1) | (column.count("1") > half)
+    return value
+
+
+def minhash(hashes: Iterable[int]) -> List[int]:
+    values = [h & _MASK32 for h in hashes]
+    return [min((a * x + b) % _PRIME for x in values) & _MASK32 for a, b in _PERMUTATIONS]
+
+
+def estimated_jaccard(a: List[int], b: List[int]) -> float:
+    return sum(x == y for x, y in zip(a, b)) / len(a)
+
+
+@dataclass
+class Duplicate:
+    email_id: str
+    distance: int
+    similarity: float
+    # Whether both emails carry the same numbers, so number-bearing fields
+    # such as action items can be reused as well
+    same_digits: bool = False
+
+    def provenance(self) -> Dict:
+        return {"source": "duplicate", "of": self.email_id, "distance": self.distance,
+                "similarity": round(self.similarity, 3)}
+
+
+class DedupIndex:
+    """SimHash/LSH index of processed emails."""
+
+    def __init__(self, max_distance: int = DEFAULT_MAX_DISTANCE):
+        self._lock = threading.RLock()
+        self.max_distance = max_distance
+        # email id -> (email hash, simhash, minhash signature, digits key)
+        self._entries: Dict[str, Tuple[str, int, List[int], Optional[int]]] = {}
+        self._dirty = False
+        self._reset_buckets_locked()
+
+    def _reset_buckets_locked(self) -> None:
+        bands = self.max_distance + 1
+        width = 64 // bands
+        self._bands = [(i * width, width if i < bands - 1 else 64 - i * width) for i in range(bands)]
+        self._buckets: Dict[Tuple[int, int], List[str]] = {}
+        for email_id, (_h, value, _sig, _digits) in self._entries.items():
+            self._bucket_locked(email_id, value)
+
+    def _keys(self, value: int) -> List[Tuple[int, int]]:
+        return [(i, (value >> start) & ((1 << width) - 1)) for i, (start, width) in enumerate(self._bands)]
+
+    def _bucket_locked(self, email_id: str, value: int) -> None:
+        for key in self._keys(value):
+            self._buckets.setdefault(key, []).append(email_id)
+
+    def _unbucket_locked(self, email_id: str, value: int) -> None:
+        for key in self._keys(value):
+            ids = self._buckets.get(key)
+            if ids and email_id in ids:
+                ids.remove(email_id)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, email_id: str) -> bool:
+        return email_id in self._entries
+
+    def set_max_distance(self, distance: int) -> None:
+        with self._lock:
+            if distance != self.max_distance:
+                self.max_distance = distance
+                self._reset_buckets_locked()
+
+    def add(self, email: Email, email_hash: Optional[str] = None) -> None:
+        """Index ``email`` (a no-op when it is already indexed with the same content)."""
+        email_hash = email_hash or email_fingerprint(email)
+        entry = self._entries.get(email.id)
+        if entry is not None and entry[0] == email_hash:
+            return
+        hashes = shingles(email)
+        with self._lock:
+            if entry is not None:
+                self._unbucket_locked(email.id, entry[1])
+                del self._entries[email.id]
+            self._dirty = True
+            if len(hashes) < MIN_SHINGLES:
+                return
+            value = simhash(hashes)
+            self._entries[email.id] = (email_hash, value, minhash(hashes), digits_key(email))
+            self._bucket_locked(email.id, value)
+
+    def remove(self, email_id: str) -> None:
+        with self._lock:
+            entry = self._entries.pop(email_id, None)
+            if entry is not None:
+                self._unbucket_locked(email_id, entry[1])
+                self._dirty = True
+
+    def export(self, email_ids: Iterable[str]) -> Dict[str, Optional[list]]:
+        """Entries of ``email_ids`` for :meth:`merge` in another process (None when not indexed)."""
+        with self._lock:
+            return {i: list(self._entries[i]) if i in self._entries else None for i in email_ids}
+
+    def merge(self, entries: Mapping[str, Optional[list]]) -> None:
+        """Apply entries exported by another index; None removes the email."""
+        with self._lock:
+            for email_id, entry in entries.items():
+                new = (entry[0], entry[1], list(entry[2]), entry[3]) if entry is not None else None
+                old = self._entries.get(email_id)
+                if old == new:
+                    continue
+                if old is not None:
+                    self._unbucket_locked(email_id, old[1])
+                    del self._entries[email_id]
+                if new is not None:
+                    self._entries[email_id] = new
+                    self._bucket_locked(email_id, new[1])
+                self._dirty = True
+
+    def candidates(self, email: Email, threshold: Optional[float] = None) -> List[Duplicate]:
+        """Indexed emails near ``email``, closest first."""
+        threshold = min_jaccard() if threshold is None else threshold
+        hashes = shingles(email)
+        if len(hashes) < MIN_SHINGLES:
+            return []
+        value = simhash(hashes)
+        signature = minhash(hashes) if threshold > 0 else None
+        digits = digits_key(email)
+        found: Dict[str, Duplicate] = {}
+        with self._lock:
+            for key in self._keys(value):
+                for other in self._buckets.get(key, ())[:MAX_CANDIDATES]:
+                    if other == email.id or other in found:
+                        continue
+                    _h, other_value, other_sig, other_digits = self._entries[other]
+                    distance = bin(value ^ other_value).count("1")
+                    if distance > self.max_distance:
+                        continue
+                    similarity = estimated_jaccard(signature, other_sig) if signature else 1.0
+                    if similarity >= threshold:
+                        found[other] = Duplicate(other, distance, similarity, digits == other_digits)
+        return sorted(found.values(), key=lambda d: (d.distance, -d.similarity))
+
+    def find_reusable(self, email: Email, processed: Mapping[str, ProcessedEmail],
+                      current: Dict[str, str], stages: Iterable[str]) -> Optional[Tuple[Duplicate, ProcessedEmail]]:
+        """The closest duplicate whose stored result is still valid for ``stages``.
+
+        The result must describe the content that was indexed and carry the
+        current prompt fingerprint for every stage to be reused.
+        """
+        for dup in self.candidates(email):
+            result = processed.get(dup.email_id)
+            if result is None or result.email_hash != self._entries[dup.email_id][0]:
+                continue
+            if all(result.prompt_fingerprints.get(s) == current[s] for s in stages):
+                return dup, result
+        return None
+
+    def save(self, path: Path = DEFAULT_DEDUP_PATH) -> None:
+        path = Path(path)
+        with self._lock:
+            if not self._dirty and path.exists():
+                return
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = path.with_suffix(path.suffix + ".tmp")
+            payload = {"version": 1, "entries": {i: list(e) for i, e in self._entries.items()}}
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(payload, f)
+            os.replace(tmp, path)
+            self._dirty = False
+
+    @classmethod
+    def load(cls, path: Path = DEFAULT_DEDUP_PATH, max_distance: int = DEFAULT_MAX_DISTANCE) -> "DedupIndex":
+        index = cls(max_distance)
+        path = Path(path)
+        if not path.exists():
+            return index
+        with open(path, "r", encoding="utf-8") as f:
+            payload = json.load(f)
+        if payload.get("version") == 1:
+            with index._lock:
+                # Entries saved before digits keys existed never match on digits
+                index._entries = {i: (e[0], e[1], e[2], e[3] if len(e) > 3 else None)
+                                  for i, e in payload.get("entries", {}).items()}
+                index._reset_buckets_locked()
+        return index
+
+
+_index: Optional[DedupIndex] = None
+_index_lock = threading.Lock()
+
+
+def get_dedup_index(path: Path = DEFAULT_DEDUP_PATH) -> Optional[DedupIndex]:
+    """Return the process-wide index (None when reuse is disabled), loading it on first use."""
+    global _index
+    if not dedup_enabled():
+        return None
+    with _index_lock:
+        if _index is None:
+            _index = DedupIndex.load(path, max_distance())
+        else:
+            _index.set_max_distance(max_distance())
+        return _index
@@ -0,0 +1,62 @@
+"""Content fingerprints used to decide what needs re-processing.
+
+An email's fingerprint covers the fields that reach the LLM; a prompt
+fingerprint covers the instruction text for one triage stage. Both are stored
+on ``ProcessedEmail`` so ingestion can redo only the stale stage of only the
+changed emails.
+"""
+
+import hashlib
+from typing import Dict, Optional, Set
+
+from .models import Email, Prompts, ProcessedEmail
+
+# Triage stages, named after the ProcessedEmail field each one fills in.
+STAGES = ("category", "action_items")
+
+
+def _digest(*parts: str) -> str:
+    h = hashlib.sha256()
+    for part in parts:
+        h.update(part.encode("utf-8"))
+        h.update(b"\0")
+    return h.hexdigest()[:16]
+
+
+def email_fingerprint(email: Email) -> str:
+    return _digest(email.sender, email.subject, email.body)
+
+
+def prompt_fingerprint(prompt: str) -> str:
+    return _digest(prompt)
+
+
+def draft_fingerprint(email: Email, prompts: Prompts, tone: str = "") -> str:
+    """Fingerprint of a reply draft's inputs: the email, the auto-reply prompt and the tone."""
+    return _digest(email_fingerprint(email), prompts.auto_reply_prompt, tone.strip())
+
+
+def stage_fingerprints(prompts: Prompts) -> Dict[str, str]:
+    """Map each triage stage to the fingerprint of the prompt that drives it."""
+    return {
+        "category": prompt_fingerprint(prompts.categorization_prompt),
+        "action_items": prompt_fingerprint(prompts.action_item_prompt),
+    }
+
+
+def stale_stages(email: Email, current: Dict[str, str], previous: Optional[ProcessedEmail],
+                 rules_fingerprint: Optional[str] = None) -> Set[str]:
+    """Return the stages whose stored result no longer matches the email or prompts.
+
+    ``current`` is the output of :func:`stage_fingerprints` for the prompts in use.
+    ``rules_fingerprint`` is that of the rule set in use (None when rules are
+    off); fields derived from a different rule set are stale too.
+    """
+    if previous is None or previous.email_hash != email_fingerprint(email):
+        return set(STAGES)
+    stale = {s for s in STAGES if previous.prompt_fingerprints.get(s) != current[s]}
+    stale |= {
+        s for s, p in previous.provenance.items()
+        if s in STAGES and p.get("source") == "rule" and p.get("rules") != rules_fingerprint
+    }
+    return stale
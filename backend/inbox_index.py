@@ -0,0 +1,204 @@
+"""Compact, columnar index of the inbox for the UI.
+
+Holding every :class:`Email` in memory costs its body plus five string
+objects per message. :class:`InboxIndex` keeps only what the inbox list
+shows -- id, sender, subject and timestamp -- in a few flat arrays, plus
+where each message lives in its source, and reads a message (body included)
+from the source when it is opened, through :meth:`MailSource.load`:
+
+  - id, subject and timestamp are each one UTF-8 buffer with an array of
+    end offsets;
+  - senders are stored once each in a table and referenced by array codes;
+  - row numbers sorted by id give O(log n) lookups without an id -> row dict;
+  - source locations (JSON array index, JSONL offset and length, mbox key
+    or Maildir key) are packed into integer arrays or a text column.
+
+That is roughly the UTF-8 size of those fields plus ~30 bytes per message.
+The most recently opened emails are cached (``EMAIL_AGENT_INBOX_CACHE``,
+128). A ``.json`` array source keeps the parsed array in memory, so use
+JSONL, mbox or Maildir for large inboxes.
+"""
+
+import os
+import threading
+from array import array
+from bisect import bisect_left
+from collections import OrderedDict
+from collections.abc import Sequence
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+from .mail_sources import EmailRef, MailSource, open_source
+from .models import Email
+
+DEFAULT_CACHE_SIZE = 128
+
+
+class TextColumn(Sequence):
+    """Append-only column of strings packed into one UTF-8 buffer."""
+
+    def __init__(self):
+        self._data = bytearray()
+        # 32-bit offsets until the buffer outgrows them
+        self._ends = array("I")
+
+    def append(self, text: str) -> None:
+        self._data += text.encode("utf-8")
+        if len(self._data) > 0xFFFFFFFF and self._ends.typecode == "I":
+            self._ends = array("Q", self._ends)
+        self._ends.append(len(self._data))
+
+    def freeze(self) -> None:
+        """Drop the buffer's spare capacity once the column is complete."""
+        self._data = bytes(self._data)
+
+    def __len__(self) -> int:
+        return len(self._ends)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        start = self._ends[i - 1] if i else 0
+        return self._data[start:self._ends[i]].decode("utf-8")
+
+    @property
+    def nbytes(self) -> int:
+        return len(self._data) + self._ends.itemsize * len(self._ends)
+
+
+class _LocationColumn:
+    """Where each message sits in its source; one kind per source."""
+
+    def __init__(self):
+        self._kind: Optional[type] = None
+        self._first = array("q")
+        self._second = array("q")
+        self._keys = TextColumn()
+
+    def append(self, location: Any) -> None:
+        kind = type(location)
+        if self._kind is None:
+            self._kind = kind
+        elif kind is not self._kind:
+            raise TypeError(f"Mixed source locations: {self._kind.__name__} and {kind.__name__}")
+        if kind is int:
+            self._first.append(location)
+        elif kind is tuple:
+            self._first.append(location[0])
+            self._second.append(location[1])
+        elif kind is str:
+            self._keys.append(location)
+        else:
+            raise TypeError(f"Unsupported source location {location!r}")
+
+    def freeze(self) -> None:
+        self._keys.freeze()
+
+    def __getitem__(self, i: int) -> Any:
+        if self._kind is int:
+            return self._first[i]
+        if self._kind is tuple:
+            return (self._first[i], self._second[i])
+        return self._keys[i]
+
+    @property
+    def nbytes(self) -> int:
+        return (self._first.itemsize * (len(self._first) + len(self._second))) + self._keys.nbytes
+
+
+def _cache_size() -> int:
+    return max(0, int(os.getenv("EMAIL_AGENT_INBOX_CACHE", DEFAULT_CACHE_SIZE)))
+
+
+class InboxIndex:
+    """Headers of every inbox message in columns; bodies stay in the source."""
+
+    def __init__(self, source: MailSource, refs: Iterable[EmailRef]):
+        self.source = source
+        self._ids = TextColumn()
+        self._subjects = TextColumn()
+        self._timestamps = TextColumn()
+        self._locations = _LocationColumn()
+        self._senders: List[str] = []
+        self._sender_codes = array("I")
+        codes: Dict[str, int] = {}
+        for ref in refs:
+            self._ids.append(ref.id)
+            self._subjects.append(ref.subject)
+            self._timestamps.append(ref.timestamp)
+            self._locations.append(ref.location)
+            code = codes.get(ref.sender)
+            if code is None:
+                code = codes[ref.sender] = len(self._senders)
+                self._senders.append(ref.sender)
+            self._sender_codes.append(code)
+        for column in (self._ids, self._subjects, self._timestamps, self._locations):
+            column.freeze()
+        # Stable, so the first of several messages sharing an id is found
+        self._order = array("I", sorted(range(len(self._ids)), key=self._ids.__getitem__))
+        self._cache: "OrderedDict[int, Email]" = OrderedDict()
+        self._cache_lock = threading.Lock()
+
+    @classmethod
+    def open(cls, path) -> "InboxIndex":
+        source = open_source(Path(path))
+        return cls(source, source.refs())
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def __contains__(self, email_id: object) -> bool:
+        return isinstance(email_id, str) and self.position(email_id) is not None
+
+    @property
+    def ids(self) -> TextColumn:
+        """Every id in source order, as a read-only sequence (no copy)."""
+        return self._ids
+
+    def position(self, email_id: str) -> Optional[int]:
+        """Row of ``email_id`` in source order, or None."""
+        i = bisect_left(self._order, email_id, key=self._ids.__getitem__)
+        if i < len(self._order) and self._ids[self._order[i]] == email_id:
+            return self._order[i]
+        return None
+
+    def ref(self, row: int) -> EmailRef:
+        """Headers of the message at ``row``, without reading its body."""
+        return EmailRef(
+            id=self._ids[row],
+            sender=self._senders[self._sender_codes[row]],
+            subject=self._subjects[row],
+            timestamp=self._timestamps[row],
+            location=self._locations[row],
+        )
+
+    def refs(self) -> Iterator[EmailRef]:
+        """Headers of every message in source order, without reading bodies."""
+        return (self.ref(row) for row in range(len(self)))
+
+    def get(self, email_id: str) -> Optional[Email]:
+        """The full email, read from the source on first use."""
+        row = self.position(email_id)
+        if row is None:
+            return None
+        with self._cache_lock:
+            email = self._cache.get(row)
+            if email is not None:
+                self._cache.move_to_end(row)
+                return email
+        email = self.source.load(self.ref(row))
+        limit = _cache_size()
+        with self._cache_lock:
+            self._cache[row] = email
+            while len(self._cache) > limit:
+                self._cache.popitem(last=False)
+        return email
+
+    @property
+    def nbytes(self) -> int:
+        """Approximate memory held by the columns (the sender table excluded)."""
+        return (self._ids.nbytes + self._subjects.nbytes + self._timestamps.nbytes
+                + self._locations.nbytes + self._sender_codes.itemsize * len(self._sender_codes)
+                + self._order.itemsize * len(self._order))
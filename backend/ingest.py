@@ -0,0 +1,346 @@
+"""Concurrent ingestion pipeline.
+
+Runs categorization and action-item extraction for many emails at once with a
+bounded number of LLM requests in flight. Results are written into the
+``processed`` mapping as soon as each email finishes, and an optional
+``on_result`` callback lets callers (the Streamlit progress bar, the CLI)
+react to every completed email.
+
+The concurrency limit defaults to ``EMAIL_AGENT_INGEST_CONCURRENCY`` (8).
+Setting ``EMAIL_AGENT_FUSED_TRIAGE=1`` (or passing ``fused=True``) makes each
+email cost one combined triage call instead of two.
+
+With ``incremental=True`` only stale work is redone: an email whose content
+hash and prompt fingerprints match its stored result is skipped, and an email
+whose only change is, say, the action-item prompt re-runs only extraction.
+
+Before any LLM call, each email is matched against the triage rules
+(``backend.rules``); a decisive match sets the category and an empty action
+list directly. During ingestion, an email that is a near-duplicate of one
+already processed (``backend.dedup``) reuses that result. Otherwise the
+local classifier (``backend.classifier``) may answer categorization when it
+is confident enough, leaving only extraction to the LLM. Each of these is
+recorded in ``ProcessedEmail.provenance``.
+"""
+
+import asyncio
+import logging
+import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Iterable, Optional, Set
+
+from .agent import (
+    categorize_email, extract_action_items, triage_email,
+    categorize_email_async, extract_action_items_async, triage_email_async,
+)
+from .classifier import LocalClassifier, classifier_threshold, get_classifier
+from .dedup import DedupIndex, get_dedup_index
+from .fingerprints import STAGES, email_fingerprint, stage_fingerprints, stale_stages
+from .models import Email, Prompts, ProcessedEmail
+from .rate_governor import LLMDeferred
+from .rules import RuleEngine, get_rule_engine
+
+log = logging.getLogger(__name__)
+
+DEFAULT_CONCURRENCY = 8
+
+ResultCallback = Callable[[ProcessedEmail, int], None]
+
+
+@dataclass
+class IngestStats:
+    """Counters filled in by an ingestion run."""
+    reprocessed: int = 0
+    skipped: int = 0
+    failed: int = 0
+    # Emails left for a later run because the provider could not take the calls
+    deferred: int = 0
+    rule_hits: int = 0
+    classifier_hits: int = 0
+    duplicate_hits: int = 0
+    # Stages sent down the pipeline; rule-decided emails are counted in rule_hits instead
+    stages_run: Dict[str, int] = field(default_factory=lambda: {s: 0 for s in STAGES})
+
+
+def ingest_concurrency() -> int:
+    """Return the configured number of concurrent LLM requests."""
+    return max(1, int(os.getenv("EMAIL_AGENT_INGEST_CONCURRENCY", DEFAULT_CONCURRENCY)))
+
+
+def fused_triage_enabled(fused: Optional[bool] = None) -> bool:
+    """Resolve an explicit ``fused`` flag, falling back to ``EMAIL_AGENT_FUSED_TRIAGE``."""
+    if fused is not None:
+        return fused
+    return os.getenv("EMAIL_AGENT_FUSED_TRIAGE", "0").strip().lower() in ("1", "true", "on", "yes")
+
+
+def _build_result(email: Email, prompts: Prompts, stages: Set[str], previous: Optional[ProcessedEmail],
+                  category: Optional[str], actions,
+                  provenance: Optional[Dict[str, Dict[str, Any]]] = None) -> ProcessedEmail:
+    """Combine the re-run ``stages`` with the fields carried over from ``previous``.
+
+    ``provenance`` maps re-run fields that did not come from the LLM to
+    where they came from.
+    """
+    fingerprints = dict(previous.prompt_fingerprints) if previous is not None else {}
+    current = stage_fingerprints(prompts)
+    fingerprints.update({s: current[s] for s in stages})
+    sources = {s: p for s, p in previous.provenance.items() if s not in stages} if previous is not None else {}
+    sources.update(provenance or {})
+    return ProcessedEmail(
+        email_id=email.id,
+        category=category if "category" in stages else previous.category,
+        action_items=actions if "action_items" in stages else previous.action_items,
+        summary=None,
+        email_hash=email_fingerprint(email),
+        prompt_fingerprints=fingerprints,
+        provenance=sources,
+    )
+
+
+def _rule_result(email: Email, prompts: Prompts, stages: Set[str], previous: Optional[ProcessedEmail],
+                 engine: Optional[RuleEngine]) -> Optional[ProcessedEmail]:
+    """The result for ``email`` if a triage rule decides it, else None."""
+    match = engine.match(email) if engine is not None else None
+    if match is None:
+        return None
+    entry = match.provenance()
+    return _build_result(email, prompts, stages, previous, match.category, [], {s: entry for s in stages})
+
+
+def _classify(email: Email, stages: Set[str], classifier: Optional[LocalClassifier]):
+    """(category, provenance entry) when the local classifier is confident, else None."""
+    if "category" not in stages or classifier is None:
+        return None
+    prediction = classifier.predict(email)
+    if prediction is None or prediction[1] < classifier_threshold():
+        return None
+    category, confidence = prediction
+    return category, {"source": "classifier", "confidence": round(confidence, 4)}
+
+
+def process_email(email: Email, prompts: Prompts, fused: Optional[bool] = None,
+                  previous: Optional[ProcessedEmail] = None,
+                  stages: Optional[Set[str]] = None) -> ProcessedEmail:
+    """Triage a single email (blocking).
+
+    ``stages`` limits the work to a subset of :data:`STAGES`; fields that are
+    not re-run are carried over from ``previous``. Emails decided by a
+    triage rule make no LLM call, and a confident local classifier saves the
+    categorization call.
+    """
+    stages = set(STAGES) if stages is None or previous is None else set(stages)
+    result = _rule_result(email, prompts, stages, previous, get_rule_engine())
+    if result is not None:
+        return result
+    local = _classify(email, stages, get_classifier())
+    llm_stages = stages - {"category"} if local else stages
+    category, actions = (local[0] if local else None), None
+    if llm_stages == set(STAGES) and fused_triage_enabled(fused):
+        category, actions = triage_email(email, prompts)
+    else:
+        if "category" in llm_stages:
+            category = categorize_email(email, prompts)
+        if "action_items" in llm_stages:
+            actions = extract_action_items(email, prompts)
+    return _build_result(email, prompts, stages, previous, category, actions,
+                         {"category": local[1]} if local else None)
+
+
+async def process_email_async(email: Email, prompts: Prompts, fused: Optional[bool] = None,
+                              previous: Optional[ProcessedEmail] = None,
+                              stages: Optional[Set[str]] = None,
+                              use_rules: bool = True) -> ProcessedEmail:
+    """Async :func:`process_email`; separate triage calls run concurrently."""
+    stages = set(STAGES) if stages is None or previous is None else set(stages)
+    if use_rules:
+        result = _rule_result(email, prompts, stages, previous, get_rule_engine())
+        if result is not None:
+            return result
+    local = _classify(email, stages, get_classifier())
+    llm_stages = stages - {"category"} if local else stages
+    category, actions = (local[0] if local else None), None
+    if llm_stages == set(STAGES) and fused_triage_enabled(fused):
+        category, actions = await triage_email_async(email, prompts)
+    elif llm_stages == set(STAGES):
+        category, actions = await asyncio.gather(
+            categorize_email_async(email, prompts),
+            extract_action_items_async(email, prompts),
+        )
+    elif "category" in llm_stages:
+        category = await categorize_email_async(email, prompts)
+    elif "action_items" in llm_stages:
+        actions = await extract_action_items_async(email, prompts)
+    return _build_result(email, prompts, stages, previous, category, actions,
+                         {"category": local[1]} if local else None)
+
+
+async def ingest_emails_async(
+    emails: Iterable[Email],
+    prompts: Prompts,
+    processed: Optional[Dict[str, ProcessedEmail]] = None,
+    concurrency: Optional[int] = None,
+    on_result: Optional[ResultCallback] = None,
+    fused: Optional[bool] = None,
+    incremental: bool = False,
+    stats: Optional[IngestStats] = None,
+) -> Dict[str, ProcessedEmail]:
+    """Process ``emails`` with at most ``concurrency`` emails in flight.
+
+    ``emails`` is consumed lazily, so a generator over a large mailbox is
+    never materialized. Each finished result is stored in ``processed``
+    (a new dict when omitted) and passed to ``on_result`` together with the
+    number of emails handled so far, skipped ones included. A failure on one
+    email is logged and does not stop the rest of the run. An email whose LLM
+    calls were deferred by the rate governor gets no result, so an
+    incremental run picks it up again. Pass an :class:`IngestStats` to learn
+    how many emails were skipped or deferred.
+
+    A near-duplicate of an email that is still being triaged waits for that
+    result and reuses it rather than being triaged in parallel; when the two
+    carry different numbers only the category is reused. Followers of a
+    leader that failed, and those action-item reruns, wait for a free slot
+    like any other email.
+    """
+    limit = concurrency or ingest_concurrency()
+    results = processed if processed is not None else {}
+    stats = stats if stats is not None else IngestStats()
+    current = stage_fingerprints(prompts)
+    engine = get_rule_engine()
+    rules_fingerprint = engine.fingerprint if engine is not None else None
+    dedup = get_dedup_index()
+    # Emails being triaged right now, so their near-duplicates can wait for
+    # the result instead of paying for the same LLM calls
+    inflight = DedupIndex(dedup.max_distance) if dedup is not None else None
+    waiting: Dict[str, list] = {}
+    # Work waiting for a free slot: new emails, followers of a failed leader
+    # and action-item reruns of near-duplicates all start from here
+    backlog = deque()
+    done = 0
+    pending = set()
+    pending_stages = {}
+
+    def _store(result, email):
+        nonlocal done
+        results[result.email_id] = result
+        if dedup is not None:
+            dedup.add(email, result.email_hash)
+        stats.reprocessed += 1
+        done += 1
+        if on_result is not None:
+            on_result(result, done)
+
+    def _reuse(email, previous, stages, dup, source):
+        entry = dup.provenance()
+        stats.duplicate_hits += 1
+        copied = _build_result(email, prompts, stages, previous, source.category, list(source.action_items),
+                               {s: entry for s in stages})
+        if dup.same_digits or "action_items" not in stages:
+            _store(copied, email)
+        else:
+            # Different numbers (dates, amounts, references): keep the
+            # category but extract this email's own action items
+            backlog.append((email, copied, {"action_items"}))
+
+    def _schedule(email, previous, stages):
+        for stage in stages:
+            stats.stages_run[stage] += 1
+        task = asyncio.ensure_future(process_email_async(email, prompts, fused, previous, stages, use_rules=False))
+        pending.add(task)
+        pending_stages[task] = (email, stages)
+        if inflight is not None:
+            inflight.add(email)
+
+    def _collect(finished):
+        for task in finished:
+            email, ran = pending_stages.pop(task)
+            if inflight is not None:
+                inflight.remove(email.id)
+            followers = waiting.pop(email.id, [])
+            try:
+                result = task.result()
+            except LLMDeferred as exc:
+                # Its near-duplicates waited for this result; they wait for the next run too
+                log.warning("Deferred email %s and %d near-duplicate(s) (%s)", email.id, len(followers), exc.reason)
+                stats.deferred += 1 + len(followers)
+                continue
+            except Exception:
+                log.exception("Failed to process email during ingestion")
+                stats.failed += 1
+                backlog.extend(follower[:3] for follower in followers)
+                continue
+            if "category" in ran and result.provenance.get("category", {}).get("source") == "classifier":
+                stats.classifier_hits += 1
+            _store(result, email)
+            for f_email, f_previous, f_stages, dup in followers:
+                _reuse(f_email, f_previous, f_stages, dup, result)
+
+    async def _wait():
+        nonlocal pending
+        finished, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        _collect(finished)
+
+    for email in emails:
+        previous = results.get(email.id)
+        stages = stale_stages(email, current, previous, rules_fingerprint) if incremental else set(STAGES)
+        if not stages:
+            stats.skipped += 1
+            done += 1
+            if dedup is not None:
+                dedup.add(email)
+            continue
+        # Rules are cheap; decide them inline instead of occupying an LLM slot
+        ruled = _rule_result(email, prompts, stages, previous, engine)
+        if ruled is not None:
+            stats.rule_hits += 1
+            _store(ruled, email)
+            continue
+        match = dedup.find_reusable(email, results, current, stages) if dedup is not None else None
+        leaders = inflight.candidates(email) if dedup is not None and match is None else []
+        if match is not None:
+            # May still queue an action-item extraction
+            _reuse(email, previous, stages, *match)
+        elif leaders:
+            waiting.setdefault(leaders[0].email_id, []).append((email, previous, stages, leaders[0]))
+            continue
+        else:
+            backlog.append((email, previous, stages))
+        while backlog:
+            if len(pending) >= limit:
+                await _wait()
+            else:
+                _schedule(*backlog.popleft())
+    while pending or backlog:
+        while backlog and len(pending) < limit:
+            _schedule(*backlog.popleft())
+        await _wait()
+    return results
+
+
+def ingest_emails(
+    emails: Iterable[Email],
+    prompts: Prompts,
+    processed: Optional[Dict[str, ProcessedEmail]] = None,
+    concurrency: Optional[int] = None,
+    on_result: Optional[ResultCallback] = None,
+    fused: Optional[bool] = None,
+    incremental: bool = False,
+    stats: Optional[IngestStats] = None,
+) -> Dict[str, ProcessedEmail]:
+    """Blocking entry point for :func:`ingest_emails_async`.
+
+    Runs a private event loop whose executor has one worker per allowed
+    concurrent LLM request, so wall-clock time scales with
+    ``len(emails) * 2 * latency / concurrency``.
+    """
+    limit = concurrency or ingest_concurrency()
+
+    async def _run():
+        loop = asyncio.get_running_loop()
+        executor = ThreadPoolExecutor(max_workers=limit, thread_name_prefix="llm")
+        loop.set_default_executor(executor)
+        return await ingest_emails_async(emails, prompts, processed, limit, on_result, fused, incremental, stats)
+
+    return asyncio.run(_run())
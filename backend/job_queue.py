@@ -0,0 +1,495 @@
+"""Durable job queue for background ingestion.
+
+The app no longer triages the inbox inside the Streamlit request. It submits
+a job to a small SQLite queue (``data/jobs.sqlite``, or
+``EMAIL_AGENT_JOBS_DB``) and polls its progress, while a separate worker
+process (``scripts/ingest_worker.py``) claims jobs and runs the ingestion
+pipeline (``backend.ingest``) over them.
+
+Job kinds:
+  - ``ingest``: the whole inbox; params ``incremental`` and ``fused``
+  - ``process``: the emails listed in ``email_ids``, always fully re-run
+
+Results are checkpointed as the job runs: every
+``EMAIL_AGENT_JOB_CHECKPOINT_EVERY`` (25) finished emails, and at least every
+few seconds, the results are upserted into the processed store and their ids
+recorded against the job. A job whose worker stops heartbeating for
+``EMAIL_AGENT_JOB_STALE_SECONDS`` (300) is claimed again by the next worker,
+which skips the emails already checkpointed. While a job runs, a background
+thread refreshes its heartbeat every quarter of that interval, so long
+stretches without a checkpoint (rate-limit backoff, the classifier and
+near-duplicate index updates, pre-drafting) don't look like a dead worker.
+A running job can be cancelled; the worker stops at its next checkpoint. With ``EMAIL_AGENT_PREDRAFT=1`` a
+completed job goes on to pre-draft replies to its actionable emails
+(``backend.predraft``).
+
+The worker needs the SQLite store. On the JSON store, or when no worker is
+heartbeating, the app runs the job itself with :func:`run_in_process`.
+"""
+
+import json
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set
+
+from . import storage
+from .classifier import update_classifier
+from .dedup import get_dedup_index
+from .ingest import IngestStats, ingest_emails
+from .metrics import export_metrics
+from .predraft import predraft_emails, predraft_enabled
+from .search_index import loaded_search_index
+
+log = logging.getLogger(__name__)
+
+DEFAULT_JOBS_DB = Path("data") / "jobs.sqlite"
+DEFAULT_CHECKPOINT_EVERY = 25
+DEFAULT_STALE_SECONDS = 300.0
+CHECKPOINT_SECONDS = 2.0
+
+JOB_KINDS = ("ingest", "process")
+ACTIVE = ("queued", "running")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    id TEXT UNIQUE NOT NULL,
+    kind TEXT NOT NULL,
+    params TEXT NOT NULL,
+    status TEXT NOT NULL,
+    total INTEGER,
+    done INTEGER NOT NULL DEFAULT 0,
+    reprocessed INTEGER NOT NULL DEFAULT 0,
+    skipped INTEGER NOT NULL DEFAULT 0,
+    failed INTEGER NOT NULL DEFAULT 0,
+    message TEXT,
+    worker TEXT,
+    heartbeat REAL,
+    cancel_requested INTEGER NOT NULL DEFAULT 0,
+    created_at TEXT NOT NULL,
+    started_at TEXT,
+    finished_at TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs(status, seq);
+CREATE TABLE IF NOT EXISTS job_items (
+    job_id TEXT NOT NULL,
+    email_id TEXT NOT NULL,
+    PRIMARY KEY (job_id, email_id)
+);
+CREATE TABLE IF NOT EXISTS workers (
+    id TEXT PRIMARY KEY,
+    pid INTEGER,
+    heartbeat REAL NOT NULL,
+    started_at TEXT NOT NULL
+);
+"""
+
+
+def checkpoint_every() -> int:
+    return max(1, int(os.getenv("EMAIL_AGENT_JOB_CHECKPOINT_EVERY", DEFAULT_CHECKPOINT_EVERY)))
+
+
+def stale_seconds() -> float:
+    return float(os.getenv("EMAIL_AGENT_JOB_STALE_SECONDS", DEFAULT_STALE_SECONDS))
+
+
+class JobCancelled(Exception):
+    """Raised inside a running job when cancellation was requested."""
+
+
+@dataclass
+class Job:
+    id: str
+    kind: str
+    status: str
+    params: Dict[str, Any] = field(default_factory=dict)
+    total: Optional[int] = None
+    done: int = 0
+    reprocessed: int = 0
+    skipped: int = 0
+    failed: int = 0
+    message: Optional[str] = None
+    worker: Optional[str] = None
+    heartbeat: Optional[float] = None
+    cancel_requested: bool = False
+    created_at: str = ""
+    started_at: Optional[str] = None
+    finished_at: Optional[str] = None
+
+    @property
+    def active(self) -> bool:
+        return self.status in ACTIVE
+
+    @property
+    def progress(self) -> float:
+        """Fraction of the job's emails handled so far (0 while the total is unknown)."""
+        return min(1.0, self.done / self.total) if self.total else 0.0
+
+
+_JOB_COLUMNS = ("id", "kind", "status", "params", "total", "done", "reprocessed", "skipped", "failed",
+                "message", "worker", "heartbeat", "cancel_requested", "created_at", "started_at", "finished_at")
+
+
+def _job_from_row(row) -> Job:
+    values = dict(zip(_JOB_COLUMNS, row))
+    values["params"] = json.loads(values["params"])
+    values["cancel_requested"] = bool(values["cancel_requested"])
+    return Job(**values)
+
+
+def _now() -> str:
+    return datetime.utcnow().isoformat()
+
+
+class JobQueue:
+    """Jobs, their checkpointed emails and the live workers, in one SQLite file."""
+
+    def __init__(self, path: Path = DEFAULT_JOBS_DB):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        # Autocommit; claim() opens its own IMMEDIATE transaction
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False, timeout=30, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(_SCHEMA)
+
+    def _select(self, where: str = "", args: tuple = (), suffix: str = "") -> List[Job]:
+        sql = f"SELECT {', '.join(_JOB_COLUMNS)} FROM jobs {where} {suffix}"
+        with self._lock:
+            rows = self._conn.execute(sql, args).fetchall()
+        return [_job_from_row(r) for r in rows]
+
+    def submit(self, kind: str, params: Optional[Dict[str, Any]] = None) -> Job:
+        """Queue a job; an identical job that is still queued is returned instead."""
+        if kind not in JOB_KINDS:
+            raise ValueError(f"Unknown job kind: {kind!r}")
+        encoded = json.dumps(params or {}, sort_keys=True)
+        existing = self._select("WHERE kind = ? AND params = ? AND status = 'queued'", (kind, encoded))
+        if existing:
+            return existing[0]
+        job_id = datetime.utcnow().strftime(f"%Y%m%dT%H%M%S-{uuid.uuid4().hex[:8]}")
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO jobs (id, kind, params, status, created_at) VALUES (?, ?, ?, 'queued', ?)",
+                (job_id, kind, encoded, _now()),
+            )
+        return self.get(job_id)
+
+    def get(self, job_id: str) -> Optional[Job]:
+        jobs = self._select("WHERE id = ?", (job_id,))
+        return jobs[0] if jobs else None
+
+    def recent(self, limit: int = 20) -> List[Job]:
+        """Most recent jobs first."""
+        return self._select(suffix="ORDER BY seq DESC LIMIT ?", args=(limit,))
+
+    def active(self) -> List[Job]:
+        return self._select("WHERE status IN ('queued', 'running')", suffix="ORDER BY seq")
+
+    def claim(self, worker_id: str, stale_after: Optional[float] = None,
+              job_id: Optional[str] = None) -> Optional[Job]:
+        """Take the oldest queued job, or a running one whose worker went silent.
+
+        With ``job_id`` only that job is taken.
+        """
+        stale_after = stale_seconds() if stale_after is None else stale_after
+        now = time.time()
+        only, only_args = (" AND id = ?", (job_id,)) if job_id is not None else ("", ())
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.execute(
+                    "UPDATE jobs SET status = 'cancelled', finished_at = ? WHERE status = 'running'"
+                    " AND cancel_requested = 1 AND heartbeat < ?",
+                    (_now(), now - stale_after),
+                )
+                row = self._conn.execute(
+                    "SELECT id, status FROM jobs WHERE (status = 'queued'"
+                    " OR (status = 'running' AND (heartbeat IS NULL OR heartbeat < ?)))"
+                    f"{only} ORDER BY seq LIMIT 1",
+                    (now - stale_after, *only_args),
+                ).fetchone()
+                if row is not None:
+                    if row[1] == "running":
+                        log.warning("Resuming job %s abandoned by its worker", row[0])
+                    self._conn.execute(
+                        "UPDATE jobs SET status = 'running', worker = ?, heartbeat = ?,"
+                        " started_at = COALESCE(started_at, ?) WHERE id = ?",
+                        (worker_id, now, _now(), row[0]),
+                    )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return self.get(row[0]) if row is not None else None
+
+    def completed_items(self, job_id: str) -> Set[str]:
+        """Ids of the emails already checkpointed for ``job_id``."""
+        with self._lock:
+            rows = self._conn.execute("SELECT email_id FROM job_items WHERE job_id = ?", (job_id,)).fetchall()
+        return {r[0] for r in rows}
+
+    def checkpoint(self, job: Job, email_ids: Iterable[str] = ()) -> bool:
+        """Record ``email_ids`` as done and store ``job``'s counters.
+
+        Also refreshes the job and worker heartbeats. Returns True when the
+        job should stop because cancellation was requested.
+        """
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.executemany(
+                    "INSERT OR IGNORE INTO job_items (job_id, email_id) VALUES (?, ?)",
+                    ((job.id, i) for i in email_ids),
+                )
+                self._conn.execute(
+                    "UPDATE jobs SET total = ?, done = ?, reprocessed = ?, skipped = ?, failed = ?,"
+                    " heartbeat = ? WHERE id = ?",
+                    (job.total, job.done, job.reprocessed, job.skipped, job.failed, now, job.id),
+                )
+                if job.worker:
+                    self._conn.execute("UPDATE workers SET heartbeat = ? WHERE id = ?", (now, job.worker))
+                (cancel,) = self._conn.execute("SELECT cancel_requested FROM jobs WHERE id = ?", (job.id,)).fetchone()
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return bool(cancel)
+
+    def heartbeat(self, job: Job) -> None:
+        """Refresh the heartbeats of a job that ``job.worker`` is still running."""
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET heartbeat = ? WHERE id = ? AND status = 'running' AND worker IS ?",
+                (now, job.id, job.worker),
+            )
+            if job.worker:
+                self._conn.execute("UPDATE workers SET heartbeat = ? WHERE id = ?", (now, job.worker))
+
+    def finish(self, job_id: str, status: str, message: Optional[str] = None) -> None:
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET status = ?, message = ?, finished_at = ? WHERE id = ?",
+                (status, message, _now(), job_id),
+            )
+
+    def cancel(self, job_id: str) -> None:
+        """Cancel a queued job now, or ask the worker to stop a running one."""
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET status = 'cancelled', finished_at = ? WHERE id = ? AND status = 'queued'",
+                (_now(), job_id),
+            )
+            self._conn.execute("UPDATE jobs SET cancel_requested = 1 WHERE id = ? AND status = 'running'", (job_id,))
+
+    # workers ----------------------------------------------------------
+
+    def register_worker(self, worker_id: str) -> None:
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO workers (id, pid, heartbeat, started_at) VALUES (?, ?, ?, ?)",
+                (worker_id, os.getpid(), time.time(), _now()),
+            )
+
+    def worker_heartbeat(self, worker_id: str) -> None:
+        with self._lock:
+            self._conn.execute("UPDATE workers SET heartbeat = ? WHERE id = ?", (time.time(), worker_id))
+
+    def unregister_worker(self, worker_id: str) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM workers WHERE id = ?", (worker_id,))
+
+    def live_workers(self, stale_after: Optional[float] = None) -> int:
+        stale_after = stale_seconds() if stale_after is None else stale_after
+        with self._lock:
+            (count,) = self._conn.execute(
+                "SELECT COUNT(*) FROM workers WHERE heartbeat >= ?", (time.time() - stale_after,)
+            ).fetchone()
+        return count
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+_queue: Optional[JobQueue] = None
+_queue_lock = threading.Lock()
+
+
+def get_job_queue() -> JobQueue:
+    """Return the process-wide queue at ``EMAIL_AGENT_JOBS_DB``."""
+    global _queue
+    path = Path(os.getenv("EMAIL_AGENT_JOBS_DB", str(DEFAULT_JOBS_DB)))
+    with _queue_lock:
+        if _queue is None or _queue.path != path:
+            if _queue is not None:
+                _queue.close()
+            _queue = JobQueue(path)
+        return _queue
+
+
+@contextmanager
+def _heartbeat(queue: JobQueue, job: Job):
+    """Keep ``job``'s heartbeat fresh from a background thread until the block exits."""
+    stop = threading.Event()
+    interval = max(0.05, stale_seconds() / 4)
+
+    def beat():
+        while not stop.wait(interval):
+            try:
+                queue.heartbeat(job)
+            except sqlite3.Error:
+                log.warning("Could not refresh the heartbeat of job %s", job.id, exc_info=True)
+
+    thread = threading.Thread(target=beat, name=f"heartbeat-{job.id}", daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        stop.set()
+        thread.join()
+
+
+ProgressCallback = Callable[[Job], None]
+
+
+def run_job(queue: JobQueue, job: Job, on_progress: Optional[ProgressCallback] = None) -> Job:
+    """Run a claimed job to completion, checkpointing as it goes.
+
+    ``on_progress`` is called with the job after every checkpoint.
+    """
+    with _heartbeat(queue, job):
+        return _run_job(queue, job, on_progress)
+
+
+def run_in_process(queue: JobQueue, job: Job, on_progress: Optional[ProgressCallback] = None) -> Job:
+    """Claim ``job`` and run it in the calling process instead of a worker.
+
+    A job that another worker is running, or that has finished, is returned
+    as it is.
+    """
+    claimed = queue.claim(f"{socket.gethostname()}:{os.getpid()}:inline", job_id=job.id)
+    if claimed is None:
+        return queue.get(job.id)
+    return run_job(queue, claimed, on_progress)
+
+
+def _run_job(queue: JobQueue, job: Job, on_progress: Optional[ProgressCallback] = None) -> Job:
+    params = job.params
+    wanted = set(params["email_ids"]) if job.kind == "process" else None
+    done_ids = queue.completed_items(job.id)
+    if job.total is None:
+        job.total = len(wanted) if wanted is not None else sum(1 for _ in storage.iter_inbox())
+    base = (job.done, job.reprocessed, job.skipped, job.failed)
+    prompts = storage.load_prompts()
+    processed = storage.load_processed()
+    stats = IngestStats()
+    pending: List = []
+    last_flush = time.monotonic()
+
+    def _update_counters():
+        job.reprocessed = base[1] + stats.reprocessed
+        job.skipped = base[2] + stats.skipped
+        job.failed = base[3] + stats.failed
+        job.done = base[0] + stats.reprocessed + stats.skipped + stats.failed + stats.deferred
+
+    def _flush() -> bool:
+        nonlocal last_flush
+        if pending:
+            storage.upsert_processed(pending)
+            # A job run inside the app keeps the app's search index current as it goes
+            index = loaded_search_index()
+            if index is not None:
+                for result in pending:
+                    index.set_category(result.email_id, result.category)
+        _update_counters()
+        cancel = queue.checkpoint(job, [r.email_id for r in pending])
+        # The app's metrics panel reads the worker's calls from the shared file
+        export_metrics()
+        pending.clear()
+        last_flush = time.monotonic()
+        if on_progress is not None:
+            on_progress(job)
+        return cancel
+
+    def on_result(result, _done):
+        pending.append(result)
+        if len(pending) >= checkpoint_every() or time.monotonic() - last_flush >= CHECKPOINT_SECONDS:
+            if _flush():
+                raise JobCancelled(job.id)
+
+    emails = (
+        e for e in storage.iter_inbox()
+        if (wanted is None or e.id in wanted) and e.id not in done_ids
+    )
+    try:
+        ingest_emails(emails, prompts, processed=processed, on_result=on_result, fused=params.get("fused"),
+                      incremental=job.kind == "ingest" and params.get("incremental", True), stats=stats)
+        if _flush():
+            raise JobCancelled(job.id)
+    except JobCancelled:
+        queue.finish(job.id, "cancelled", f"Cancelled after {job.done} of {job.total} emails")
+        return queue.get(job.id)
+    except Exception as exc:
+        log.exception("Job %s failed", job.id)
+        _flush()
+        queue.finish(job.id, "failed", f"{type(exc).__name__}: {exc}")
+        return queue.get(job.id)
+
+    update_classifier(storage.iter_inbox(), processed, prompts)
+    dedup = get_dedup_index()
+    if dedup is not None:
+        dedup.save()
+    message = (
+        f"Reprocessed {stats.reprocessed} ({stats.rule_hits} by rules, {stats.duplicate_hits} as near-duplicates, "
+        f"{stats.classifier_hits} categorized locally), skipped {stats.skipped} unchanged, "
+        f"{stats.failed} failed, {stats.deferred} deferred to the next run"
+    )
+    if predraft_enabled():
+        # Each draft is a full LLM call; show the worker is alive between them
+        drafted = predraft_emails(
+            (e for e in storage.iter_inbox() if wanted is None or e.id in wanted), processed, prompts,
+            on_progress=lambda _drafted: queue.heartbeat(job),
+        )
+        message += f"; pre-drafted {drafted} repl{'y' if drafted == 1 else 'ies'}"
+    queue.finish(job.id, "completed", message)
+    return queue.get(job.id)
+
+
+def work(queue: Optional[JobQueue] = None, once: bool = False, poll_interval: float = 2.0,
+         worker_id: Optional[str] = None) -> int:
+    """Claim and run jobs until stopped (or, with ``once``, until the queue is empty).
+
+    Returns the number of jobs run.
+    """
+    queue = queue or get_job_queue()
+    worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}"
+    queue.register_worker(worker_id)
+    count = 0
+    try:
+        while True:
+            job = queue.claim(worker_id)
+            if job is None:
+                if once:
+                    return count
+                queue.worker_heartbeat(worker_id)
+                time.sleep(poll_interval)
+                continue
+            log.info("Running %s job %s", job.kind, job.id)
+            job = run_job(queue, job)
+            log.info("Job %s %s: %s", job.id, job.status, job.message)
+            count += 1
+    finally:
+        export_metrics()
+        queue.unregister_worker(worker_id)
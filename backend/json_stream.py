@@ -0,0 +1,141 @@
+"""Incremental reader for a JSON object that is still being generated.
+
+``PartialJsonObject`` accepts the raw text of a streamed LLM response chunk by
+chunk and exposes the top-level fields decoded so far. String values are
+available while they are still open, so a draft's ``body`` can be rendered
+before the model has finished writing it. Non-string values (lists, numbers)
+appear once they are complete.
+"""
+
+import json
+from typing import Any, Dict, Optional, Tuple
+
+_ESCAPES = {'"': '"', "\\": "\\", "/": "/", "b": "\b", "f": "\f", "n": "\n", "r": "\r", "t": "\t"}
+_CLOSERS = {"{": "}", "[": "]"}
+
+
+def _skip_ws(text: str, i: int) -> int:
+    while i < len(text) and text[i] in " \t\r\n":
+        i += 1
+    return i
+
+
+def _read_string(text: str, i: int) -> Tuple[str, int, bool]:
+    """Decode the string starting after the opening quote at ``i``.
+
+    Returns (value so far, index after the string, complete?). A trailing
+    partial escape sequence is left out of the value.
+    """
+    out = []
+    n = len(text)
+    while i < n:
+        ch = text[i]
+        if ch == '"':
+            return "".join(out), i + 1, True
+        if ch == "\\":
+            if i + 1 >= n:
+                break
+            esc = text[i + 1]
+            if esc == "u":
+                if i + 6 > n:
+                    break
+                try:
+                    out.append(chr(int(text[i + 2:i + 6], 16)))
+                except ValueError:
+                    out.append(text[i:i + 6])
+                i += 6
+                continue
+            out.append(_ESCAPES.get(esc, esc))
+            i += 2
+            continue
+        out.append(ch)
+        i += 1
+    return "".join(out), n, False
+
+
+def _value_end(text: str, i: int) -> Optional[int]:
+    """Index just past the non-string value starting at ``i``, or None if incomplete."""
+    n = len(text)
+    if text[i] in _CLOSERS:
+        stack = []
+        while i < n:
+            ch = text[i]
+            if ch == '"':
+                _value, i, complete = _read_string(text, i + 1)
+                if not complete:
+                    return None
+                continue
+            if ch in _CLOSERS:
+                stack.append(_CLOSERS[ch])
+            elif stack and ch == stack[-1]:
+                stack.pop()
+                if not stack:
+                    return i + 1
+            i += 1
+        return None
+    while i < n and text[i] not in ",}":
+        i += 1
+    # A scalar is only known to be complete once a delimiter follows it
+    return i if i < n else None
+
+
+def parse_partial_object(text: str) -> Tuple[Dict[str, Any], bool]:
+    """Parse as much of a (possibly truncated) JSON object as possible.
+
+    Returns (fields, complete). Text before the first ``{`` (such as a
+    Markdown code fence) is ignored.
+    """
+    fields: Dict[str, Any] = {}
+    i = text.find("{")
+    if i == -1:
+        return fields, False
+    i += 1
+    n = len(text)
+    while True:
+        i = _skip_ws(text, i)
+        if i >= n:
+            return fields, False
+        if text[i] == "}":
+            return fields, True
+        if text[i] == ",":
+            i += 1
+            continue
+        if text[i] != '"':
+            return fields, False
+        key, i, complete = _read_string(text, i + 1)
+        if not complete:
+            return fields, False
+        i = _skip_ws(text, i)
+        if i >= n or text[i] != ":":
+            return fields, False
+        i = _skip_ws(text, i + 1)
+        if i >= n:
+            return fields, False
+        if text[i] == '"':
+            value, i, complete = _read_string(text, i + 1)
+            fields[key] = value
+            if not complete:
+                return fields, False
+            continue
+        end = _value_end(text, i)
+        if end is None:
+            return fields, False
+        try:
+            fields[key] = json.loads(text[i:end])
+        except ValueError:
+            return fields, False
+        i = end
+
+
+class PartialJsonObject:
+    """Accumulates streamed chunks and tracks the fields decoded so far."""
+
+    def __init__(self):
+        self.text = ""
+        self.fields: Dict[str, Any] = {}
+        self.complete = False
+
+    def feed(self, chunk: str) -> Dict[str, Any]:
+        self.text += chunk
+        self.fields, self.complete = parse_partial_object(self.text)
+        return self.fields
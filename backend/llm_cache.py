@@ -0,0 +1,167 @@
+"""Persistent, content-addressed cache for LLM responses.
+
+Responses are stored in a small SQLite file (``data/llm_cache.sqlite`` by
+default) keyed by a hash of the model, temperature, system prompt and user
+prompt, so re-running categorization or extraction over unchanged emails with
+unchanged prompts does not hit the network again.
+
+Configuration (environment variables):
+  - ``EMAIL_AGENT_LLM_CACHE``: set to ``0``/``false``/``off`` to bypass the cache.
+  - ``EMAIL_AGENT_LLM_CACHE_PATH``: location of the SQLite file.
+  - ``EMAIL_AGENT_LLM_CACHE_MAX_ENTRIES``: evict least-recently-used entries above this count.
+  - ``EMAIL_AGENT_LLM_CACHE_MAX_AGE_DAYS``: evict entries older than this many days.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Optional, Dict, Any
+
+log = logging.getLogger(__name__)
+
+DEFAULT_CACHE_PATH = Path("data") / "llm_cache.sqlite"
+DEFAULT_MAX_ENTRIES = 200_000
+DEFAULT_MAX_AGE_DAYS = 30.0
+# Eviction scans the table, so only run it every N writes.
+_EVICT_EVERY = 500
+
+
+def cache_enabled() -> bool:
+    """Return False when the cache has been switched off via the environment."""
+    return os.getenv("EMAIL_AGENT_LLM_CACHE", "1").strip().lower() not in ("0", "false", "off", "no")
+
+
+def make_key(model: str, temperature: float, system_prompt: str, user_prompt: str) -> str:
+    """Build the content address for a single chat completion request."""
+    payload = json.dumps([model, float(temperature), system_prompt, user_prompt], ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class LLMCache:
+    """SQLite-backed response cache with LRU/age eviction and hit/miss counters."""
+
+    def __init__(self, path: Path = DEFAULT_CACHE_PATH,
+                 max_entries: int = DEFAULT_MAX_ENTRIES,
+                 max_age_days: Optional[float] = DEFAULT_MAX_AGE_DAYS):
+        self.path = Path(path)
+        self.max_entries = max_entries
+        self.max_age_seconds = max_age_days * 86400 if max_age_days else None
+        self.hits = 0
+        self.misses = 0
+        self._writes = 0
+        self._lock = threading.Lock()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            " key TEXT PRIMARY KEY,"
+            " model TEXT NOT NULL,"
+            " response TEXT NOT NULL,"
+            " created_at REAL NOT NULL,"
+            " last_access REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_last_access ON responses(last_access)")
+        self._conn.commit()
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT response, created_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None or (self.max_age_seconds and now - row[1] > self.max_age_seconds):
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE responses SET last_access = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            self.hits += 1
+            return row[0]
+
+    def put(self, key: str, model: str, response: str) -> None:
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, model, response, created_at, last_access)"
+                " VALUES (?, ?, ?, ?, ?)",
+                (key, model, response, now, now),
+            )
+            self._conn.commit()
+            self._writes += 1
+            if self._writes % _EVICT_EVERY == 0:
+                self._evict_locked(now)
+
+    def evict(self) -> int:
+        """Drop expired entries and trim to ``max_entries``; returns rows removed."""
+        with self._lock:
+            return self._evict_locked(time.time())
+
+    def _evict_locked(self, now: float) -> int:
+        removed = 0
+        if self.max_age_seconds:
+            cur = self._conn.execute(
+                "DELETE FROM responses WHERE created_at < ?", (now - self.max_age_seconds,)
+            )
+            removed += cur.rowcount
+        if self.max_entries:
+            (count,) = self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()
+            excess = count - self.max_entries
+            if excess > 0:
+                cur = self._conn.execute(
+                    "DELETE FROM responses WHERE key IN ("
+                    " SELECT key FROM responses ORDER BY last_access ASC LIMIT ?)",
+                    (excess,),
+                )
+                removed += cur.rowcount
+        self._conn.commit()
+        if removed:
+            log.debug("Evicted %d LLM cache entries", removed)
+        return removed
+
+    def clear(self) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM responses")
+            self._conn.commit()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            (count,) = self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()
+        lookups = self.hits + self.misses
+        return {
+            "entries": count,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits / lookups) if lookups else 0.0,
+        }
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+_cache: Optional[LLMCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_cache() -> Optional[LLMCache]:
+    """Return the process-wide cache, creating it lazily; None when bypassed."""
+    global _cache
+    if not cache_enabled():
+        return None
+    path = Path(os.getenv("EMAIL_AGENT_LLM_CACHE_PATH", str(DEFAULT_CACHE_PATH)))
+    with _cache_lock:
+        if _cache is None or _cache.path != path:
+            if _cache is not None:
+                _cache.close()
+            max_age = os.getenv("EMAIL_AGENT_LLM_CACHE_MAX_AGE_DAYS")
+            _cache = LLMCache(
+                path,
+                max_entries=int(os.getenv("EMAIL_AGENT_LLM_CACHE_MAX_ENTRIES", DEFAULT_MAX_ENTRIES)),
+                max_age_days=float(max_age) if max_age else DEFAULT_MAX_AGE_DAYS,
+            )
+        return _cache
@@ -1,7 +1,17 @@
+import asyncio
+import contextvars
+import functools
 import os
 import json
 import logging
-from typing import Optional
+import re
+import threading
+import time
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from .llm_cache import get_cache, make_key
+from .metrics import current_caller, record_call, usage_tokens
+from .rate_governor import LLMDeferred, LLMRejected, get_governor
 
 # Prefer the official OpenAI SDK if available; import lazily to allow running without a key
 try:
@@ -9,23 +19,131 @@ try:
 except Exception:  # pragma: no cover - optional import
     OpenAI = None
 
+# httpx ships with the OpenAI SDK; used to size the keep-alive connection pool
+try:
+    import httpx
+except Exception:  # pragma: no cover - optional import
+    httpx = None
+
 log = logging.getLogger(__name__)
 
+# Completion tokens assumed per call until the provider reports usage
+COMPLETION_TOKENS_ESTIMATE = 256
+
 
-def _build_client() -> Optional[object]:
+def model_settings() -> Tuple[str, float]:
+    """Return the (model, temperature) used for chat completions."""
+    return os.getenv("OPENAI_DEFAULT_MODEL", "gpt-4o-mini"), float(os.getenv("OPENAI_TEMPERATURE", "0.2"))
+
+
+def _client_settings() -> Tuple:
+    """Return the environment settings that determine how the client is built.
+
+    A change in any of these (for example a rotated ``OPENAI_API_KEY``) makes
+    the pooled client stale so it gets rebuilt on the next call.
+    """
+    return (
+        os.getenv("OPENAI_API_KEY"),
+        os.getenv("OPENAI_DEFAULT_MODEL", "gpt-4o-mini"),
+        int(os.getenv("OPENAI_POOL_MAXSIZE", "20")),
+        float(os.getenv("OPENAI_TIMEOUT", "60")),
+        float(os.getenv("OPENAI_CONNECT_TIMEOUT", "10")),
+        # Retries are left to the rate governor, which also adapts concurrency
+        int(os.getenv("OPENAI_MAX_RETRIES", "0")),
+    )
+
+
+def _build_client(settings: Optional[Tuple] = None) -> Optional[object]:
     """Create an OpenAI client from the OPENAI_API_KEY environment variable.
 
     If OPENAI_API_KEY is not set or the OpenAI SDK isn't available the function
     returns None and callers should fall back to the builtin mock responder.
+    When httpx is available the client gets a keep-alive connection pool of
+    ``OPENAI_POOL_MAXSIZE`` connections and the configured timeouts.
     """
-    key = os.getenv("OPENAI_API_KEY")
+    key, _model, pool_size, timeout, connect_timeout, max_retries = settings or _client_settings()
     if not key:
         log.debug("OPENAI_API_KEY not found in environment; using mock LLM output")
         return None
     if OpenAI is None:
         log.warning("OpenAI SDK not installed even though OPENAI_API_KEY is set; continuing without network LLM")
         return None
-    return OpenAI(api_key=key)
+    if httpx is None:
+        return OpenAI(api_key=key, timeout=timeout, max_retries=max_retries)
+    http_client = httpx.Client(
+        limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size),
+        timeout=httpx.Timeout(timeout, connect=connect_timeout),
+    )
+    return OpenAI(api_key=key, http_client=http_client, timeout=timeout, max_retries=max_retries)
+
+
+class _ClientManager:
+    """Process-wide holder for a lazily created, reusable OpenAI client.
+
+    Reusing one client keeps its HTTP connections alive between calls, so
+    short triage prompts don't pay for a new TLS handshake every time.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._client = None
+        self._settings = None
+
+    def get(self) -> Optional[object]:
+        settings = _client_settings()
+        if settings == self._settings:
+            return self._client
+        with self._lock:
+            if settings != self._settings:
+                old = self._client
+                self._client = _build_client(settings)
+                self._settings = settings
+                if old is not None:
+                    log.info("OpenAI client settings changed; rebuilt pooled client")
+                    try:
+                        old.close()
+                    except Exception:  # pragma: no cover - best effort cleanup
+                        pass
+            return self._client
+
+    def reset(self) -> None:
+        with self._lock:
+            if self._client is not None:
+                try:
+                    self._client.close()
+                except Exception:  # pragma: no cover - best effort cleanup
+                    pass
+            self._client = None
+            self._settings = None
+
+
+_client_manager = _ClientManager()
+
+
+def get_client() -> Optional[object]:
+    """Return the shared OpenAI client, or None when running in mock mode."""
+    return _client_manager.get()
+
+
+def _mock_category(combined: str) -> str:
+    if "prize" in combined or "click here" in combined or "reward" in combined:
+        return "Spam"
+    if "newsletter" in combined or "top stories" in combined:
+        return "Newsletter"
+    if "final report" in combined or "prepare slides" in combined or "meeting" in combined:
+        return "To-Do"
+    return "Important"
+
+
+def _mock_action_items(combined: str) -> list:
+    items = []
+    if "final report" in combined:
+        items.append({"task": "Write final report", "deadline": "2025-11-21"})
+    if "prepare slides" in combined or "slides" in combined:
+        items.append({"task": "Prepare slides for review meeting", "deadline": "2025-11-24"})
+    if "claim your reward" in combined or "you won" in combined:
+        items.append({"task": "Check spam link", "deadline": None})
+    return items
 
 
 def _mock_response(system_prompt: str, user_prompt: str) -> str:
@@ -37,26 +155,17 @@ def _mock_response(system_prompt: str, user_prompt: str) -> str:
     # Combine prompts to make decisions
     combined = (system_prompt + "\n" + user_prompt).lower()
 
+    # fused triage -> one object with both the category and the action items
+    if '"action_items"' in system_prompt:
+        return json.dumps({"category": _mock_category(combined), "action_items": _mock_action_items(combined)})
+
     # categorization -> look for keywords
     if "categorize" in system_prompt.lower() or "category" in combined:
-        if "prize" in combined or "click here" in combined or "reward" in combined:
-            return json.dumps({"category": "Spam"})
-        if "newsletter" in combined or "top stories" in combined:
-            return json.dumps({"category": "Newsletter"})
-        if "final report" in combined or "prepare slides" in combined or "meeting" in combined:
-            return json.dumps({"category": "To-Do"})
-        return json.dumps({"category": "Important"})
+        return json.dumps({"category": _mock_category(combined)})
 
     # action item extraction -> return a list of tasks
     if "extract" in system_prompt.lower() or "action" in combined:
-        items = []
-        if "final report" in combined:
-            items.append({"task": "Write final report", "deadline": "2025-11-21"})
-        if "prepare slides" in combined or "slides" in combined:
-            items.append({"task": "Prepare slides for review meeting", "deadline": "2025-11-24"})
-        if "claim your reward" in combined or "you won" in combined:
-            items.append({"task": "Check spam link", "deadline": None})
-        return json.dumps(items)
+        return json.dumps(_mock_action_items(combined))
 
     # auto-reply -> return the JSON with subject/body/suggested_followups
     if "draft" in system_prompt.lower() or "draft" in combined or "reply" in combined:
@@ -71,31 +180,203 @@ def _mock_response(system_prompt: str, user_prompt: str) -> str:
     return "I'm an offline assistant (mock mode) — no LLM API key configured."
 
 
-def run_llm(system_prompt: str, user_prompt: str) -> str:
+def _messages(system_prompt: str, user_prompt: str) -> List[Dict[str, str]]:
+    return [{"role": "system", "content": system_prompt}, {"role": "user", "content": user_prompt}]
+
+
+def _chat_key(model: str, temperature: float, messages: List[Dict[str, str]]) -> str:
+    """Cache key of a conversation; a plain system + user pair keys as in ``run_llm``."""
+    if len(messages) == 2 and [m["role"] for m in messages] == ["system", "user"]:
+        return make_key(model, temperature, messages[0]["content"], messages[1]["content"])
+    return make_key(model, temperature, "", json.dumps(messages, ensure_ascii=False))
+
+
+def _estimate_tokens(messages: List[Dict[str, str]]) -> int:
+    return sum(len(m["content"]) for m in messages) // 4 + COMPLETION_TOKENS_ESTIMATE
+
+
+def _mock_chat(messages: List[Dict[str, str]]) -> str:
+    system = next((m["content"] for m in messages if m["role"] == "system"), "")
+    user = next((m["content"] for m in reversed(messages) if m["role"] == "user"), "")
+    return _mock_response(system, user)
+
+
+def run_llm(system_prompt: str, user_prompt: str, use_cache: bool = True) -> str:
     """Runs a chat completion with a system + user prompt.
 
     Behavior:
       - If OPENAI_API_KEY is set and openai.OpenAI is importable, uses the network client.
       - Otherwise, returns a safe offline mock response (useful for demos/tests).
+      - Network responses are stored in the persistent LLM cache (see
+        ``backend.llm_cache``); pass ``use_cache=False`` or set
+        ``EMAIL_AGENT_LLM_CACHE=0`` to bypass it.
 
     The function never raises due to missing configuration — it returns a helpful
-    string that the caller can display or parse.
+    string that the caller can display or parse. Network calls go through the
+    rate governor (``backend.rate_governor``); one that cannot be completed
+    raises ``LLMDeferred`` instead of returning made-up output, and one the
+    provider refuses raises ``LLMRejected``. Every call is recorded in
+    ``backend.metrics``.
+    """
+    return run_chat(_messages(system_prompt, user_prompt), use_cache)
+
+
+def run_chat(messages: List[Dict[str, str]], use_cache: bool = True) -> str:
+    """Like :func:`run_llm` for a whole conversation (``role``/``content`` dicts).
+
+    Keep the leading messages identical from call to call so the provider
+    can reuse its cached processing of that prefix.
     """
-    client = _build_client()
+    start = time.perf_counter()
+    client = get_client()
     if client is None:
         log.info("Using mock LLM response (no API key).")
-        return _mock_response(system_prompt, user_prompt)
+        content = _mock_chat(messages)
+        record_call("mock", time.perf_counter() - start, fallback_reason="no_client")
+        return content
 
+    model, temperature = model_settings()
+    cache = get_cache() if use_cache else None
+    key = _chat_key(model, temperature, messages) if cache else None
+    if cache is not None:
+        cached = cache.get(key)
+        if cached is not None:
+            record_call("cache", time.perf_counter() - start, model=model)
+            return cached
+
+    governor = get_governor()
+    estimate = _estimate_tokens(messages)
     try:
-        response = client.chat.completions.create(
-            model=os.getenv("OPENAI_DEFAULT_MODEL", "gpt-4o-mini"),
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt}
-            ],
-            temperature=float(os.getenv("OPENAI_TEMPERATURE", "0.2"))
-        )
-        return response.choices[0].message.content
-    except Exception as exc:  # pragma: no cover - network call
-        log.exception("LLM call failed, falling back to mock response: %s", exc)
-        return _mock_response(system_prompt, user_prompt)
+        response = governor.call(lambda: client.chat.completions.create(
+            model=model,
+            messages=messages,
+            temperature=temperature
+        ), estimate)
+    except LLMDeferred as exc:
+        record_call("deferred", time.perf_counter() - start, model=model, fallback_reason=exc.reason)
+        raise
+    except LLMRejected as exc:
+        record_call("rejected", time.perf_counter() - start, model=model, fallback_reason=exc.reason)
+        raise
+    content = response.choices[0].message.content
+
+    prompt_tokens, completion_tokens = usage_tokens(getattr(response, "usage", None))
+    governor.settle(estimate, prompt_tokens + completion_tokens)
+    record_call("network", time.perf_counter() - start, model=model,
+                prompt_tokens=prompt_tokens, completion_tokens=completion_tokens)
+
+    # Only real completions are cached; mock responses must not poison the cache.
+    if cache is not None and content is not None:
+        cache.put(key, model, content)
+    return content
+
+
+async def run_llm_async(system_prompt: str, user_prompt: str, use_cache: bool = True) -> str:
+    """Async variant of :func:`run_llm`.
+
+    The blocking call runs in the event loop's default executor, so the number
+    of LLM requests in flight is bounded by that executor's worker count (the
+    ingestion pipeline sizes it to its concurrency limit). It shares the
+    pooled client and the response cache with the sync path. The call runs in
+    a copy of the current context so metrics see the calling function.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        None, functools.partial(contextvars.copy_context().run, run_llm, system_prompt, user_prompt, use_cache)
+    )
+
+
+_STREAM_CHUNK_RE = re.compile(r"\S+\s*|\s+")
+
+
+def _stream_text(text: str) -> Iterator[str]:
+    """Split a complete response into word-sized chunks, like a token stream."""
+    for match in _STREAM_CHUNK_RE.finditer(text):
+        yield match.group(0)
+
+
+def run_llm_stream(system_prompt: str, user_prompt: str, use_cache: bool = True) -> Iterator[str]:
+    """Streaming variant of :func:`run_llm` that yields text chunks as they arrive.
+
+    The mock responder and cache hits are streamed too, so callers can always
+    render incrementally. A completed network response is written to the
+    cache. Opening the stream goes through the rate governor; if it cannot
+    be opened, or the stream breaks off, ``LLMDeferred`` is raised
+    (``LLMRejected`` when the provider refuses the request).
+
+    The calling function is captured now, since the generator body only runs
+    once the caller starts iterating.
+    """
+    return _run_chat_stream(_messages(system_prompt, user_prompt), use_cache, current_caller())
+
+
+def run_chat_stream(messages: List[Dict[str, str]], use_cache: bool = True) -> Iterator[str]:
+    """Streaming variant of :func:`run_chat`."""
+    return _run_chat_stream(messages, use_cache, current_caller())
+
+
+def _run_chat_stream(messages: List[Dict[str, str]], use_cache: bool, caller: str) -> Iterator[str]:
+    start = time.perf_counter()
+    client = get_client()
+    if client is None:
+        log.info("Using mock LLM response (no API key).")
+        yield from _stream_text(_mock_chat(messages))
+        record_call("mock", time.perf_counter() - start, caller=caller, fallback_reason="no_client")
+        return
+
+    model, temperature = model_settings()
+    cache = get_cache() if use_cache else None
+    key = _chat_key(model, temperature, messages) if cache else None
+    if cache is not None:
+        cached = cache.get(key)
+        if cached is not None:
+            yield cached
+            record_call("cache", time.perf_counter() - start, model=model, caller=caller)
+            return
+
+    parts = []
+    usage = None
+    governor = get_governor()
+    estimate = _estimate_tokens(messages)
+    try:
+        stream = governor.call(lambda: client.chat.completions.create(
+            model=model,
+            messages=messages,
+            temperature=temperature,
+            stream=True,
+            stream_options={"include_usage": True},
+        ), estimate, hold=True)
+    except LLMDeferred as exc:
+        record_call("deferred", time.perf_counter() - start, model=model, caller=caller, fallback_reason=exc.reason)
+        raise
+    except LLMRejected as exc:
+        record_call("rejected", time.perf_counter() - start, model=model, caller=caller, fallback_reason=exc.reason)
+        raise
+    try:
+        for chunk in stream:
+            # With include_usage the final chunk has no choices, only usage
+            usage = getattr(chunk, "usage", None) or usage
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content
+            if delta:
+                parts.append(delta)
+                yield delta
+    except Exception as exc:
+        log.exception("LLM stream failed after %d chunks: %s", len(parts), exc)
+        governor.finish(exc)
+        record_call("deferred", time.perf_counter() - start, model=model, caller=caller,
+                    fallback_reason=type(exc).__name__)
+        raise LLMDeferred(type(exc).__name__) from exc
+    except BaseException:
+        # The reader stopped early (GeneratorExit); the provider did its part
+        governor.finish()
+        raise
+    governor.finish()
+
+    prompt_tokens, completion_tokens = usage_tokens(usage)
+    governor.settle(estimate, prompt_tokens + completion_tokens)
+    record_call("network", time.perf_counter() - start, model=model, caller=caller,
+                prompt_tokens=prompt_tokens, completion_tokens=completion_tokens)
+    if cache is not None and parts:
+        cache.put(key, model, "".join(parts))
@@ -0,0 +1,301 @@
+"""Streaming inbox readers for JSON, JSONL, mbox and Maildir sources.
+
+Every source yields ``Email`` objects lazily, so the ingestion pipeline can
+consume a multi-GB mailbox export as a generator without building the whole
+list first. Sources can also produce lightweight :class:`EmailRef` records
+(headers plus the location of the message) and load a single message on
+demand with :meth:`MailSource.load`, which reads only that message's bytes.
+
+A message without a ``Message-ID`` header gets an id hashed from its
+From, To, Date and Subject headers, so it keeps the same id when the
+mailbox is rewritten and doesn't collide with messages of other mailboxes.
+
+Use :func:`open_source` to pick the reader from a path:
+  - a directory containing ``cur``/``new`` -> Maildir
+  - ``*.jsonl`` / ``*.ndjson``             -> one JSON email object per line
+  - ``*.json``                             -> JSON array (the mock inbox format)
+  - anything else                          -> mbox
+"""
+
+import json
+import mailbox
+import mmap
+import os
+from dataclasses import dataclass, fields
+from email.header import decode_header, make_header
+from email.parser import BytesHeaderParser
+from email.utils import parsedate_to_datetime
+from pathlib import Path
+from typing import Any, Dict, Iterator, Optional, Tuple
+
+from .fingerprints import _digest
+from .models import Email
+
+_EMAIL_FIELDS = {f.name for f in fields(Email)}
+
+
+@dataclass(slots=True)
+class EmailRef:
+    """Headers of one message plus where to find it in its source."""
+    id: str
+    sender: str
+    subject: str
+    timestamp: str
+    location: Any
+
+
+def email_from_dict(raw: Dict[str, Any]) -> Email:
+    """Build an Email from a JSON record, ignoring keys the model doesn't know."""
+    return Email(**{k: v for k, v in raw.items() if k in _EMAIL_FIELDS})
+
+
+def _ref(email: Email, location: Any) -> EmailRef:
+    return EmailRef(email.id, email.sender, email.subject, email.timestamp, location)
+
+
+class MailSource:
+    """Base class: iterate emails, iterate refs, load one message by ref."""
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+
+    def __iter__(self) -> Iterator[Email]:
+        raise NotImplementedError
+
+    def refs(self) -> Iterator[EmailRef]:
+        raise NotImplementedError
+
+    def load(self, ref: EmailRef) -> Email:
+        raise NotImplementedError
+
+    def close(self) -> None:
+        pass
+
+    def __enter__(self) -> "MailSource":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+class JsonArraySource(MailSource):
+    """The legacy ``mock_inbox.json`` format: a single JSON array of emails.
+
+    The array is parsed once per instance and kept until the file's mtime or
+    size changes, so loading messages one at a time doesn't re-read the file.
+    """
+
+    def __init__(self, path: Path):
+        super().__init__(path)
+        self._cache: Optional[Tuple[Tuple[int, int], list]] = None
+
+    def _records(self) -> list:
+        stat = os.stat(self.path)
+        key = (stat.st_mtime_ns, stat.st_size)
+        cached = self._cache
+        if cached is not None and cached[0] == key:
+            return cached[1]
+        with open(self.path, "r", encoding="utf-8") as f:
+            records = json.load(f)
+        self._cache = (key, records)
+        return records
+
+    def __iter__(self) -> Iterator[Email]:
+        for raw in self._records():
+            yield email_from_dict(raw)
+
+    def refs(self) -> Iterator[EmailRef]:
+        for i, raw in enumerate(self._records()):
+            yield _ref(email_from_dict(raw), i)
+
+    def load(self, ref: EmailRef) -> Email:
+        return email_from_dict(self._records()[ref.location])
+
+
+class JsonlSource(MailSource):
+    """One JSON email object per line, scanned through a read-only mmap."""
+
+    def _lines(self) -> Iterator[Tuple[int, int, bytes]]:
+        with open(self.path, "rb") as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                size = len(mm)
+                pos = 0
+                while pos < size:
+                    end = mm.find(b"\n", pos)
+                    if end == -1:
+                        end = size
+                    line = mm[pos:end]
+                    if line.strip():
+                        yield pos, end - pos, line
+                    pos = end + 1
+
+    def __iter__(self) -> Iterator[Email]:
+        for _offset, _length, line in self._lines():
+            yield email_from_dict(json.loads(line))
+
+    def refs(self) -> Iterator[EmailRef]:
+        for offset, length, line in self._lines():
+            yield _ref(email_from_dict(json.loads(line)), (offset, length))
+
+    def load(self, ref: EmailRef) -> Email:
+        offset, length = ref.location
+        with open(self.path, "rb") as f:
+            f.seek(offset)
+            return email_from_dict(json.loads(f.read(length)))
+
+
+def _header(msg, name: str) -> str:
+    value = msg.get(name)
+    if value is None:
+        return ""
+    try:
+        return str(make_header(decode_header(value))).strip()
+    except Exception:
+        return str(value).strip()
+
+
+def _body(msg) -> str:
+    part = msg
+    if msg.is_multipart():
+        part = next((p for p in msg.walk() if p.get_content_type() == "text/plain"
+                     and not p.get_filename()), None)
+        if part is None:
+            return ""
+    payload = part.get_payload(decode=True)
+    if payload is None:
+        return str(part.get_payload() or "")
+    return payload.decode(part.get_content_charset() or "utf-8", errors="replace")
+
+
+def _timestamp(msg) -> str:
+    raw = msg.get("Date")
+    if not raw:
+        return ""
+    try:
+        return parsedate_to_datetime(raw).isoformat()
+    except Exception:
+        return str(raw)
+
+
+def _parent_id(msg) -> Optional[str]:
+    # In-Reply-To names the direct parent; otherwise the last References entry does
+    for name in ("In-Reply-To", "References"):
+        ids = _header(msg, name).split()
+        if ids:
+            return ids[-1].strip("<>")
+    return None
+
+
+def _message_id(msg) -> str:
+    return _header(msg, "Message-ID").strip("<>")
+
+
+def _email_id(msg) -> str:
+    """The Message-ID, or a hash of the identifying headers when there is none."""
+    return _message_id(msg) or "h-" + _digest(*(_header(msg, name) for name in ("From", "To", "Date", "Subject")))
+
+
+def message_to_email(msg) -> Email:
+    """Convert an RFC 822 message to an Email."""
+    message_id = _message_id(msg)
+    return Email(
+        id=_email_id(msg),
+        sender=_header(msg, "From"),
+        subject=_header(msg, "Subject"),
+        body=_body(msg),
+        timestamp=_timestamp(msg),
+        message_id=message_id or None,
+        in_reply_to=_parent_id(msg),
+    )
+
+
+def _read_headers(fp):
+    lines = []
+    try:
+        for line in fp:
+            if line in (b"\n", b"\r\n"):
+                break
+            lines.append(line)
+    finally:
+        fp.close()
+    return BytesHeaderParser().parsebytes(b"".join(lines))
+
+
+class _MailboxSource(MailSource):
+    """Shared logic for stdlib ``mailbox`` formats; messages are read one key at a time.
+
+    The mailbox is opened once and kept, so an mbox file's table of message
+    offsets is only built on first use.
+    """
+
+    def __init__(self, path: Path):
+        super().__init__(path)
+        self._box = None
+
+    def _open(self) -> mailbox.Mailbox:
+        raise NotImplementedError
+
+    def _mailbox(self) -> mailbox.Mailbox:
+        if self._box is None:
+            self._box = self._open()
+        return self._box
+
+    def __iter__(self) -> Iterator[Email]:
+        box = self._mailbox()
+        for key in box.iterkeys():
+            yield message_to_email(box.get_message(key))
+
+    def refs(self) -> Iterator[EmailRef]:
+        box = self._mailbox()
+        for key in box.iterkeys():
+            # Headers only: the body is read lazily by load()
+            msg = _read_headers(box.get_file(key))
+            yield EmailRef(
+                id=_email_id(msg),
+                sender=_header(msg, "From"),
+                subject=_header(msg, "Subject"),
+                timestamp=_timestamp(msg),
+                location=key,
+            )
+
+    def load(self, ref: EmailRef) -> Email:
+        return message_to_email(self._mailbox().get_message(ref.location))
+
+    def close(self) -> None:
+        if self._box is not None:
+            self._box.close()
+            self._box = None
+
+
+class MboxSource(_MailboxSource):
+    def _open(self) -> mailbox.Mailbox:
+        # mailbox.mbox keeps only a table of byte offsets and seeks to each message
+        return mailbox.mbox(str(self.path), create=False)
+
+
+class MaildirSource(_MailboxSource):
+    def _open(self) -> mailbox.Mailbox:
+        return mailbox.Maildir(str(self.path), factory=None, create=False)
+
+
+def open_source(path) -> MailSource:
+    """Return the reader matching ``path`` (see module docstring)."""
+    path = Path(path)
+    if path.is_dir():
+        if (path / "cur").is_dir() or (path / "new").is_dir():
+            return MaildirSource(path)
+        raise ValueError(f"{path} is a directory but not a Maildir")
+    suffix = path.suffix.lower()
+    if suffix in (".jsonl", ".ndjson"):
+        return JsonlSource(path)
+    if suffix == ".json":
+        return JsonArraySource(path)
+    return MboxSource(path)
+
+
+def iter_emails(path) -> Iterator[Email]:
+    """Lazily yield every email in ``path``; the source is closed when the iteration ends or is dropped."""
+    with open_source(path) as source:
+        yield from source
@@ -0,0 +1,391 @@
+"""In-process instrumentation for LLM calls.
+
+``run_llm`` and its async/streaming variants report every call here with its
+latency, outcome, model and token usage, tagged with the agent function that
+made it (set with :func:`track_caller` or :func:`llm_caller`). Outcomes:
+
+  - ``network``: a completion from the provider
+  - ``cache``: served from the response cache
+  - ``mock``: no client configured (offline mode)
+  - ``deferred``: the request could not be completed (see
+    ``backend.rate_governor``); the reason is recorded as well
+  - ``rejected``: the provider refused the request (a 4xx error); the
+    reason is recorded as well
+
+The aggregates (counters and latency/token histograms) can be exported as
+Prometheus text or JSON. Set ``EMAIL_AGENT_METRICS=0`` to turn recording off.
+
+Triage runs in other processes (the ingestion worker, ``demo_ingest.py`` and
+its pool workers), so each of them publishes its aggregates with
+:func:`export_metrics` to a shared SQLite file (``data/metrics.sqlite``, or
+``EMAIL_AGENT_METRICS_DB``), one row per process. :func:`shared_metrics`
+adds up every process's row with this process's live numbers; the app's
+panel and its downloads read from there. Rows of processes that stopped
+exporting a week ago are dropped.
+"""
+
+import bisect
+import contextlib
+import contextvars
+import functools
+import inspect
+import json
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+log = logging.getLogger(__name__)
+
+OUTCOMES = ("network", "cache", "mock", "deferred", "rejected")
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+TOKEN_BUCKETS = (16, 64, 128, 256, 512, 1024, 2048, 4096, 8192, 16384)
+
+DEFAULT_METRICS_DB = Path("data") / "metrics.sqlite"
+_RETENTION_SECONDS = 7 * 86400
+# (pid, row id) of this process in the shared file; see _process_id
+_process: Tuple[int, str] = (0, "")
+
+_caller: contextvars.ContextVar[str] = contextvars.ContextVar("llm_caller", default="unknown")
+
+
+def metrics_enabled() -> bool:
+    return os.getenv("EMAIL_AGENT_METRICS", "1").strip().lower() not in ("0", "false", "no", "off")
+
+
+def metrics_db_path() -> Path:
+    return Path(os.getenv("EMAIL_AGENT_METRICS_DB", str(DEFAULT_METRICS_DB)))
+
+
+def current_caller() -> str:
+    return _caller.get()
+
+
+@contextlib.contextmanager
+def llm_caller(name: str):
+    """Attribute the LLM calls made inside the block to ``name``."""
+    token = _caller.set(name)
+    try:
+        yield
+    finally:
+        _caller.reset(token)
+
+
+def track_caller(name: Optional[str] = None):
+    """Decorator: attribute a function's LLM calls to ``name`` (default: its name)."""
+
+    def decorate(fn):
+        label = name or fn.__name__
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                with llm_caller(label):
+                    return await fn(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with llm_caller(label):
+                return fn(*args, **kwargs)
+        return wrapper
+
+    return decorate
+
+
+class Histogram:
+    """Cumulative-bucket histogram in the Prometheus layout."""
+
+    def __init__(self, buckets: Sequence[float]):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # last slot is +Inf
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Estimate a quantile by linear interpolation inside its bucket."""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            if n and seen + n >= rank:
+                lower = self.buckets[i - 1] if i else 0.0
+                if i == len(self.buckets):
+                    return lower
+                return lower + (self.buckets[i] - lower) * (rank - seen) / n
+            seen += n
+        return self.buckets[-1]
+
+    def to_dict(self) -> Dict:
+        return {
+            "buckets": list(self.buckets),
+            "counts": list(self.counts),
+            "count": self.count,
+            "sum": self.sum,
+        }
+
+    def merge(self, data: Dict) -> None:
+        """Add a histogram exported with :meth:`to_dict`; one with other buckets is skipped."""
+        if tuple(data["buckets"]) != self.buckets:
+            return
+        self.counts = [a + b for a, b in zip(self.counts, data["counts"])]
+        self.count += data["count"]
+        self.sum += data["sum"]
+
+
+@dataclass
+class CallerStats:
+    calls: Dict[Tuple[str, str], int] = field(default_factory=dict)  # (model, outcome) -> n
+    fallbacks: Dict[str, int] = field(default_factory=dict)  # mock or deferral reason -> n
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    latency: Histogram = field(default_factory=lambda: Histogram(LATENCY_BUCKETS))
+    tokens: Histogram = field(default_factory=lambda: Histogram(TOKEN_BUCKETS))
+
+
+class LLMMetrics:
+    """Thread-safe aggregates of LLM calls, keyed by calling function."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._callers: Dict[str, CallerStats] = {}
+
+    def record(self, outcome: str, seconds: float, model: str = "", caller: Optional[str] = None,
+               prompt_tokens: int = 0, completion_tokens: int = 0,
+               fallback_reason: Optional[str] = None) -> None:
+        caller = caller or current_caller()
+        with self._lock:
+            stats = self._callers.get(caller)
+            if stats is None:
+                stats = self._callers[caller] = CallerStats()
+            key = (model, outcome)
+            stats.calls[key] = stats.calls.get(key, 0) + 1
+            if fallback_reason:
+                stats.fallbacks[fallback_reason] = stats.fallbacks.get(fallback_reason, 0) + 1
+            stats.latency.observe(seconds)
+            if prompt_tokens or completion_tokens:
+                stats.prompt_tokens += prompt_tokens
+                stats.completion_tokens += completion_tokens
+                stats.tokens.observe(prompt_tokens + completion_tokens)
+
+    def reset(self) -> None:
+        with self._lock:
+            self._callers.clear()
+
+    def to_payload(self) -> Dict[str, Dict[str, Any]]:
+        """Per-caller aggregates as plain data (the ``callers`` of :meth:`to_json`)."""
+        with self._lock:
+            return {
+                caller: {
+                    "calls": [
+                        {"model": model, "outcome": outcome, "count": n}
+                        for (model, outcome), n in sorted(stats.calls.items())
+                    ],
+                    "fallback_reasons": dict(stats.fallbacks),
+                    "prompt_tokens": stats.prompt_tokens,
+                    "completion_tokens": stats.completion_tokens,
+                    "latency_seconds": stats.latency.to_dict(),
+                    "tokens_per_call": stats.tokens.to_dict(),
+                }
+                for caller, stats in sorted(self._callers.items())
+            }
+
+    def merge(self, payload: Dict[str, Dict[str, Any]]) -> None:
+        """Add aggregates from :meth:`to_payload`, e.g. another process's."""
+        with self._lock:
+            for caller, data in payload.items():
+                stats = self._callers.get(caller)
+                if stats is None:
+                    stats = self._callers[caller] = CallerStats()
+                for call in data["calls"]:
+                    key = (call["model"], call["outcome"])
+                    stats.calls[key] = stats.calls.get(key, 0) + call["count"]
+                for reason, n in data["fallback_reasons"].items():
+                    stats.fallbacks[reason] = stats.fallbacks.get(reason, 0) + n
+                stats.prompt_tokens += data["prompt_tokens"]
+                stats.completion_tokens += data["completion_tokens"]
+                stats.latency.merge(data["latency_seconds"])
+                stats.tokens.merge(data["tokens_per_call"])
+
+    def summary(self) -> List[Dict]:
+        """One row per caller, for display."""
+        rows = []
+        with self._lock:
+            for caller, stats in sorted(self._callers.items()):
+                by_outcome = {o: 0 for o in OUTCOMES}
+                for (_model, outcome), n in stats.calls.items():
+                    by_outcome[outcome] = by_outcome.get(outcome, 0) + n
+                total = sum(by_outcome.values())
+                rows.append({
+                    "caller": caller,
+                    "calls": total,
+                    "cache_hit_rate": by_outcome["cache"] / total if total else 0.0,
+                    "deferred": by_outcome["deferred"],
+                    "rejected": by_outcome["rejected"],
+                    "mock": by_outcome["mock"],
+                    "p50_s": stats.latency.quantile(0.5),
+                    "p95_s": stats.latency.quantile(0.95),
+                    "prompt_tokens": stats.prompt_tokens,
+                    "completion_tokens": stats.completion_tokens,
+                })
+        return rows
+
+    def to_json(self) -> str:
+        return json.dumps({"callers": self.to_payload()}, indent=2)
+
+    def to_prometheus(self) -> str:
+        lines = [
+            "# HELP email_agent_llm_calls_total LLM calls by caller, model and outcome.",
+            "# TYPE email_agent_llm_calls_total counter",
+        ]
+        with self._lock:
+            callers = sorted(self._callers.items())
+            for caller, stats in callers:
+                for (model, outcome), n in sorted(stats.calls.items()):
+                    lines.append(f"email_agent_llm_calls_total{_labels(caller=caller, model=model, outcome=outcome)} {n}")
+            lines += [
+                "# HELP email_agent_llm_fallbacks_total LLM calls not answered by the provider, by reason.",
+                "# TYPE email_agent_llm_fallbacks_total counter",
+            ]
+            for caller, stats in callers:
+                for reason, n in sorted(stats.fallbacks.items()):
+                    lines.append(f"email_agent_llm_fallbacks_total{_labels(caller=caller, reason=reason)} {n}")
+            lines += [
+                "# HELP email_agent_llm_tokens_total Tokens reported by the provider.",
+                "# TYPE email_agent_llm_tokens_total counter",
+            ]
+            for caller, stats in callers:
+                lines.append(f"email_agent_llm_tokens_total{_labels(caller=caller, kind='prompt')} {stats.prompt_tokens}")
+                lines.append(f"email_agent_llm_tokens_total{_labels(caller=caller, kind='completion')} {stats.completion_tokens}")
+            for metric, attr, help_text in (
+                ("email_agent_llm_latency_seconds", "latency", "LLM call latency."),
+                ("email_agent_llm_call_tokens", "tokens", "Prompt plus completion tokens per network call."),
+            ):
+                lines += [f"# HELP {metric} {help_text}", f"# TYPE {metric} histogram"]
+                for caller, stats in callers:
+                    lines += _histogram_lines(metric, getattr(stats, attr), caller)
+        return "\n".join(lines) + "\n"
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(**labels) -> str:
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in labels.items()) + "}"
+
+
+def _histogram_lines(metric: str, hist: Histogram, caller: str) -> List[str]:
+    lines = []
+    cumulative = 0
+    for bound, n in zip(list(hist.buckets) + ["+Inf"], hist.counts):
+        cumulative += n
+        lines.append(f"{metric}_bucket{_labels(caller=caller, le=bound)} {cumulative}")
+    lines.append(f"{metric}_sum{_labels(caller=caller)} {hist.sum}")
+    lines.append(f"{metric}_count{_labels(caller=caller)} {hist.count}")
+    return lines
+
+
+_metrics = LLMMetrics()
+
+
+def get_metrics() -> LLMMetrics:
+    """Return the process-wide LLM metrics registry."""
+    return _metrics
+
+
+def record_call(outcome: str, seconds: float, **kwargs) -> None:
+    """Record one LLM call unless metrics are disabled."""
+    if metrics_enabled():
+        _metrics.record(outcome, seconds, **kwargs)
+
+
+def _process_id() -> str:
+    """This process's row in the shared file.
+
+    A pid is reused across restarts, and a forked child inherits its parent's
+    module state, so the id gets a random suffix and is remade after a fork.
+    """
+    global _process
+    pid = os.getpid()
+    if _process[0] != pid:
+        _process = (pid, f"{socket.gethostname()}:{pid}:{uuid.uuid4().hex[:8]}")
+    return _process[1]
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS llm_metrics (
+    process TEXT PRIMARY KEY,
+    updated REAL NOT NULL,
+    payload TEXT NOT NULL
+)
+"""
+
+
+def _connect(path: Path) -> sqlite3.Connection:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(str(path), timeout=30)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute(_SCHEMA)
+    return conn
+
+
+def export_metrics(path: Optional[Path] = None) -> None:
+    """Publish this process's aggregates to the shared metrics file.
+
+    Cheap enough to call at every checkpoint; a failure is logged, not raised.
+    """
+    payload = _metrics.to_payload() if metrics_enabled() else None
+    if not payload:
+        return
+    try:
+        conn = _connect(path or metrics_db_path())
+        try:
+            with conn:
+                now = time.time()
+                conn.execute("INSERT OR REPLACE INTO llm_metrics (process, updated, payload) VALUES (?, ?, ?)",
+                             (_process_id(), now, json.dumps(payload)))
+                conn.execute("DELETE FROM llm_metrics WHERE updated < ?", (now - _RETENTION_SECONDS,))
+        finally:
+            conn.close()
+    except sqlite3.Error:
+        log.warning("Could not export LLM metrics", exc_info=True)
+
+
+def shared_metrics(path: Optional[Path] = None) -> LLMMetrics:
+    """Every process's exported aggregates plus this process's live ones."""
+    merged = LLMMetrics()
+    path = path or metrics_db_path()
+    if path.exists():
+        try:
+            conn = _connect(path)
+            try:
+                rows = conn.execute("SELECT payload FROM llm_metrics WHERE process != ?", (_process_id(),)).fetchall()
+            finally:
+                conn.close()
+        except sqlite3.Error:
+            log.warning("Could not read the shared LLM metrics", exc_info=True)
+            rows = []
+        for (payload,) in rows:
+            merged.merge(json.loads(payload))
+    merged.merge(_metrics.to_payload())
+    return merged
+
+
+def usage_tokens(usage) -> Tuple[int, int]:
+    """(prompt, completion) tokens from a response ``usage`` object, if any."""
+    if usage is None:
+        return 0, 0
+    return getattr(usage, "prompt_tokens", 0) or 0, getattr(usage, "completion_tokens", 0) or 0
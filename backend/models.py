@@ -1,32 +1,53 @@
-﻿from dataclasses import dataclass
+﻿import sys
+from dataclasses import dataclass, field
 from typing import List, Optional, Dict, Any
 
 
-@dataclass
+@dataclass(slots=True)
 class Email:
     id: str
     sender: str
     subject: str
     body: str
     timestamp: str  # ISO string
+    # RFC 822 threading headers, when the source provides them
+    message_id: Optional[str] = None
+    in_reply_to: Optional[str] = None
 
+    def __post_init__(self):
+        # A large inbox has few distinct senders; share one string per sender
+        if isinstance(self.sender, str):
+            self.sender = sys.intern(self.sender)
 
-@dataclass
+
+@dataclass(slots=True)
 class ProcessedEmail:
     email_id: str
     category: str
     action_items: List[Dict[str, Any]]
     summary: Optional[str] = None
+    # Content hash of the email and per-field prompt fingerprints
+    # ("category", "action_items") used to skip unchanged work on re-ingest.
+    email_hash: Optional[str] = None
+    prompt_fingerprints: Dict[str, str] = field(default_factory=dict)
+    # Where a field came from when it wasn't the LLM, keyed by field name,
+    # e.g. {"category": {"source": "rule", "rule": "bulk-senders", ...}}.
+    # A field without an entry was produced by the LLM.
+    provenance: Dict[str, Dict[str, Any]] = field(default_factory=dict)
+
+    def __post_init__(self):
+        if isinstance(self.category, str):
+            self.category = sys.intern(self.category)
 
 
-@dataclass
+@dataclass(slots=True)
 class Prompts:
     categorization_prompt: str
     action_item_prompt: str
     auto_reply_prompt: str
 
 
-@dataclass
+@dataclass(slots=True)
 class Draft:
     id: str
     related_email_id: Optional[str]
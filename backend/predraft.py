@@ -0,0 +1,167 @@
+"""Speculative reply drafts for actionable emails.
+
+After a background ingest job, :func:`predraft_emails` drafts replies for the
+emails triaged into ``EMAIL_AGENT_PREDRAFT_CATEGORIES`` (``Important,To-Do``)
+with :func:`backend.agent.draft_reply`, so "Generate Reply Draft" can show a
+finished draft at once instead of waiting for a full generation.
+
+Drafts are stored as pending (``metadata["status"] == "pending"``) and tagged
+with the fingerprint of the email, the auto-reply prompt and the tone
+(``EMAIL_AGENT_PREDRAFT_TONE``, empty by default). A pending draft is only
+shown when all three still match what the user asks for; otherwise the app
+drafts afresh, and the next run replaces the stale pending draft.
+
+The stage is off unless ``EMAIL_AGENT_PREDRAFT=1``, since every draft is an
+LLM call the user may never need. Each run drafts at most
+``EMAIL_AGENT_PREDRAFT_BUDGET`` (20) emails -- earlier categories in the list
+first, newest first within a category -- and skips emails the user already
+saved a draft for. It stops as soon as the provider defers calls.
+"""
+
+import json
+import logging
+import os
+import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import replace
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterable, List, Mapping, Optional
+
+from . import storage
+from .agent import draft_reply
+from .fingerprints import draft_fingerprint
+from .ingest import ingest_concurrency
+from .models import Draft, Email, ProcessedEmail, Prompts
+from .rate_governor import LLMDeferred
+
+log = logging.getLogger(__name__)
+
+DEFAULT_BUDGET = 20
+DEFAULT_CATEGORIES = ("Important", "To-Do")
+PENDING = "pending"
+
+
+def predraft_enabled() -> bool:
+    return os.getenv("EMAIL_AGENT_PREDRAFT", "0").strip().lower() not in ("", "0", "false", "no", "off")
+
+
+def predraft_budget() -> int:
+    return max(0, int(os.getenv("EMAIL_AGENT_PREDRAFT_BUDGET", DEFAULT_BUDGET)))
+
+
+def predraft_categories() -> List[str]:
+    raw = os.getenv("EMAIL_AGENT_PREDRAFT_CATEGORIES", ",".join(DEFAULT_CATEGORIES))
+    return [c.strip() for c in raw.split(",") if c.strip()]
+
+
+def predraft_tone() -> str:
+    return os.getenv("EMAIL_AGENT_PREDRAFT_TONE", "")
+
+
+def _pending(drafts: Iterable[Draft]) -> Optional[Draft]:
+    return next((d for d in drafts if d.metadata.get("status") == PENDING), None)
+
+
+def pending_draft(email: Email, prompts: Prompts, tone: str = "",
+                  drafts: Optional[List[Draft]] = None) -> Optional[Draft]:
+    """The pending draft for ``email`` if it was made from these exact inputs."""
+    draft = _pending(storage.drafts_for_email(email.id) if drafts is None else drafts)
+    if draft is not None and draft.metadata.get("fingerprint") == draft_fingerprint(email, prompts, tone):
+        return draft
+    return None
+
+
+def claim_pending_draft(email: Email, prompts: Prompts, tone: str = "") -> Optional[Draft]:
+    """Turn a matching pending draft into a regular saved draft and return it."""
+    draft = pending_draft(email, prompts, tone)
+    if draft is None:
+        return None
+    draft = replace(draft, metadata={**draft.metadata, "status": "saved", "predrafted": True})
+    storage.replace_draft(draft)
+    return draft
+
+
+def _parse_draft(raw: str) -> Optional[Dict[str, Any]]:
+    try:
+        data = json.loads(raw)
+    except (TypeError, ValueError):
+        return None
+    return data if isinstance(data, dict) and isinstance(data.get("body"), str) else None
+
+
+def predraft_emails(emails: Iterable[Email], processed: Mapping[str, ProcessedEmail], prompts: Prompts,
+                    budget: Optional[int] = None, tone: Optional[str] = None,
+                    on_progress: Optional[Callable[[int], Any]] = None) -> int:
+    """Draft replies for the actionable ``emails``; returns the number drafted.
+
+    ``on_progress`` is called with the number drafted so far after each
+    stored draft.
+    """
+    budget = predraft_budget() if budget is None else budget
+    tone = predraft_tone() if tone is None else tone
+    rank = {c.lower(): i for i, c in enumerate(predraft_categories())}
+    if budget <= 0 or not rank:
+        return 0
+
+    drafts: Dict[str, List[Draft]] = {}
+    for draft in storage.load_drafts():
+        drafts.setdefault(draft.related_email_id, []).append(draft)
+    candidates = []
+    for email in emails:
+        result = processed.get(email.id)
+        if result is None or result.category.lower() not in rank:
+            continue
+        existing = drafts.get(email.id, [])
+        if any(d.metadata.get("status") != PENDING for d in existing):
+            continue  # the user has drafted a reply already
+        if pending_draft(email, prompts, tone, existing) is not None:
+            continue
+        candidates.append(email)
+    candidates.sort(key=lambda e: e.timestamp, reverse=True)
+    candidates.sort(key=lambda e: rank[processed[e.id].category.lower()])
+    chosen = candidates[:budget]
+    if not chosen:
+        return 0
+
+    drafted = 0
+    with ThreadPoolExecutor(max_workers=min(len(chosen), ingest_concurrency()),
+                            thread_name_prefix="predraft") as pool:
+        futures = {pool.submit(draft_reply, email, prompts, tone): email for email in chosen}
+        for future in as_completed(futures):
+            email = futures[future]
+            if future.cancelled():
+                continue
+            try:
+                data = _parse_draft(future.result())
+            except LLMDeferred as exc:
+                log.info("Provider deferred pre-drafting (%s); stopping after %d draft(s)", exc.reason, drafted)
+                for other in futures:
+                    other.cancel()
+                continue
+            except Exception:
+                log.exception("Failed to pre-draft a reply to email %s", email.id)
+                continue
+            if data is None:
+                log.warning("Unparseable pre-drafted reply to email %s", email.id)
+                continue
+            result = processed[email.id]
+            stale = _pending(drafts.get(email.id, []))
+            storage.replace_draft(Draft(
+                id=stale.id if stale is not None else str(uuid.uuid4()),
+                related_email_id=email.id,
+                subject=data.get("subject") or f"Re: {email.subject}",
+                body=data["body"],
+                metadata={
+                    "status": PENDING,
+                    "fingerprint": draft_fingerprint(email, prompts, tone),
+                    "tone": tone,
+                    "suggested_followups": data.get("suggested_followups", []),
+                    "category": result.category,
+                    "action_items": result.action_items,
+                },
+                created_at=datetime.utcnow().isoformat(),
+            ))
+            drafted += 1
+            if on_progress is not None:
+                on_progress(drafted)
+    return drafted
@@ -0,0 +1,227 @@
+"""Email body preprocessing ahead of the LLM prompts.
+
+Before a body is put in a prompt it is cleaned and measured:
+
+  - quoted history is cut: ``>``-quoted lines, and everything from a reply
+    attribution (``On ... wrote:``, ``-----Original Message-----``, an
+    Outlook ``From:``/``Sent:`` header block) onwards. Forwarded messages
+    are kept, since the forwarded text is usually the point of the email.
+  - the signature is cut: everything after a ``-- `` delimiter, mobile
+    footers ("Sent from my iPhone"), and a closing such as "Best regards,"
+    followed only by a few name, title or contact lines.
+  - tokens are counted with ``tiktoken`` for the configured model when it is
+    installed, else estimated as one token per four characters.
+
+The cleaned body is split into chunks of at most
+``EMAIL_AGENT_PROMPT_TOKEN_BUDGET`` (2000) tokens, on paragraph and line
+boundaries where possible. Single-call prompts use the first chunk, with a
+note of how much was left out. Extraction and chat over a body that needs
+more than one chunk run a map-reduce pass over the first
+``EMAIL_AGENT_MAX_CHUNKS`` (8) chunks instead (see ``backend.agent``).
+Set ``EMAIL_AGENT_PREPROCESS=0`` to send bodies unchanged and uncapped.
+"""
+
+import functools
+import logging
+import os
+import re
+from dataclasses import dataclass
+from typing import List, Optional
+
+from .llm_client import model_settings
+
+# tiktoken is optional; without it token counts are estimated
+try:
+    import tiktoken
+except Exception:  # pragma: no cover - optional import
+    tiktoken = None
+
+log = logging.getLogger(__name__)
+
+DEFAULT_TOKEN_BUDGET = 2000
+DEFAULT_MAX_CHUNKS = 8
+CHARS_PER_TOKEN = 4
+
+_ATTRIBUTION_RE = re.compile(r"^on\b.{0,250}\bwrote:$", re.IGNORECASE)
+_SEPARATOR_RE = re.compile(r"^-{2,}\s*original message\s*-{2,}$|^_{8,}$", re.IGNORECASE)
+_OUTLOOK_FIELD_RE = re.compile(r"^(sent|date|to|subject|cc):", re.IGNORECASE)
+_MOBILE_FOOTER_RE = re.compile(r"^(sent from my \w+|get outlook for \w+|sent from (mail|yahoo mail) for \w+)", re.IGNORECASE)
+# A bare sign-off line ("Best regards,", "Thanks!"); a sentence that merely
+# starts with "Thanks" or "Best" is content.
+_CLOSING_RE = re.compile(
+    r"^(((best|kind|warm|warmest)\s+)?(regards|wishes)"
+    r"|(many\s+)?thanks( again| so much)?|thank you( so much)?|cheers|best|all the best"
+    r"|sincerely|yours( truly| sincerely)?)\s*[,.!]?$",
+    re.IGNORECASE,
+)
+# A closing is only treated as the start of a signature when at most this
+# many short lines follow it, and none of them reads like a sentence.
+_SIGNATURE_LINES = 5
+_SIGNATURE_LINE_CHARS = 60
+# Questions, exclamations, and a line ending in a lowercase word and a full stop
+_SENTENCE_PUNCT_RE = re.compile(r"[?!]|\b[a-z][a-z']+[.;:]\s*$")
+# Pronouns, auxiliaries and common request verbs; name, title and contact
+# lines don't contain them
+_SENTENCE_WORDS = frozenset(
+    "i you we he she it they me us them my your our this that is are was were be been am "
+    "can could will would shall should may might must do does did have has had please let "
+    "send meet meets need needs want get make see call check review book".split()
+)
+
+
+def preprocess_enabled() -> bool:
+    return os.getenv("EMAIL_AGENT_PREPROCESS", "1").strip().lower() not in ("0", "false", "no", "off")
+
+
+def token_budget() -> int:
+    return max(1, int(os.getenv("EMAIL_AGENT_PROMPT_TOKEN_BUDGET", DEFAULT_TOKEN_BUDGET)))
+
+
+def max_chunks() -> int:
+    return max(1, int(os.getenv("EMAIL_AGENT_MAX_CHUNKS", DEFAULT_MAX_CHUNKS)))
+
+
+@functools.lru_cache(maxsize=8)
+def _encoding(model: str):
+    if tiktoken is None:
+        return None
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding("o200k_base")
+
+
+def count_tokens(text: str, model: Optional[str] = None) -> int:
+    """Tokens in ``text`` for ``model`` (default: the configured chat model)."""
+    encoding = _encoding(model or model_settings()[0])
+    if encoding is None:
+        return -(-len(text) // CHARS_PER_TOKEN)
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def _is_outlook_header(lines: List[str], i: int) -> bool:
+    if not lines[i].lower().startswith("from:"):
+        return False
+    following = [l for l in lines[i + 1:i + 4] if l]
+    return any(_OUTLOOK_FIELD_RE.match(l) for l in following)
+
+
+def _is_signature_line(line: str) -> bool:
+    """Whether ``line`` looks like a name, title or contact line rather than content."""
+    if len(line) > _SIGNATURE_LINE_CHARS or _SENTENCE_PUNCT_RE.search(line):
+        return False
+    return not any(word in _SENTENCE_WORDS for word in re.findall(r"[a-z']+", line.lower()))
+
+
+def _strip_signature(lines: List[str]) -> List[str]:
+    stripped = [line.strip() for line in lines]
+    for i, line in enumerate(stripped):
+        if line == "--" or _MOBILE_FOOTER_RE.match(line):
+            return lines[:i]
+    content = [i for i, line in enumerate(stripped) if line]
+    # Only a closing after the last line of content starts a signature
+    for i in content[-(_SIGNATURE_LINES + 1):]:
+        tail = [l for l in stripped[i + 1:] if l]
+        if (_CLOSING_RE.match(stripped[i]) and len(stripped[i]) <= _SIGNATURE_LINE_CHARS
+                and len(tail) <= _SIGNATURE_LINES and all(map(_is_signature_line, tail))):
+            return lines[:i]
+    return lines
+
+
+def clean_body(body: str) -> str:
+    """``body`` without quoted history and signature.
+
+    If nothing is left (an email that is all quote), the body is returned
+    with only surrounding whitespace removed.
+    """
+    raw = (body or "").replace("\r\n", "\n").replace("\r", "\n")
+    lines = [line.rstrip() for line in raw.split("\n")]
+    stripped = [line.strip() for line in lines]
+    kept: List[str] = []
+    for i, line in enumerate(stripped):
+        joined = f"{line} {stripped[i + 1]}" if i + 1 < len(stripped) else line
+        if (_SEPARATOR_RE.match(line) or _ATTRIBUTION_RE.match(line)
+                or (line.lower().startswith("on ") and _ATTRIBUTION_RE.match(joined))
+                or _is_outlook_header(stripped, i)):
+            break
+        if line.startswith(">"):
+            continue
+        kept.append(lines[i])
+    kept = _strip_signature(kept)
+    text = re.sub(r"\n{3,}", "\n\n", "\n".join(kept)).strip()
+    return text or raw.strip()
+
+
+def _split_long(text: str, budget: int, model: str) -> List[str]:
+    """Hard-split a paragraph or line with no usable break points."""
+    encoding = _encoding(model)
+    if encoding is None:
+        size = budget * CHARS_PER_TOKEN
+        return [text[i:i + size] for i in range(0, len(text), size)]
+    tokens = encoding.encode(text, disallowed_special=())
+    return [encoding.decode(tokens[i:i + budget]) for i in range(0, len(tokens), budget)]
+
+
+def chunk_text(text: str, budget: int, model: Optional[str] = None) -> List[str]:
+    """Split ``text`` into pieces of at most ``budget`` tokens.
+
+    Paragraphs are packed greedily; a paragraph over the budget is split by
+    lines, and a line over the budget is split by tokens.
+    """
+    model = model or model_settings()[0]
+    if count_tokens(text, model) <= budget:
+        return [text]
+    pieces: List[str] = []
+    for paragraph in re.split(r"\n\s*\n", text):
+        if count_tokens(paragraph, model) <= budget:
+            pieces.append(paragraph)
+            continue
+        for line in paragraph.split("\n"):
+            pieces.extend([line] if count_tokens(line, model) <= budget else _split_long(line, budget, model))
+
+    chunks: List[str] = []
+    current: List[str] = []
+    used = 0
+    for piece in pieces:
+        size = count_tokens(piece, model) + 1
+        if current and used + size > budget:
+            chunks.append("\n".join(current))
+            current, used = [], 0
+        current.append(piece)
+        used += size
+    if current:
+        chunks.append("\n".join(current))
+    return chunks
+
+
+@dataclass
+class PreparedBody:
+    text: str  # cleaned body, capped at the token budget
+    tokens: int  # tokens in the cleaned body before capping
+    chunks: List[str]  # budget-sized pieces of the cleaned body
+
+    @property
+    def over_budget(self) -> bool:
+        return len(self.chunks) > 1
+
+
+@functools.lru_cache(maxsize=256)
+def _prepare(body: str, budget: int, model: str) -> PreparedBody:
+    text = clean_body(body)
+    tokens = count_tokens(text, model)
+    if tokens <= budget:
+        return PreparedBody(text, tokens, [text])
+    chunks = chunk_text(text, budget, model)
+    omitted = tokens - count_tokens(chunks[0], model)
+    log.debug("Email body of %d tokens split into %d chunks", tokens, len(chunks))
+    return PreparedBody(f"{chunks[0]}\n[... {omitted} more tokens not shown ...]", tokens, chunks)
+
+
+def prepare_body(body: str, budget: Optional[int] = None) -> PreparedBody:
+    """Clean ``body`` and fit it to ``budget`` tokens (default: the configured budget).
+
+    Results are cached, since one email is usually prepared for several prompts.
+    """
+    if not preprocess_enabled():
+        return PreparedBody(body, count_tokens(body), [body])
+    return _prepare(body or "", budget or token_budget(), model_settings()[0])
@@ -0,0 +1,323 @@
+"""Adaptive rate governor for provider calls.
+
+Every network completion in ``backend.llm_client`` goes through
+:meth:`RateGovernor.call`, which combines:
+
+  - token buckets for requests per minute (``EMAIL_AGENT_LLM_RPM``, 500) and
+    tokens per minute (``EMAIL_AGENT_LLM_TPM``, 200000; estimated from the
+    prompt, then corrected with the usage the provider reports). Set either
+    to 0 to disable it.
+  - AIMD concurrency: up to ``EMAIL_AGENT_LLM_MAX_CONCURRENCY`` (32) calls in
+    flight. The limit grows by about one per round of successful calls and
+    halves when the provider pushes back (429, 503, timeouts).
+  - retries of transient failures, up to ``EMAIL_AGENT_LLM_RETRIES`` (4)
+    times, with exponential backoff and full jitter, waiting at least as long
+    as a ``Retry-After`` hint asks.
+  - a circuit breaker: after ``EMAIL_AGENT_LLM_BREAKER_FAILURES`` (5) failed
+    calls in a row it opens for ``EMAIL_AGENT_LLM_BREAKER_COOLDOWN`` (30)
+    seconds, and calls fail fast until one probe call succeeds.
+
+A streamed completion holds its concurrency slot until the stream ends and
+only then counts as a success, or as a failure when it breaks part-way
+(:meth:`RateGovernor.finish`).
+
+A call that cannot be completed raises :class:`LLMDeferred` rather than
+producing a made-up answer; ingestion records such emails as deferred and
+leaves them for the next run. A request the provider rejects as invalid
+(400, 401, 403, 404, 422) raises :class:`LLMRejected` instead: it is not
+retried, later runs would fail the same way, and it does not count towards
+the circuit breaker, since the provider itself is answering.
+"""
+
+import logging
+import os
+import random
+import threading
+import time
+from typing import Callable, Optional, Tuple, TypeVar
+
+log = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+DEFAULT_RPM = 500
+DEFAULT_TPM = 200_000
+DEFAULT_MAX_CONCURRENCY = 32
+DEFAULT_RETRIES = 4
+DEFAULT_BREAKER_FAILURES = 5
+DEFAULT_BREAKER_COOLDOWN = 30.0
+BASE_DELAY = 0.5
+MAX_DELAY = 60.0
+# Concurrency is halved at most once per window, however many in-flight
+# calls fail together
+DECREASE_WINDOW = 1.0
+
+_OVERLOAD_STATUS = (408, 429, 503, 504)
+_FATAL_STATUS = (400, 401, 403, 404, 422)
+
+
+class LLMDeferred(Exception):
+    """The provider could not complete the call now; retry the work later."""
+
+    def __init__(self, reason: str):
+        super().__init__(reason)
+        self.reason = reason
+
+
+class LLMRejected(Exception):
+    """The provider refused the request itself; retrying it will not help."""
+
+    def __init__(self, reason: str, status: Optional[int] = None):
+        super().__init__(reason if status is None else f"{reason} (HTTP {status})")
+        self.reason = reason
+        self.status = status
+
+
+def _status_code(exc: BaseException) -> Optional[int]:
+    code = getattr(exc, "status_code", None)
+    if code is None:
+        code = getattr(getattr(exc, "response", None), "status_code", None)
+    return code if isinstance(code, int) else None
+
+
+def retry_after(exc: BaseException) -> Optional[float]:
+    """Seconds the provider asked us to wait, from ``Retry-After`` style headers."""
+    headers = getattr(getattr(exc, "response", None), "headers", None)
+    if not headers:
+        return None
+    for name, scale in (("retry-after-ms", 0.001), ("retry-after", 1.0)):
+        value = headers.get(name)
+        if value is None:
+            continue
+        try:
+            return max(0.0, float(value) * scale)
+        except (TypeError, ValueError):
+            continue  # an HTTP date; fall back to our own backoff
+    return None
+
+
+def classify(exc: BaseException) -> str:
+    """``overload`` (back off and slow down), ``transient`` (retry) or ``fatal``."""
+    code = _status_code(exc)
+    name = type(exc).__name__
+    if code in _OVERLOAD_STATUS or "RateLimit" in name or "Timeout" in name:
+        return "overload"
+    if code in _FATAL_STATUS:
+        return "fatal"
+    if code is not None and code >= 500 or "Connection" in name or isinstance(exc, (ConnectionError, OSError)):
+        return "transient"
+    return "fatal" if code is not None else "transient"
+
+
+class TokenBucket:
+    """``rate`` units per second, bursting up to ``capacity``.
+
+    :meth:`reserve` always takes the amount, letting the level go negative,
+    and tells the caller how long to wait; callers queue up fairly and a
+    request larger than the bucket still gets through eventually.
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self._level = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill_locked(self) -> None:
+        now = time.monotonic()
+        self._level = min(self.capacity, self._level + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def reserve(self, amount: float) -> float:
+        with self._lock:
+            self._refill_locked()
+            self._level -= amount
+            return 0.0 if self._level >= 0 else -self._level / self.rate
+
+    def adjust(self, amount: float) -> None:
+        """Take ``amount`` more (or give it back when negative)."""
+        with self._lock:
+            self._refill_locked()
+            self._level = min(self.capacity, self._level - amount)
+
+
+class AdaptiveLimiter:
+    """Additive-increase / multiplicative-decrease cap on calls in flight."""
+
+    def __init__(self, maximum: int, minimum: int = 1):
+        self.maximum = maximum
+        self.minimum = minimum
+        self.limit = float(maximum)
+        self.inflight = 0
+        self._last_decrease = 0.0
+        self._cond = threading.Condition()
+
+    def acquire(self) -> None:
+        with self._cond:
+            while self.inflight >= int(self.limit):
+                self._cond.wait()
+            self.inflight += 1
+
+    def release(self, overloaded: bool = False) -> None:
+        with self._cond:
+            self.inflight -= 1
+            now = time.monotonic()
+            if overloaded:
+                if now - self._last_decrease >= DECREASE_WINDOW:
+                    self.limit = max(float(self.minimum), self.limit / 2)
+                    self._last_decrease = now
+                    log.info("Provider overloaded; LLM concurrency limit lowered to %d", int(self.limit))
+            else:
+                self.limit = min(float(self.maximum), self.limit + 1 / self.limit)
+            self._cond.notify_all()
+
+
+class CircuitBreaker:
+    """Closed -> open after ``threshold`` consecutive failures -> half-open after ``cooldown``."""
+
+    def __init__(self, threshold: int = DEFAULT_BREAKER_FAILURES, cooldown: float = DEFAULT_BREAKER_COOLDOWN):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.state = "closed"
+        self._opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == "closed":
+                return True
+            if self.state == "open" and time.monotonic() - self._opened_at >= self.cooldown:
+                self.state = "half_open"
+            if self.state == "half_open" and not self._probing:
+                self._probing = True
+                return True
+            return False
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.failures = 0
+            self.state = "closed"
+            self._probing = False
+
+    def record_neutral(self) -> None:
+        """A call that says nothing about the provider's health (a rejected request)."""
+        with self._lock:
+            self._probing = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            self._probing = False
+            if self.state == "half_open" or self.failures >= self.threshold:
+                if self.state != "open":
+                    log.warning("LLM circuit breaker opened after %d failure(s)", self.failures)
+                self.state = "open"
+                self._opened_at = time.monotonic()
+
+
+class RateGovernor:
+    """Rate limits, adaptive concurrency, retries and circuit breaking around provider calls."""
+
+    def __init__(self, rpm: float = DEFAULT_RPM, tpm: float = DEFAULT_TPM,
+                 max_concurrency: int = DEFAULT_MAX_CONCURRENCY, retries: int = DEFAULT_RETRIES,
+                 breaker_failures: int = DEFAULT_BREAKER_FAILURES,
+                 breaker_cooldown: float = DEFAULT_BREAKER_COOLDOWN,
+                 sleep: Callable[[float], None] = time.sleep):
+        self.requests = TokenBucket(rpm / 60, rpm / 60 * 10) if rpm else None
+        self.tokens = TokenBucket(tpm / 60, tpm / 60 * 10) if tpm else None
+        self.limiter = AdaptiveLimiter(max_concurrency)
+        self.breaker = CircuitBreaker(breaker_failures, breaker_cooldown)
+        self.retries = retries
+        self._sleep = sleep
+
+    def _backoff(self, attempt: int, exc: BaseException) -> float:
+        delay = random.uniform(0, min(MAX_DELAY, BASE_DELAY * 2 ** attempt))
+        hint = retry_after(exc)
+        return min(MAX_DELAY, max(delay, hint)) if hint is not None else delay
+
+    def call(self, fn: Callable[[], T], estimated_tokens: int = 0, hold: bool = False) -> T:
+        """Run ``fn`` (one provider request) under the governor.
+
+        Raises :class:`LLMDeferred` when the breaker is open or the request
+        still failed after the allowed retries, and :class:`LLMRejected`
+        when the provider refused the request.
+
+        With ``hold`` (a stream) the call keeps its concurrency slot once
+        ``fn`` returns and its outcome is left open; the caller must report
+        it with :meth:`finish` when the stream ends.
+        """
+        for attempt in range(self.retries + 1):
+            if not self.breaker.allow():
+                raise LLMDeferred("circuit_open")
+            wait = max(self.requests.reserve(1) if self.requests else 0.0,
+                       self.tokens.reserve(estimated_tokens) if self.tokens else 0.0)
+            if wait > 0:
+                self._sleep(wait)
+            self.limiter.acquire()
+            try:
+                result = fn()
+            except Exception as exc:
+                kind = classify(exc)
+                self.limiter.release(overloaded=kind == "overload")
+                if kind == "fatal":
+                    self.breaker.record_neutral()
+                    log.error("LLM request rejected: %s", exc)
+                    raise LLMRejected(type(exc).__name__, _status_code(exc)) from exc
+                self.breaker.record_failure()
+                if attempt == self.retries:
+                    raise LLMDeferred(type(exc).__name__) from exc
+                delay = self._backoff(attempt, exc)
+                log.warning("LLM call failed (%s); retry %d/%d in %.1fs", type(exc).__name__,
+                            attempt + 1, self.retries, delay)
+                self._sleep(delay)
+                continue
+            if not hold:
+                self.finish()
+            return result
+        raise AssertionError("unreachable")  # pragma: no cover
+
+    def finish(self, exc: Optional[BaseException] = None) -> None:
+        """Release a held call, counting ``exc`` (raised while reading it) as a failure."""
+        kind = classify(exc) if exc is not None else None
+        self.limiter.release(overloaded=kind == "overload")
+        if kind is None:
+            self.breaker.record_success()
+        elif kind == "fatal":
+            self.breaker.record_neutral()
+        else:
+            self.breaker.record_failure()
+
+    def settle(self, estimated_tokens: int, actual_tokens: int) -> None:
+        """Correct the token bucket once the provider reports real usage."""
+        if self.tokens is not None and actual_tokens:
+            self.tokens.adjust(actual_tokens - estimated_tokens)
+
+
+def _governor_settings() -> Tuple:
+    return (
+        float(os.getenv("EMAIL_AGENT_LLM_RPM", DEFAULT_RPM)),
+        float(os.getenv("EMAIL_AGENT_LLM_TPM", DEFAULT_TPM)),
+        max(1, int(os.getenv("EMAIL_AGENT_LLM_MAX_CONCURRENCY", DEFAULT_MAX_CONCURRENCY))),
+        max(0, int(os.getenv("EMAIL_AGENT_LLM_RETRIES", DEFAULT_RETRIES))),
+        max(1, int(os.getenv("EMAIL_AGENT_LLM_BREAKER_FAILURES", DEFAULT_BREAKER_FAILURES))),
+        float(os.getenv("EMAIL_AGENT_LLM_BREAKER_COOLDOWN", DEFAULT_BREAKER_COOLDOWN)),
+    )
+
+
+_governor: Optional[RateGovernor] = None
+_governor_key: Optional[Tuple] = None
+_governor_lock = threading.Lock()
+
+
+def get_governor() -> RateGovernor:
+    """Return the process-wide governor, rebuilt when its settings change."""
+    global _governor, _governor_key
+    settings = _governor_settings()
+    with _governor_lock:
+        if settings != _governor_key:
+            _governor = RateGovernor(*settings)
+            _governor_key = settings
+        return _governor
@@ -0,0 +1,220 @@
+"""Rule-based fast path that triages obvious mail without calling the LLM.
+
+Rules are read from ``data/rules.json`` (override with
+``EMAIL_AGENT_RULES_PATH``). Each rule assigns a category and has any of
+these matchers; it fires when at least one of them hits:
+
+  - ``senders``: exact sender addresses
+  - ``domains``: sender domains; subdomains match too
+  - ``headers``: ``{field: regex}`` over ``sender``, ``subject``,
+    ``message_id`` or ``in_reply_to``
+  - ``keywords``: phrases searched (case-insensitively, on word boundaries)
+    in the subject and body; at least ``min_matches`` distinct phrases must
+    appear
+
+The keywords of every rule are compiled into one alternation regex, so an
+email's text is scanned once however many rules there are.
+
+A rule carries a ``confidence`` (default 1.0). Only rules at or above
+``EMAIL_AGENT_RULE_MIN_CONFIDENCE`` (0.9) are used. If firing rules disagree
+on the category the email is left to the LLM. A match records which rule
+fired and what it matched, so every rule-derived result can be audited.
+Set ``EMAIL_AGENT_RULES=0`` to turn the fast path off.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Pattern, Tuple
+
+from .models import Email
+
+log = logging.getLogger(__name__)
+
+DEFAULT_RULES_PATH = Path("data") / "rules.json"
+DEFAULT_MIN_CONFIDENCE = 0.9
+HEADER_FIELDS = ("sender", "subject", "message_id", "in_reply_to")
+
+
+def rules_enabled() -> bool:
+    return os.getenv("EMAIL_AGENT_RULES", "1").strip().lower() not in ("0", "false", "no", "off")
+
+
+def rules_path() -> Path:
+    return Path(os.getenv("EMAIL_AGENT_RULES_PATH", str(DEFAULT_RULES_PATH)))
+
+
+def min_confidence() -> float:
+    return float(os.getenv("EMAIL_AGENT_RULE_MIN_CONFIDENCE", DEFAULT_MIN_CONFIDENCE))
+
+
+@dataclass
+class Rule:
+    name: str
+    category: str
+    confidence: float = 1.0
+    senders: List[str] = field(default_factory=list)
+    domains: List[str] = field(default_factory=list)
+    headers: Dict[str, str] = field(default_factory=dict)
+    keywords: List[str] = field(default_factory=list)
+    min_matches: int = 1
+
+
+@dataclass
+class RuleMatch:
+    rule: str
+    category: str
+    confidence: float
+    matched: List[str]
+    rules_fingerprint: str
+
+    def provenance(self) -> Dict[str, Any]:
+        """Per-field provenance entry stored on ``ProcessedEmail``."""
+        return {
+            "source": "rule",
+            "rule": self.rule,
+            "confidence": self.confidence,
+            "matched": list(self.matched),
+            "rules": self.rules_fingerprint,
+        }
+
+
+def _sender_address(sender: str) -> str:
+    """``Jane <jane@x.com>`` -> ``jane@x.com`` (lower-cased)."""
+    sender = (sender or "").strip().lower()
+    if "<" in sender and sender.endswith(">"):
+        sender = sender[sender.rindex("<") + 1:-1]
+    return sender
+
+
+class RuleEngine:
+    """A compiled rule set."""
+
+    def __init__(self, rules: List[Rule], threshold: float = DEFAULT_MIN_CONFIDENCE):
+        self.rules = [r for r in rules if r.confidence >= threshold]
+        self.threshold = threshold
+        canonical = json.dumps([asdict(r) for r in rules], sort_keys=True) + f"|{threshold}"
+        self.fingerprint = hashlib.sha256(canonical.encode("utf-8")).hexdigest()[:16]
+
+        self._senders: Dict[str, List[int]] = {}
+        self._domains: Dict[str, List[int]] = {}
+        self._headers: Dict[str, List[Tuple[Pattern, int]]] = {}
+        self._keyword_rules: Dict[str, List[int]] = {}
+        for i, rule in enumerate(self.rules):
+            for sender in rule.senders:
+                self._senders.setdefault(sender.strip().lower(), []).append(i)
+            for domain in rule.domains:
+                self._domains.setdefault(domain.strip().lower().lstrip("@."), []).append(i)
+            for name, pattern in rule.headers.items():
+                if name not in HEADER_FIELDS:
+                    raise ValueError(f"Rule {rule.name!r}: unknown header field {name!r}")
+                try:
+                    compiled = re.compile(pattern, re.IGNORECASE)
+                except re.error as exc:
+                    raise ValueError(f"Rule {rule.name!r}: bad pattern for {name}: {exc}") from None
+                self._headers.setdefault(name, []).append((compiled, i))
+            for keyword in rule.keywords:
+                self._keyword_rules.setdefault(" ".join(keyword.lower().split()), []).append(i)
+
+        # One pass over the text finds every keyword of every rule; longer
+        # phrases go first so "click here now" wins over "click here".
+        keywords = sorted(self._keyword_rules, key=len, reverse=True)
+        self._keyword_re = re.compile(
+            r"(?<!\w)(?:" + "|".join(r"\s+".join(map(re.escape, k.split())) for k in keywords) + r")(?!\w)"
+        ) if keywords else None
+
+    def __len__(self) -> int:
+        return len(self.rules)
+
+    def match(self, email: Email) -> Optional[RuleMatch]:
+        """Return the decisive rule match for ``email``, or None to use the LLM."""
+        if not self.rules:
+            return None
+        hits: Dict[int, List[str]] = {}
+        address = _sender_address(email.sender)
+        for i in self._senders.get(address, ()):
+            hits.setdefault(i, []).append(f"sender:{address}")
+        domain = address.rpartition("@")[2]
+        while domain:
+            for i in self._domains.get(domain, ()):
+                hits.setdefault(i, []).append(f"domain:{domain}")
+            domain = domain.partition(".")[2]
+        for name, patterns in self._headers.items():
+            value = getattr(email, name, None) or ""
+            for pattern, i in patterns:
+                if pattern.search(value):
+                    hits.setdefault(i, []).append(f"{name}:/{pattern.pattern}/")
+        if self._keyword_re is not None:
+            text = f"{email.subject}\n{email.body}".lower()
+            found = {" ".join(m.group(0).split()) for m in self._keyword_re.finditer(text)}
+            per_rule: Dict[int, List[str]] = {}
+            for keyword in sorted(found):
+                for i in self._keyword_rules[keyword]:
+                    per_rule.setdefault(i, []).append(keyword)
+            for i, keywords in per_rule.items():
+                if len(keywords) >= self.rules[i].min_matches:
+                    hits.setdefault(i, []).extend(f"keyword:{k}" for k in keywords)
+
+        if not hits:
+            return None
+        categories = {self.rules[i].category for i in hits}
+        if len(categories) > 1:
+            log.debug("Rules disagree on email %s (%s); deferring to the LLM", email.id, sorted(categories))
+            return None
+        best = max(hits, key=lambda i: (self.rules[i].confidence, -i))
+        rule = self.rules[best]
+        return RuleMatch(rule.name, rule.category, rule.confidence, hits[best], self.fingerprint)
+
+
+def load_rules(path: Optional[Path] = None) -> List[Rule]:
+    """Read the rule list from ``path``; a missing file means no rules."""
+    path = Path(path or rules_path())
+    if not path.exists():
+        return []
+    with open(path, "r", encoding="utf-8") as f:
+        payload = json.load(f)
+    rules = []
+    for raw in payload.get("rules", []):
+        try:
+            rules.append(Rule(**raw))
+        except TypeError as exc:
+            raise ValueError(f"Invalid rule {raw.get('name', '?')!r} in {path}: {exc}") from None
+    return rules
+
+
+_engine: Optional[RuleEngine] = None
+_engine_key: Optional[Tuple] = None
+_engine_lock = threading.Lock()
+
+
+def get_rule_engine() -> Optional[RuleEngine]:
+    """Return the compiled rule set, or None when the fast path is disabled.
+
+    The file is recompiled when it changes on disk or the threshold changes.
+    """
+    global _engine, _engine_key
+    if not rules_enabled():
+        return None
+    path = rules_path()
+    try:
+        st = path.stat()
+        key = (str(path), st.st_mtime_ns, st.st_size, min_confidence())
+    except OSError:
+        key = (str(path), None, None, min_confidence())
+    with _engine_lock:
+        if key != _engine_key:
+            _engine = RuleEngine(load_rules(path), threshold=key[3])
+            _engine_key = key
+            log.info("Loaded %d triage rule(s) from %s", len(_engine), path)
+        return _engine
+
+
+def match_rules(email: Email) -> Optional[RuleMatch]:
+    """Match ``email`` against the configured rules (None if no decisive match)."""
+    engine = get_rule_engine()
+    return engine.match(email) if engine is not None else None
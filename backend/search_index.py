@@ -0,0 +1,341 @@
+"""Inverted full-text index over the inbox.
+
+Subject, sender, body and the processed category are tokenized into one
+posting list per token, weighted by field (a subject hit counts more than a
+body hit). Queries are ranked with tf-idf and accept field filters:
+
+  ``invoice category:To-Do from:hr@``
+
+``category:`` matches the processed category exactly (case-insensitive) and
+``from:`` (or ``sender:``) matches a substring of the sender address. Filter
+values containing spaces can be quoted: ``category:"Follow up"``.
+
+The index is updated incrementally: :meth:`SearchIndex.sync_refs` walks the
+inbox refs and loads only new or changed messages, and a new processed
+category is applied with :meth:`SearchIndex.set_category` without touching
+the body. It is persisted as ``data/search_index.json``, at most every
+``EMAIL_AGENT_INDEX_SAVE_SECONDS`` (30) seconds while it keeps changing
+(:meth:`SearchIndex.save_if_due`) and when the process exits.
+"""
+
+import atexit
+import hashlib
+import heapq
+import json
+import math
+import os
+import re
+import threading
+import time
+from collections import Counter
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Mapping, Optional, Set, Tuple
+
+from .fingerprints import email_fingerprint
+from .mail_sources import EmailRef
+from .models import Email, ProcessedEmail
+
+DEFAULT_INDEX_PATH = Path("data") / "search_index.json"
+DEFAULT_SAVE_SECONDS = 30.0
+
+FIELD_WEIGHTS = {"subject": 3.0, "sender": 2.0, "category": 2.0, "body": 1.0}
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+_QUERY_RE = re.compile(r'(\w+):("[^"]*"|\S+)|"([^"]*)"|(\S+)')
+
+
+def tokenize(text: str) -> List[str]:
+    return _TOKEN_RE.findall(text.lower())
+
+
+def save_seconds() -> float:
+    return float(os.getenv("EMAIL_AGENT_INDEX_SAVE_SECONDS", DEFAULT_SAVE_SECONDS))
+
+
+def _ref_key(ref: EmailRef) -> str:
+    """Short hash of a message's headers and place in its source, to spot changed messages."""
+    text = "\x1f".join((ref.sender, ref.subject, ref.timestamp, repr(ref.location)))
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=8).hexdigest()
+
+
+def _category_of(processed: Mapping[str, ProcessedEmail], email_id: str) -> Optional[str]:
+    result = processed.get(email_id)
+    return result.category if result is not None else None
+
+
+@dataclass
+class SearchHit:
+    email_id: str
+    score: float
+
+
+class SearchIndex:
+    """Field-weighted inverted index with incremental updates."""
+
+    def __init__(self):
+        # token -> {email_id: field-weighted term frequency}
+        self._postings: Dict[str, Dict[str, float]] = {}
+        # email_id -> stored document (weights, sender, category, fingerprint)
+        self._docs: Dict[str, dict] = {}
+        # lower-cased category -> ids, and lower-cased sender -> ids, for filters
+        self._by_category: Dict[str, Set[str]] = {}
+        self._by_sender: Dict[str, Set[str]] = {}
+        self._lock = threading.RLock()
+        # Changed since the last save, and when that save happened (monotonic)
+        self._dirty = False
+        self._saved_at = 0.0
+
+    def __len__(self) -> int:
+        return len(self._docs)
+
+    # updates ----------------------------------------------------------
+
+    def add(self, email: Email, category: Optional[str] = None, ref: Optional[EmailRef] = None) -> None:
+        """Index (or re-index) one email with its processed category.
+
+        ``ref`` is the email's inbox ref, remembered so :meth:`sync_refs` can
+        tell whether the message changed without reading it.
+        """
+        weights: Counter = Counter()
+        for field_name, text in (("subject", email.subject), ("sender", email.sender),
+                                 ("body", email.body), ("category", category or "")):
+            for token in tokenize(text):
+                weights[token] += FIELD_WEIGHTS[field_name]
+        doc = {
+            "weights": dict(weights),
+            "length": sum(weights.values()),
+            "sender": email.sender.lower(),
+            "category": (category or "").lower(),
+            "fingerprint": email_fingerprint(email),
+        }
+        if ref is not None:
+            doc["ref"] = _ref_key(ref)
+        with self._lock:
+            self._remove_locked(email.id)
+            self._insert_locked(email.id, doc)
+
+    def remove(self, email_id: str) -> None:
+        with self._lock:
+            self._remove_locked(email_id)
+
+    def update_category(self, email: Email, category: Optional[str]) -> None:
+        """Refresh an email after (re-)processing; a no-op when nothing changed."""
+        doc = self._docs.get(email.id)
+        if doc is None or doc["fingerprint"] != email_fingerprint(email):
+            self.add(email, category)
+        else:
+            self.set_category(email.id, category)
+
+    def set_category(self, email_id: str, category: Optional[str]) -> bool:
+        """Change the category of an indexed email without its body; returns whether it changed."""
+        new = (category or "").lower()
+        with self._lock:
+            doc = self._docs.get(email_id)
+            if doc is None or doc["category"] == new:
+                return False
+            weights = Counter(doc["weights"])
+            for token in tokenize(doc["category"]):
+                weights[token] -= FIELD_WEIGHTS["category"]
+            for token in tokenize(new):
+                weights[token] += FIELD_WEIGHTS["category"]
+            weights = {t: w for t, w in weights.items() if w > 0}
+            self._remove_locked(email_id)
+            self._insert_locked(email_id, dict(doc, weights=weights, length=sum(weights.values()), category=new))
+            return True
+
+    def sync(self, emails: Iterable[Email], processed: Mapping[str, ProcessedEmail]) -> int:
+        """Bring the index in line with ``emails``; returns the number of changes."""
+        changes = 0
+        seen = set()
+        for email in emails:
+            seen.add(email.id)
+            category = _category_of(processed, email.id)
+            doc = self._docs.get(email.id)
+            if doc is None or doc["fingerprint"] != email_fingerprint(email):
+                self.add(email, category)
+                changes += 1
+            elif self.set_category(email.id, category):
+                changes += 1
+        return changes + self._remove_missing(seen)
+
+    def sync_refs(self, refs: Iterable[EmailRef], load: Callable[[EmailRef], Email],
+                  processed: Mapping[str, ProcessedEmail]) -> int:
+        """:meth:`sync` from inbox refs: only new or changed messages are loaded with ``load``."""
+        changes = 0
+        seen = set()
+        for ref in refs:
+            seen.add(ref.id)
+            category = _category_of(processed, ref.id)
+            doc = self._docs.get(ref.id)
+            if doc is None or doc.get("ref") != _ref_key(ref):
+                self.add(load(ref), category, ref)
+                changes += 1
+            elif self.set_category(ref.id, category):
+                changes += 1
+        return changes + self._remove_missing(seen)
+
+    def sync_categories(self, processed: Mapping[str, ProcessedEmail]) -> int:
+        """Apply the categories in ``processed`` to every indexed email; returns the number changed."""
+        with self._lock:
+            return sum(self.set_category(i, _category_of(processed, i)) for i in list(self._docs))
+
+    def _remove_missing(self, seen: Set[str]) -> int:
+        with self._lock:
+            missing = [i for i in self._docs if i not in seen]
+            for email_id in missing:
+                self._remove_locked(email_id)
+        return len(missing)
+
+    def _insert_locked(self, email_id: str, doc: dict) -> None:
+        self._dirty = True
+        self._docs[email_id] = doc
+        for token, weight in doc["weights"].items():
+            self._postings.setdefault(token, {})[email_id] = weight
+        self._by_category.setdefault(doc["category"], set()).add(email_id)
+        self._by_sender.setdefault(doc["sender"], set()).add(email_id)
+
+    def _remove_locked(self, email_id: str) -> None:
+        doc = self._docs.pop(email_id, None)
+        if doc is None:
+            return
+        self._dirty = True
+        for token in doc["weights"]:
+            posting = self._postings.get(token)
+            if posting is not None:
+                posting.pop(email_id, None)
+                if not posting:
+                    del self._postings[token]
+        for table, key in ((self._by_category, doc["category"]), (self._by_sender, doc["sender"])):
+            ids = table.get(key)
+            if ids is not None:
+                ids.discard(email_id)
+                if not ids:
+                    del table[key]
+
+    # queries ----------------------------------------------------------
+
+    @staticmethod
+    def parse_query(query: str) -> Tuple[List[str], Dict[str, str]]:
+        """Split a query into free-text tokens and ``field:value`` filters."""
+        terms: List[str] = []
+        filters: Dict[str, str] = {}
+        for name, value, quoted, word in _QUERY_RE.findall(query):
+            if name and name.lower() in ("category", "from", "sender"):
+                key = "from" if name.lower() == "sender" else name.lower()
+                filters[key] = value.strip('"').lower()
+            elif name:
+                terms.extend(tokenize(f"{name} {value}"))
+            else:
+                terms.extend(tokenize(quoted or word))
+        return terms, filters
+
+    def search(self, query: str, limit: int = 50) -> List[SearchHit]:
+        """Return up to ``limit`` hits ranked by tf-idf, best first.
+
+        Every free-text term must match (AND semantics). A query made only of
+        filters returns the matching emails in index order with score 0.
+        """
+        terms, filters = self.parse_query(query)
+        with self._lock:
+            allowed = self._filter_ids(filters)
+            if not terms:
+                if allowed is None:
+                    return []
+                ids = [i for i in self._docs if i in allowed]
+                return [SearchHit(i, 0.0) for i in ids[:limit]]
+
+            postings = []
+            for term in set(terms):
+                posting = self._postings.get(term)
+                if not posting:
+                    return []
+                postings.append((term, posting))
+            # Intersect starting from the rarest term
+            postings.sort(key=lambda tp: len(tp[1]))
+            candidates = set(postings[0][1])
+            if allowed is not None:
+                candidates &= allowed
+            for _term, posting in postings[1:]:
+                candidates &= posting.keys()
+                if not candidates:
+                    return []
+
+            total = len(self._docs)
+            idf = {term: math.log(1.0 + total / len(posting)) for term, posting in postings}
+            scored = []
+            for email_id in candidates:
+                length = self._docs[email_id]["length"]
+                score = sum(posting[email_id] * idf[term] for term, posting in postings)
+                scored.append((score / (1.0 + math.log(1.0 + length)), email_id))
+        return [SearchHit(i, s) for s, i in heapq.nlargest(limit, scored)]
+
+    def _filter_ids(self, filters: Dict[str, str]) -> Optional[Set[str]]:
+        allowed: Optional[Set[str]] = None
+        if "category" in filters:
+            allowed = set(self._by_category.get(filters["category"], ()))
+        if "from" in filters:
+            needle = filters["from"]
+            senders: Set[str] = set()
+            for sender, ids in self._by_sender.items():
+                if needle in sender:
+                    senders |= ids
+            allowed = senders if allowed is None else allowed & senders
+        return allowed
+
+    # persistence ------------------------------------------------------
+
+    def save(self, path: Path = DEFAULT_INDEX_PATH) -> None:
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix(path.suffix + ".tmp")
+        with self._lock:
+            payload = {"version": 1, "docs": self._docs}
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(payload, f)
+            os.replace(tmp, path)
+            self._dirty = False
+            self._saved_at = time.monotonic()
+
+    def save_if_due(self, path: Path = DEFAULT_INDEX_PATH, force: bool = False) -> bool:
+        """Save when the index changed and the last save is ``save_seconds()`` old (or ``force``)."""
+        with self._lock:
+            if not self._dirty or (not force and time.monotonic() - self._saved_at < save_seconds()):
+                return False
+            self.save(path)
+            return True
+
+    @classmethod
+    def load(cls, path: Path = DEFAULT_INDEX_PATH) -> "SearchIndex":
+        index = cls()
+        path = Path(path)
+        if not path.exists():
+            return index
+        with open(path, "r", encoding="utf-8") as f:
+            payload = json.load(f)
+        if payload.get("version") != 1:
+            return index
+        with index._lock:
+            for email_id, doc in payload.get("docs", {}).items():
+                index._insert_locked(email_id, doc)
+            index._dirty = False
+        return index
+
+
+_index: Optional[SearchIndex] = None
+_index_lock = threading.Lock()
+
+
+def get_search_index(path: Path = DEFAULT_INDEX_PATH) -> SearchIndex:
+    """Return the process-wide index, loading it from ``path`` on first use."""
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = SearchIndex.load(path)
+            atexit.register(_index.save_if_due, path, True)
+        return _index
+
+
+def loaded_search_index() -> Optional[SearchIndex]:
+    """The process-wide index if this process has loaded it, else None."""
+    return _index
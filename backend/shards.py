@@ -0,0 +1,209 @@
+"""Sharded ingestion for large inboxes.
+
+An inbox is split into ``count`` shards by a stable hash of ``Email.id``
+(:func:`shard_of`), so any number of machines can each run ``--shard i/n``
+over the same source and together cover every email exactly once. Within
+one machine a shard can be split again across a process pool: shard ``i/n``
+run by ``w`` workers is exactly shards ``i + n*j`` of ``n*w`` for ``j`` in
+``range(w)``, so no email needs to be handed between processes.
+
+Each shard run writes its results to its own file
+(``processed_shard_<i>_of_<n>.json`` in ``EMAIL_AGENT_SHARD_DIR``, default
+``data/shards``); :func:`merge_shards` folds those
+files back together and reports emails that came back from more than one
+shard with different results, and shards that are missing.
+
+Every process has its own rate governor, so pool workers get an equal share
+of ``EMAIL_AGENT_LLM_RPM``, ``EMAIL_AGENT_LLM_TPM`` and
+``EMAIL_AGENT_LLM_MAX_CONCURRENCY``. Split them by hand across machines.
+Pool workers publish their LLM call metrics to the shared metrics file
+(``backend.metrics``) when their shard is done, and hand the dedup index
+entries of their emails back to the parent, which merges them into its own
+index so the next run can reuse them. The classifier is trained in the
+parent from the merged results, so it needs nothing from the workers.
+"""
+
+import hashlib
+import json
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import asdict, dataclass, field, fields
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from .dedup import get_dedup_index
+from .ingest import IngestStats, ingest_emails
+from .metrics import export_metrics, get_metrics
+from .models import Email, ProcessedEmail
+from .rate_governor import DEFAULT_MAX_CONCURRENCY, DEFAULT_RPM, DEFAULT_TPM
+from .storage import _write_json, iter_inbox, load_processed, load_prompts
+
+log = logging.getLogger(__name__)
+
+DEFAULT_SHARD_DIR = Path("data") / "shards"
+SHARD_GLOB = "processed_shard_*_of_*.json"
+
+
+def default_shard_dir() -> Path:
+    return Path(os.getenv("EMAIL_AGENT_SHARD_DIR", str(DEFAULT_SHARD_DIR)))
+
+
+def parse_shard(spec: str) -> Tuple[int, int]:
+    """Parse ``"i/n"`` (0-based ``i``) into ``(i, n)``."""
+    try:
+        index, count = (int(part) for part in spec.split("/"))
+    except ValueError:
+        raise ValueError(f"Shard must look like i/n, got {spec!r}") from None
+    if count < 1 or not 0 <= index < count:
+        raise ValueError(f"Shard index must be in 0..{count - 1}, got {spec!r}")
+    return index, count
+
+
+def shard_of(email_id: str, count: int) -> int:
+    """Stable shard number of an email; the same on every machine and Python run."""
+    digest = hashlib.blake2b(email_id.encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "big") % count
+
+
+def iter_shard(emails: Iterable[Email], index: int, count: int) -> Iterator[Email]:
+    for email in emails:
+        if shard_of(email.id, count) == index:
+            yield email
+
+
+def shard_path(index: int, count: int, out_dir: Optional[Path] = None) -> Path:
+    return (out_dir or default_shard_dir()) / f"processed_shard_{index}_of_{count}.json"
+
+
+def add_stats(total: IngestStats, part: IngestStats) -> None:
+    for f in fields(IngestStats):
+        if f.name == "stages_run":
+            for stage, n in part.stages_run.items():
+                total.stages_run[stage] = total.stages_run.get(stage, 0) + n
+        else:
+            setattr(total, f.name, getattr(total, f.name) + getattr(part, f.name))
+
+
+def ingest_shard(index: int, count: int, incremental: bool = True,
+                 processed: Optional[Dict[str, ProcessedEmail]] = None) -> Tuple[Dict[str, ProcessedEmail], IngestStats]:
+    """Ingest the emails of shard ``index/count`` in this process.
+
+    Returns the results for this shard only (previous results of its emails
+    included when ``incremental`` skipped them) and the run's stats.
+    """
+    previous = load_processed() if processed is None else processed
+    previous = {k: v for k, v in previous.items() if shard_of(k, count) == index}
+    stats = IngestStats()
+    results = ingest_emails(iter_shard(iter_inbox(), index, count), load_prompts(), processed=previous,
+                            incremental=incremental, stats=stats)
+    return results, stats
+
+
+def _init_pool_worker(workers: int) -> None:
+    # A forked worker starts with a copy of the parent's counters
+    get_metrics().reset()
+    for name, default in (("EMAIL_AGENT_LLM_RPM", DEFAULT_RPM), ("EMAIL_AGENT_LLM_TPM", DEFAULT_TPM)):
+        os.environ[name] = str(float(os.getenv(name, default)) / workers)
+    concurrency = int(os.getenv("EMAIL_AGENT_LLM_MAX_CONCURRENCY", DEFAULT_MAX_CONCURRENCY))
+    os.environ["EMAIL_AGENT_LLM_MAX_CONCURRENCY"] = str(max(1, concurrency // workers))
+
+
+def _ingest_pool_shard(index: int, count: int,
+                       incremental: bool) -> Tuple[Dict[str, ProcessedEmail], IngestStats, Dict[str, Optional[list]]]:
+    try:
+        results, stats = ingest_shard(index, count, incremental)
+        dedup = get_dedup_index()
+        return results, stats, dedup.export(results) if dedup is not None else {}
+    finally:
+        export_metrics()
+
+
+def ingest_parallel(index: int = 0, count: int = 1, workers: int = 1,
+                    incremental: bool = True) -> Tuple[Dict[str, ProcessedEmail], IngestStats]:
+    """Ingest shard ``index/count`` with ``workers`` processes.
+
+    The workers' dedup entries are merged into this process's index; saving
+    it is left to the caller, as for a single-process run.
+    """
+    if workers <= 1:
+        return ingest_shard(index, count, incremental)
+    results: Dict[str, ProcessedEmail] = {}
+    stats = IngestStats()
+    dedup = get_dedup_index()
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_pool_worker, initargs=(workers,)) as pool:
+        parts = [pool.submit(_ingest_pool_shard, index + count * j, count * workers, incremental)
+                 for j in range(workers)]
+        for part in parts:
+            part_results, part_stats, part_entries = part.result()
+            results.update(part_results)
+            add_stats(stats, part_stats)
+            if dedup is not None:
+                dedup.merge(part_entries)
+    return results, stats
+
+
+def write_shard(path: Path, index: int, count: int, results: Dict[str, ProcessedEmail]) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    _write_json(path, {
+        "version": 1,
+        "shard": [index, count],
+        "results": {k: asdict(v) for k, v in results.items()},
+    })
+
+
+def read_shard(path: Path) -> Tuple[Tuple[int, int], Dict[str, ProcessedEmail]]:
+    with open(path, "r", encoding="utf-8") as f:
+        raw = json.load(f)
+    if raw.get("version") != 1:
+        raise ValueError(f"{path}: unsupported shard file version {raw.get('version')!r}")
+    index, count = raw["shard"]
+    return (index, count), {k: ProcessedEmail(**v) for k, v in raw["results"].items()}
+
+
+@dataclass
+class Conflict:
+    email_id: str
+    # Shard files holding differing results, the kept one first
+    paths: List[Path]
+
+
+@dataclass
+class MergeReport:
+    merged: int = 0
+    conflicts: List[Conflict] = field(default_factory=list)
+    # "i/n" shards with no file among the inputs
+    missing: List[str] = field(default_factory=list)
+
+
+def merge_shards(paths: Sequence[Path]) -> Tuple[Dict[str, ProcessedEmail], MergeReport]:
+    """Combine shard files into one result set.
+
+    An email found in several files with different results (overlapping or
+    mis-sharded runs) is a conflict: the result from the shard that owns the
+    email wins, or the last file's when none does.
+    """
+    candidates: Dict[str, List[Tuple[Path, bool, ProcessedEmail]]] = {}
+    seen: Dict[int, set] = {}
+    for path in paths:
+        (index, count), results = read_shard(path)
+        seen.setdefault(count, set()).add(index)
+        for email_id, result in results.items():
+            candidates.setdefault(email_id, []).append((path, shard_of(email_id, count) == index, result))
+
+    merged: Dict[str, ProcessedEmail] = {}
+    report = MergeReport()
+    for email_id, found in candidates.items():
+        owned = [c for c in found if c[1]]
+        path, _owns, result = (owned or found)[-1]
+        merged[email_id] = result
+        kept = asdict(result)
+        others = [p for p, _o, r in found if asdict(r) != kept]
+        if others:
+            report.conflicts.append(Conflict(email_id, [path] + others))
+            log.warning("Conflicting results for email %s; kept %s over %s", email_id, path,
+                        ", ".join(str(p) for p in others))
+    report.merged = len(merged)
+    report.missing = [f"{i}/{count}" for count, indexes in sorted(seen.items())
+                      for i in range(count) if i not in indexes]
+    return merged, report
@@ -0,0 +1,145 @@
+"""SQLite storage engine for processed results and drafts.
+
+Rows are stored as JSON documents next to the columns they are queried by
+(email id, category, related email), so single-row upserts and lookups are
+indexed instead of rewriting a whole JSON file. Every write runs in its own
+transaction and the database uses WAL mode, so several Streamlit sessions (or
+a worker process) can write at the same time.
+"""
+
+import json
+import sqlite3
+import threading
+from dataclasses import asdict
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+
+from .models import ProcessedEmail, Draft
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS processed (
+    email_id TEXT PRIMARY KEY,
+    category TEXT,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_processed_category ON processed(category);
+CREATE TABLE IF NOT EXISTS drafts (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    id TEXT UNIQUE NOT NULL,
+    related_email_id TEXT,
+    created_at TEXT,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_drafts_related ON drafts(related_email_id);
+"""
+
+
+class SQLiteStore:
+    """Processed-email and draft store backed by a single SQLite file."""
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(_SCHEMA)
+        self._conn.commit()
+
+    # processed emails -------------------------------------------------
+
+    @staticmethod
+    def _processed_row(item: ProcessedEmail):
+        return (item.email_id, item.category, json.dumps(asdict(item)))
+
+    def load_processed(self) -> Dict[str, ProcessedEmail]:
+        with self._lock:
+            rows = self._conn.execute("SELECT data FROM processed").fetchall()
+        items = (ProcessedEmail(**json.loads(r[0])) for r in rows)
+        return {p.email_id: p for p in items}
+
+    def save_processed(self, data: Dict[str, ProcessedEmail]) -> None:
+        """Replace the stored results with ``data`` in one transaction."""
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM processed")
+            self._conn.executemany(
+                "INSERT INTO processed (email_id, category, data) VALUES (?, ?, ?)",
+                (self._processed_row(v) for v in data.values()),
+            )
+
+    def upsert_processed(self, items: Iterable[ProcessedEmail]) -> None:
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT INTO processed (email_id, category, data) VALUES (?, ?, ?)"
+                " ON CONFLICT(email_id) DO UPDATE SET category = excluded.category, data = excluded.data",
+                (self._processed_row(v) for v in items),
+            )
+
+    def get_processed(self, email_id: str) -> Optional[ProcessedEmail]:
+        with self._lock:
+            row = self._conn.execute("SELECT data FROM processed WHERE email_id = ?", (email_id,)).fetchone()
+        return ProcessedEmail(**json.loads(row[0])) if row else None
+
+    def processed_by_category(self, category: str) -> List[ProcessedEmail]:
+        with self._lock:
+            rows = self._conn.execute("SELECT data FROM processed WHERE category = ?", (category,)).fetchall()
+        return [ProcessedEmail(**json.loads(r[0])) for r in rows]
+
+    def count_processed(self) -> int:
+        with self._lock:
+            (count,) = self._conn.execute("SELECT COUNT(*) FROM processed").fetchone()
+        return count
+
+    # drafts -----------------------------------------------------------
+
+    @staticmethod
+    def _draft_row(draft: Draft):
+        return (draft.id, draft.related_email_id, draft.created_at, json.dumps(asdict(draft)))
+
+    def load_drafts(self) -> List[Draft]:
+        with self._lock:
+            rows = self._conn.execute("SELECT data FROM drafts ORDER BY seq").fetchall()
+        return [Draft(**json.loads(r[0])) for r in rows]
+
+    def save_drafts(self, drafts: List[Draft]) -> None:
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM drafts")
+            self._conn.executemany(
+                "INSERT INTO drafts (id, related_email_id, created_at, data) VALUES (?, ?, ?, ?)",
+                (self._draft_row(d) for d in drafts),
+            )
+
+    def append_draft(self, draft: Draft) -> None:
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT INTO drafts (id, related_email_id, created_at, data) VALUES (?, ?, ?, ?)",
+                self._draft_row(draft),
+            )
+
+    def replace_draft(self, draft: Draft) -> None:
+        with self._lock, self._conn:
+            updated = self._conn.execute(
+                "UPDATE drafts SET related_email_id = ?, created_at = ?, data = ? WHERE id = ?",
+                self._draft_row(draft)[1:] + (draft.id,),
+            ).rowcount
+            if not updated:
+                self._conn.execute(
+                    "INSERT INTO drafts (id, related_email_id, created_at, data) VALUES (?, ?, ?, ?)",
+                    self._draft_row(draft),
+                )
+
+    def drafts_for_email(self, email_id: str) -> List[Draft]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT data FROM drafts WHERE related_email_id = ? ORDER BY seq", (email_id,)
+            ).fetchall()
+        return [Draft(**json.loads(r[0])) for r in rows]
+
+    def count_drafts(self) -> int:
+        with self._lock:
+            (count,) = self._conn.execute("SELECT COUNT(*) FROM drafts").fetchone()
+        return count
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
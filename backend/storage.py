@@ -1,24 +1,81 @@
 """Storage helpers for the application.
 
-This file provides JSON-backed storage helpers the app expects. The functions
-are intentionally minimal – they read and write small JSON files under the
-``data/`` directory so the repository remains simple to run without a db.
+This file provides the storage helpers the app expects. Prompts are a small
+JSON file under the ``data/`` directory; the inbox is read through
+``backend.mail_sources`` from ``EMAIL_AGENT_INBOX`` (default
+``data/mock_inbox.json``), which may also be JSONL, mbox or Maildir. Processed results
+and drafts go through a pluggable store selected by ``EMAIL_AGENT_STORAGE``:
+
+  - ``json`` (default): whole-file JSON documents, simple to run without a db.
+    Every read-modify-write holds an exclusive lock on a ``.lock`` file next
+    to the document, so processes sharing ``data/`` don't lose each other's
+    writes; still, whole-file rewrites make it a poor fit for the background
+    worker, which refuses to run on it.
+  - ``sqlite``: ``backend.sqlite_store.SQLiteStore`` at ``EMAIL_AGENT_DB_PATH``
+    (``data/email_agent.sqlite``), with indexed single-row upserts and appends.
+
+Use :func:`migrate_json_to_sqlite` (or ``scripts/migrate_storage.py``) to import
+existing JSON stores into SQLite.
 """
 
 import json
+import os
+import threading
+from contextlib import contextmanager
+from dataclasses import asdict
 from pathlib import Path
-from typing import List, Dict
+from typing import Iterable, Iterator, List, Dict, Optional
 from datetime import datetime
 import uuid
 
+from .mail_sources import iter_emails
 from .models import Email, ProcessedEmail, Prompts, Draft
 
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
 DATA_DIR = Path("data")
 
+# In-process write counters, bumped by every save that goes through this
+# module; ``backend.data_layer`` combines them with file stats to invalidate.
+_versions: Dict[str, int] = {"prompts": 0, "processed": 0, "drafts": 0}
+_versions_lock = threading.Lock()
+
+
+def _bump(name: str) -> None:
+    with _versions_lock:
+        _versions[name] += 1
+
+
+def store_version(name: str) -> int:
+    """Return the write counter for ``prompts``, ``processed`` or ``drafts``."""
+    return _versions[name]
+
+
+def backing_files(name: str) -> List[Path]:
+    """Files whose modification means the ``name`` store changed on disk."""
+    if name == "emails":
+        return [inbox_path()]
+    if name == "prompts":
+        return [DATA_DIR / "prompts.json"]
+    if storage_engine() == "sqlite":
+        db = _db_path()
+        return [db, db.with_name(db.name + "-wal")]
+    return [DATA_DIR / ("processed_emails.json" if name == "processed" else "drafts.json")]
+
+def inbox_path() -> Path:
+    """Inbox source: ``EMAIL_AGENT_INBOX`` (JSON, JSONL, mbox or Maildir) or the mock inbox."""
+    return Path(os.getenv("EMAIL_AGENT_INBOX", str(DATA_DIR / "mock_inbox.json")))
+
+def iter_inbox() -> Iterator[Email]:
+    """Lazily yield inbox emails without loading the whole source into memory."""
+    return iter_emails(inbox_path())
+
 def load_emails() -> List[Email]:
-    with open(DATA_DIR / "mock_inbox.json", "r", encoding="utf-8") as f:
-        raw = json.load(f)
-    return [Email(**e) for e in raw]
+    return list(iter_inbox())
 
 def load_prompts() -> Prompts:
     path = DATA_DIR / "prompts.json"
@@ -56,35 +113,186 @@ def load_prompts() -> Prompts:
 
 def save_prompts(prompts: Prompts):
     with open(DATA_DIR / "prompts.json", "w", encoding="utf-8") as f:
-        json.dump(prompts.__dict__, f, indent=2)
+        json.dump(asdict(prompts), f, indent=2)
+    _bump("prompts")
+
+def _write_json(path: Path, payload) -> None:
+    # Write to a sibling temp file and rename so readers never see a partial file.
+    tmp = path.with_suffix(path.suffix + ".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(payload, f, indent=2)
+    os.replace(tmp, path)
+
+
+@contextmanager
+def _file_lock(path: Path):
+    """Hold an exclusive lock on ``path``'s ``.lock`` sibling, across processes."""
+    with open(path.with_suffix(path.suffix + ".lock"), "a+b") as f:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        else:
+            f.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    pass  # LK_LOCK gives up after ten seconds; keep waiting
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+class JsonStore:
+    """Processed-email and draft store backed by whole-file JSON documents."""
+
+    def load_processed(self) -> Dict[str, ProcessedEmail]:
+        path = DATA_DIR / "processed_emails.json"
+        if not path.exists():
+            return {}
+        with open(path, "r", encoding="utf-8") as f:
+            raw = json.load(f)
+        return {k: ProcessedEmail(**v) for k, v in raw.items()}
+
+    def _write_processed(self, data: Dict[str, ProcessedEmail]) -> None:
+        _write_json(DATA_DIR / "processed_emails.json", {k: asdict(v) for k, v in data.items()})
+
+    def save_processed(self, data: Dict[str, ProcessedEmail]) -> None:
+        with _file_lock(DATA_DIR / "processed_emails.json"):
+            self._write_processed(data)
+
+    def upsert_processed(self, items: Iterable[ProcessedEmail]) -> None:
+        with _file_lock(DATA_DIR / "processed_emails.json"):
+            data = self.load_processed()
+            for item in items:
+                data[item.email_id] = item
+            self._write_processed(data)
+
+    def get_processed(self, email_id: str) -> Optional[ProcessedEmail]:
+        return self.load_processed().get(email_id)
+
+    def processed_by_category(self, category: str) -> List[ProcessedEmail]:
+        return [p for p in self.load_processed().values() if p.category == category]
+
+    def count_processed(self) -> int:
+        return len(self.load_processed())
+
+    def load_drafts(self) -> List[Draft]:
+        path = DATA_DIR / "drafts.json"
+        if not path.exists():
+            return []
+        with open(path, "r", encoding="utf-8") as f:
+            raw = json.load(f)
+        return [Draft(**d) for d in raw]
+
+    def _write_drafts(self, drafts: List[Draft]) -> None:
+        _write_json(DATA_DIR / "drafts.json", [asdict(d) for d in drafts])
+
+    def save_drafts(self, drafts: List[Draft]) -> None:
+        with _file_lock(DATA_DIR / "drafts.json"):
+            self._write_drafts(drafts)
+
+    def append_draft(self, draft: Draft) -> None:
+        with _file_lock(DATA_DIR / "drafts.json"):
+            drafts = self.load_drafts()
+            drafts.append(draft)
+            self._write_drafts(drafts)
+
+    def replace_draft(self, draft: Draft) -> None:
+        with _file_lock(DATA_DIR / "drafts.json"):
+            drafts = self.load_drafts()
+            for i, d in enumerate(drafts):
+                if d.id == draft.id:
+                    drafts[i] = draft
+                    break
+            else:
+                drafts.append(draft)
+            self._write_drafts(drafts)
+
+    def drafts_for_email(self, email_id: str) -> List[Draft]:
+        return [d for d in self.load_drafts() if d.related_email_id == email_id]
+
+    def count_drafts(self) -> int:
+        return len(self.load_drafts())
+
+
+_store = None
+_store_key = None
+_store_lock = threading.Lock()
+
+
+def _db_path() -> Path:
+    return Path(os.getenv("EMAIL_AGENT_DB_PATH", str(DATA_DIR / "email_agent.sqlite")))
+
+
+def storage_engine() -> str:
+    """The configured store engine, ``json`` or ``sqlite`` (``EMAIL_AGENT_STORAGE``)."""
+    return os.getenv("EMAIL_AGENT_STORAGE", "json").strip().lower()
+
+
+def get_store():
+    """Return the configured processed/draft store (``EMAIL_AGENT_STORAGE``)."""
+    global _store, _store_key
+    engine = storage_engine()
+    key = (engine, _db_path() if engine == "sqlite" else DATA_DIR)
+    with _store_lock:
+        if key != _store_key:
+            if engine == "sqlite":
+                from .sqlite_store import SQLiteStore
+                _store = SQLiteStore(key[1])
+            elif engine == "json":
+                _store = JsonStore()
+            else:
+                raise ValueError(f"Unknown EMAIL_AGENT_STORAGE engine: {engine!r}")
+            _store_key = key
+        return _store
+
 
 def load_processed() -> Dict[str, ProcessedEmail]:
-    path = DATA_DIR / "processed_emails.json"
-    if not path.exists():
-        return {}
-    with open(path, "r", encoding="utf-8") as f:
-        raw = json.load(f)
-    return {k: ProcessedEmail(**v) for k, v in raw.items()}
+    return get_store().load_processed()
 
 def save_processed(data: Dict[str, ProcessedEmail]):
-    serializable = {k: v.__dict__ for k, v in data.items()}
-    with open(DATA_DIR / "processed_emails.json", "w", encoding="utf-8") as f:
-        json.dump(serializable, f, indent=2)
+    get_store().save_processed(data)
+    _bump("processed")
+
+def upsert_processed(items: Iterable[ProcessedEmail]):
+    """Insert or replace the given results without touching the others."""
+    get_store().upsert_processed(list(items))
+    _bump("processed")
+
+def get_processed(email_id: str) -> Optional[ProcessedEmail]:
+    return get_store().get_processed(email_id)
+
+def processed_by_category(category: str) -> List[ProcessedEmail]:
+    return get_store().processed_by_category(category)
+
+def count_processed() -> int:
+    return get_store().count_processed()
 
 def load_drafts() -> List[Draft]:
-    path = DATA_DIR / "drafts.json"
-    if not path.exists():
-        return []
-    with open(path, "r", encoding="utf-8") as f:
-        raw = json.load(f)
-    return [Draft(**d) for d in raw]
+    return get_store().load_drafts()
 
 def save_drafts(drafts: List[Draft]):
-    with open(DATA_DIR / "drafts.json", "w", encoding="utf-8") as f:
-        json.dump([d.__dict__ for d in drafts], f, indent=2)
+    get_store().save_drafts(drafts)
+    _bump("drafts")
+
+def replace_draft(draft: Draft):
+    """Store ``draft`` in place of the draft with the same id (or add it)."""
+    get_store().replace_draft(draft)
+    _bump("drafts")
+
+def drafts_for_email(email_id: str) -> List[Draft]:
+    return get_store().drafts_for_email(email_id)
+
+def count_drafts() -> int:
+    return get_store().count_drafts()
 
 def add_draft(related_email_id, subject, body, metadata):
-    drafts = load_drafts()
     new_draft = Draft(
         id=str(uuid.uuid4()),
         related_email_id=related_email_id,
@@ -93,6 +301,28 @@ def add_draft(related_email_id, subject, body, metadata):
         metadata=metadata,
         created_at=datetime.utcnow().isoformat()
     )
-    drafts.append(new_draft)
-    save_drafts(drafts)
+    get_store().append_draft(new_draft)
+    _bump("drafts")
     return new_draft
+
+def migrate_json_to_sqlite(db_path: Optional[Path] = None) -> Dict[str, int]:
+    """Import ``processed_emails.json`` and ``drafts.json`` into a SQLite store.
+
+    Processed rows with the same email id are replaced and drafts that are
+    already present are skipped, so the migration can be re-run safely.
+    Returns the number of rows imported.
+    """
+    from .sqlite_store import SQLiteStore
+
+    source = JsonStore()
+    target = SQLiteStore(db_path or _db_path())
+    try:
+        processed = source.load_processed()
+        target.upsert_processed(processed.values())
+        existing = {d.id for d in target.load_drafts()}
+        drafts = [d for d in source.load_drafts() if d.id not in existing]
+        for draft in drafts:
+            target.append_draft(draft)
+    finally:
+        target.close()
+    return {"processed": len(processed), "drafts": len(drafts)}
@@ -0,0 +1,188 @@
+"""Conversation thread index.
+
+Emails are grouped into threads by two links:
+  - Message-ID / In-Reply-To, when the source provides those headers;
+  - the normalized subject, with reply/forward prefixes (``Re:``, ``Fwd:``,
+    ``FW:``, ``AW:`` ...) stripped, so "Re: Budget" joins "Budget".
+
+Threads are kept in a union-find structure whose members are stored sorted by
+timestamp, so looking up the thread of an email is effectively O(1) and new
+mail is merged in incrementally. :meth:`ThreadIndex.sync_refs` keeps it in
+line with the inbox refs, loading only messages that are new or whose subject
+or timestamp changed. The index persists to ``data/thread_index.json``.
+"""
+
+import heapq
+import json
+import os
+import re
+import threading
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from .mail_sources import EmailRef
+from .models import Email
+
+DEFAULT_THREAD_INDEX_PATH = Path("data") / "thread_index.json"
+
+_PREFIX_RE = re.compile(r"^\s*((re|fwd?|aw|sv|antw|wg)(\[\d+\])?\s*:\s*)+", re.IGNORECASE)
+
+# Per-email fields that decide thread membership: (subject key, message id, parent id, timestamp)
+_Keys = Tuple[str, Optional[str], Optional[str], str]
+
+
+def normalize_subject(subject: str) -> str:
+    """Lower-case a subject and strip reply/forward prefixes and extra whitespace."""
+    return " ".join(_PREFIX_RE.sub("", subject or "").split()).lower()
+
+
+def _keys(email: Email) -> _Keys:
+    return (normalize_subject(email.subject), email.message_id, email.in_reply_to, email.timestamp or "")
+
+
+class ThreadIndex:
+    """Incrementally maintained email -> thread mapping."""
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._reset_locked()
+
+    def _reset_locked(self) -> None:
+        self._keys: Dict[str, _Keys] = {}
+        self._parent: Dict[str, str] = {}
+        # root email id -> [(timestamp, email_id)] sorted
+        self._members: Dict[str, List[Tuple[str, str]]] = {}
+        self._by_subject: Dict[str, str] = {}
+        self._by_message_id: Dict[str, str] = {}
+        # message id -> emails replying to it that arrived before it
+        self._orphans: Dict[str, List[str]] = {}
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def _find(self, email_id: str) -> str:
+        root = email_id
+        while self._parent[root] != root:
+            root = self._parent[root]
+        while self._parent[email_id] != root:
+            self._parent[email_id], email_id = root, self._parent[email_id]
+        return root
+
+    def _union(self, a: str, b: str) -> None:
+        ra, rb = self._find(a), self._find(b)
+        if ra == rb:
+            return
+        if len(self._members[ra]) < len(self._members[rb]):
+            ra, rb = rb, ra
+        self._parent[rb] = ra
+        self._members[ra] = list(heapq.merge(self._members[ra], self._members.pop(rb)))
+
+    def add(self, email: Email) -> None:
+        """Add a new email, merging it into any thread it links to."""
+        with self._lock:
+            if email.id in self._keys:
+                if self._keys[email.id] == _keys(email):
+                    return
+                # Thread links changed; union-find can't split, so rebuild.
+                keys = dict(self._keys)
+                keys[email.id] = _keys(email)
+                self._rebuild_locked(keys)
+                return
+            self._add_locked(email.id, _keys(email))
+
+    def _add_locked(self, email_id: str, keys: _Keys) -> None:
+        subject, message_id, parent_id, timestamp = keys
+        self._keys[email_id] = keys
+        self._parent[email_id] = email_id
+        self._members[email_id] = [(timestamp, email_id)]
+        if subject:
+            if subject in self._by_subject:
+                self._union(email_id, self._by_subject[subject])
+            else:
+                self._by_subject[subject] = email_id
+        if message_id:
+            self._by_message_id[message_id] = email_id
+            for child in self._orphans.pop(message_id, []):
+                self._union(email_id, child)
+        if parent_id:
+            if parent_id in self._by_message_id:
+                self._union(email_id, self._by_message_id[parent_id])
+            else:
+                self._orphans.setdefault(parent_id, []).append(email_id)
+
+    def _rebuild_locked(self, keys: Dict[str, _Keys]) -> None:
+        self._reset_locked()
+        for email_id, k in keys.items():
+            self._add_locked(email_id, k)
+
+    def sync(self, emails: Iterable[Email]) -> int:
+        """Bring the index in line with ``emails``; returns the number of changes."""
+        with self._lock:
+            return self._apply_locked({e.id: _keys(e) for e in emails})
+
+    def sync_refs(self, refs: Iterable[EmailRef], load: Callable[[EmailRef], Email]) -> int:
+        """:meth:`sync` from inbox refs: only new or changed messages are loaded with ``load``."""
+        with self._lock:
+            current = {}
+            for ref in refs:
+                keys = self._keys.get(ref.id)
+                if keys is None or keys[0] != normalize_subject(ref.subject) or keys[3] != (ref.timestamp or ""):
+                    keys = _keys(load(ref))
+                current[ref.id] = keys
+            return self._apply_locked(current)
+
+    def _apply_locked(self, current: Dict[str, _Keys]) -> int:
+        changed = [i for i, k in current.items() if self._keys.get(i) != k]
+        removed = [i for i in self._keys if i not in current]
+        if removed or any(i in self._keys for i in changed):
+            self._rebuild_locked(current)
+        else:
+            for email_id in changed:
+                self._add_locked(email_id, current[email_id])
+        return len(changed) + len(removed)
+
+    def thread_of(self, email_id: str) -> List[str]:
+        """Ids of every email in the same thread, oldest first."""
+        with self._lock:
+            if email_id not in self._parent:
+                return []
+            return [i for _ts, i in self._members[self._find(email_id)]]
+
+    def thread_id(self, email_id: str) -> Optional[str]:
+        with self._lock:
+            return self._find(email_id) if email_id in self._parent else None
+
+    def save(self, path: Path = DEFAULT_THREAD_INDEX_PATH) -> None:
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix(path.suffix + ".tmp")
+        with self._lock:
+            payload = {"version": 1, "emails": {i: list(k) for i, k in self._keys.items()}}
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(payload, f)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: Path = DEFAULT_THREAD_INDEX_PATH) -> "ThreadIndex":
+        index = cls()
+        path = Path(path)
+        if not path.exists():
+            return index
+        with open(path, "r", encoding="utf-8") as f:
+            payload = json.load(f)
+        if payload.get("version") == 1:
+            index._rebuild_locked({i: tuple(k) for i, k in payload.get("emails", {}).items()})
+        return index
+
+
+_index: Optional[ThreadIndex] = None
+_index_lock = threading.Lock()
+
+
+def get_thread_index(path: Path = DEFAULT_THREAD_INDEX_PATH) -> ThreadIndex:
+    """Return the process-wide thread index, loading it from ``path`` on first use."""
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = ThreadIndex.load(path)
+        return _index
@@ -0,0 +1 @@
+"""Benchmark suite for ingestion, storage and UI data paths (see run_benchmarks.py)."""
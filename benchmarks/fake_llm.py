@@ -0,0 +1,42 @@
+"""Latency-injecting stand-in for the LLM used by the benchmarks.
+
+It answers with the offline mock responder after sleeping for a configurable
+latency, so the pipeline's concurrency and overheads can be measured without
+network calls.
+"""
+
+import contextlib
+import random
+import threading
+import time
+
+import backend.agent as agent
+import backend.llm_client as llm_client
+
+
+class FakeLLM:
+    def __init__(self, latency: float = 0.05, jitter: float = 0.0, seed: int = 0):
+        self.latency = latency
+        self.jitter = jitter
+        self.calls = 0
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def __call__(self, system_prompt: str, user_prompt: str, use_cache: bool = True) -> str:
+        with self._lock:
+            self.calls += 1
+            delay = self.latency + (self._rng.uniform(-self.jitter, self.jitter) if self.jitter else 0.0)
+        if delay > 0:
+            time.sleep(delay)
+        return llm_client._mock_response(system_prompt, user_prompt)
+
+
+@contextlib.contextmanager
+def patched_llm(fake: FakeLLM):
+    """Route every ``run_llm`` call (sync, async and via the agent) to ``fake``."""
+    originals = (llm_client.run_llm, agent.run_llm)
+    llm_client.run_llm = agent.run_llm = fake
+    try:
+        yield fake
+    finally:
+        llm_client.run_llm, agent.run_llm = originals
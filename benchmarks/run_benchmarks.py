@@ -0,0 +1,306 @@
+r"""Benchmarks for ingestion, storage and the UI data paths.
+
+Run this from the repo root inside the repo venv:
+
+  python -m benchmarks.run_benchmarks                       # 1k, 10k and 100k emails
+  python -m benchmarks.run_benchmarks --sizes 1000 --latency 0.02
+  python -m benchmarks.run_benchmarks --compare benchmarks/results/OLD.json
+
+For each inbox size it measures:
+  - ingest: throughput of ``ingest_emails`` against a fake LLM with injected
+    latency (on a sample of at most ``--ingest-limit`` emails, since the fake
+    latency dominates), in a temporary data dir with an empty near-duplicate
+    index and an untrained classifier, and the repo's own ``data/rules.json``,
+    so runs don't depend on (or change) what the local install has learned;
+  - storage: ``save_processed``, ``upsert_processed``, ``load_processed`` and
+    ``add_draft`` for the JSON and SQLite engines, in a temporary data dir;
+  - search: index build time and query latency (p50/p95);
+  - threads: index build time and ``thread_of`` latency.
+
+Build steps run under tracemalloc and report their peak Python memory; the
+per-query latency loops run without it. The report is written as JSON to
+``benchmarks/results/<commit>.json`` so runs can be compared across commits
+with ``--compare``.
+"""
+import argparse
+import contextlib
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Dict, List, Tuple
+
+# Ensure project root is on sys.path when this script is run directly from benchmarks/
+ROOT = Path(__file__).resolve().parent.parent
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from backend import classifier, dedup, storage
+from backend.ingest import IngestStats, ingest_emails
+from backend.search_index import SearchIndex
+from backend.threads import ThreadIndex
+from benchmarks.fake_llm import FakeLLM, patched_llm
+from benchmarks.synthetic import CATEGORIES, WORDS, generate_inbox, processed_for
+
+RESULTS_DIR = ROOT / "benchmarks" / "results"
+DEFAULT_SIZES = (1000, 10000, 100000)
+
+
+def _measure(fn: Callable[[], object]) -> Tuple[object, float, float]:
+    """Run ``fn`` under tracemalloc; return (result, seconds, peak MiB)."""
+    tracemalloc.start()
+    try:
+        start = time.perf_counter()
+        result = fn()
+        elapsed = time.perf_counter() - start
+        _current, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return result, elapsed, peak / 2**20
+
+
+def _latencies_ms(fn: Callable[[str], object], args: List[str]) -> Dict[str, float]:
+    samples = []
+    for arg in args:
+        start = time.perf_counter()
+        fn(arg)
+        samples.append((time.perf_counter() - start) * 1000)
+    samples.sort()
+    return {
+        "mean_ms": statistics.fmean(samples),
+        "p50_ms": samples[len(samples) // 2],
+        "p95_ms": samples[min(len(samples) - 1, int(len(samples) * 0.95))],
+    }
+
+
+@contextlib.contextmanager
+def _temp_storage(engine: str, data_dir: Path):
+    """Point ``backend.storage`` at ``data_dir`` using ``engine``."""
+    saved = (storage.DATA_DIR, storage._store, storage._store_key)
+    saved_env = {k: os.environ.get(k) for k in ("EMAIL_AGENT_STORAGE", "EMAIL_AGENT_DB_PATH")}
+    storage.DATA_DIR = data_dir
+    storage._store, storage._store_key = None, None
+    os.environ["EMAIL_AGENT_STORAGE"] = engine
+    os.environ["EMAIL_AGENT_DB_PATH"] = str(data_dir / "bench.sqlite")
+    try:
+        yield
+    finally:
+        storage.DATA_DIR, storage._store, storage._store_key = saved
+        for key, value in saved_env.items():
+            if value is None:
+                os.environ.pop(key, None)
+            else:
+                os.environ[key] = value
+
+
+@contextlib.contextmanager
+def _fresh_learners():
+    """Give ingestion an empty dedup index, an untrained classifier and the repo's rules."""
+    saved = (dedup._index, classifier._classifier)
+    saved_rules = os.environ.get("EMAIL_AGENT_RULES_PATH")
+    dedup._index = dedup.DedupIndex(dedup.max_distance())
+    classifier._classifier = classifier.LocalClassifier()
+    os.environ["EMAIL_AGENT_RULES_PATH"] = str(ROOT / "data" / "rules.json")
+    try:
+        yield
+    finally:
+        dedup._index, classifier._classifier = saved
+        if saved_rules is None:
+            os.environ.pop("EMAIL_AGENT_RULES_PATH", None)
+        else:
+            os.environ["EMAIL_AGENT_RULES_PATH"] = saved_rules
+
+
+def bench_ingest(emails, limit: int, latency: float, concurrency: int, fused: bool) -> Dict[str, float]:
+    sample = emails[:limit]
+    fake = FakeLLM(latency=latency)
+    stats = IngestStats()
+    prompts = storage.load_prompts()
+    with tempfile.TemporaryDirectory() as tmp, _temp_storage("json", Path(tmp)), _fresh_learners(), \
+            patched_llm(fake):
+        _result, elapsed, peak = _measure(lambda: ingest_emails(
+            sample, prompts, concurrency=concurrency, fused=fused, stats=stats))
+    return {
+        "emails": len(sample),
+        "seconds": elapsed,
+        "emails_per_s": len(sample) / elapsed if elapsed else 0.0,
+        "llm_calls": fake.calls,
+        "rule_hits": stats.rule_hits,
+        "duplicate_hits": stats.duplicate_hits,
+        "classifier_hits": stats.classifier_hits,
+        "peak_mib": peak,
+    }
+
+
+def bench_storage(emails, processed, engine: str, drafts: int) -> Dict[str, float]:
+    with tempfile.TemporaryDirectory() as tmp, _temp_storage(engine, Path(tmp)):
+        _r, save_s, save_peak = _measure(lambda: storage.save_processed(processed))
+        one = next(iter(processed.values()))
+        _r, upsert_s, _p = _measure(lambda: storage.upsert_processed([one]))
+        _r, load_s, load_peak = _measure(storage.load_processed)
+        # Seed the drafts store, then time single appends on top of it
+        for email in emails[:drafts]:
+            storage.add_draft(email.id, "Re: " + email.subject, "Thanks!", {"seed": True})
+        add = _latencies_ms(lambda i: storage.add_draft(i, "Re: bench", "Thanks!", {}),
+                            [e.id for e in emails[:20]])
+        if engine == "sqlite":
+            storage.get_store().close()
+    return {
+        "save_processed_s": save_s,
+        "save_processed_peak_mib": save_peak,
+        "upsert_one_s": upsert_s,
+        "load_processed_s": load_s,
+        "load_processed_peak_mib": load_peak,
+        "drafts_seeded": min(drafts, len(emails)),
+        "add_draft_mean_ms": add["mean_ms"],
+        "add_draft_p95_ms": add["p95_ms"],
+    }
+
+
+def _queries(count: int, seed: int = 0) -> List[str]:
+    rng = random.Random(seed)
+    queries = []
+    for i in range(count):
+        words = rng.sample(WORDS, rng.randint(1, 2))
+        if i % 4 == 0:
+            words.append("category:" + rng.choice(CATEGORIES))
+        queries.append(" ".join(words))
+    return queries
+
+
+def bench_search(emails, processed, queries: int) -> Dict[str, float]:
+    index = SearchIndex()
+    _r, build_s, peak = _measure(lambda: index.sync(emails, processed))
+    result = {"build_s": build_s, "build_peak_mib": peak}
+    result.update(_latencies_ms(index.search, _queries(queries)))
+    return result
+
+
+def bench_threads(emails, lookups: int) -> Dict[str, float]:
+    index = ThreadIndex()
+    _r, build_s, peak = _measure(lambda: index.sync(emails))
+    rng = random.Random(0)
+    ids = [rng.choice(emails).id for _ in range(lookups)]
+    result = {"build_s": build_s, "build_peak_mib": peak}
+    result.update(_latencies_ms(index.thread_of, ids))
+    return result
+
+
+def run(sizes, latency: float = 0.05, concurrency: int = 16, ingest_limit: int = 2000,
+        fused: bool = False, queries: int = 200, drafts: int = 1000, log=print) -> Dict:
+    """Run every benchmark for each inbox size and return the report."""
+    results = {}
+    for n in sizes:
+        log(f"== {n} emails")
+        emails, _s, gen_peak = _measure(lambda: list(generate_inbox(n)))
+        processed = processed_for(emails)
+        results[str(n)] = section = {"inbox": {"emails": n, "peak_mib": gen_peak}}
+        section["ingest"] = bench_ingest(emails, ingest_limit, latency, concurrency, fused)
+        ingest = section["ingest"]
+        log(f"   ingest   {ingest['emails_per_s']:.1f} emails/s  ({ingest['rule_hits']} by rules, "
+            f"{ingest['duplicate_hits']} near-duplicates, {ingest['classifier_hits']} classified locally)")
+        for engine in ("json", "sqlite"):
+            section[f"storage_{engine}"] = bench_storage(emails, processed, engine, drafts)
+            log(f"   {engine:7}  save {section[f'storage_{engine}']['save_processed_s']:.3f}s  "
+                f"add_draft {section[f'storage_{engine}']['add_draft_mean_ms']:.2f}ms")
+        section["search"] = bench_search(emails, processed, queries)
+        log(f"   search   build {section['search']['build_s']:.2f}s  p95 {section['search']['p95_ms']:.2f}ms")
+        section["threads"] = bench_threads(emails, queries)
+        log(f"   threads  build {section['threads']['build_s']:.2f}s  p95 {section['threads']['p95_ms']:.3f}ms")
+    return {
+        "schema": 1,
+        "commit": _git_commit(),
+        "created_at": datetime.utcnow().isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "params": {
+            "sizes": list(sizes), "latency": latency, "concurrency": concurrency,
+            "ingest_limit": ingest_limit, "fused": fused, "queries": queries, "drafts": drafts,
+        },
+        "results": results,
+    }
+
+
+def _git_commit() -> str:
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT,
+                             capture_output=True, text=True, check=True)
+        return out.stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def _flatten(report: Dict) -> Dict[str, float]:
+    return {
+        f"{size}.{section}.{metric}": value
+        for size, sections in report["results"].items()
+        for section, metrics in sections.items()
+        for metric, value in metrics.items()
+        if isinstance(value, (int, float))
+    }
+
+
+def compare(base: Dict, current: Dict, threshold: float = 0.2) -> List[str]:
+    """Metrics that got worse by more than ``threshold`` (as a fraction).
+
+    Throughput metrics (``*_per_s``) regress when they drop; every other
+    metric (seconds, milliseconds, MiB) regresses when it grows.
+    """
+    old, new = _flatten(base), _flatten(current)
+    regressions = []
+    for key in sorted(old.keys() & new.keys()):
+        before, after = old[key], new[key]
+        if not before or key.endswith((".emails", ".llm_calls", ".rule_hits", ".duplicate_hits",
+                                                 ".classifier_hits", ".drafts_seeded")):
+            continue
+        change = (after - before) / before
+        if key.endswith("_per_s"):
+            change = -change
+        if change > threshold:
+            regressions.append(f"{key}: {before:.4g} -> {after:.4g} ({change:+.0%} worse)")
+    return regressions
+
+
+def main(argv=None) -> Dict:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", default=",".join(map(str, DEFAULT_SIZES)),
+                        help="comma-separated inbox sizes")
+    parser.add_argument("--latency", type=float, default=0.05, help="fake LLM latency in seconds")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--ingest-limit", type=int, default=2000, help="max emails ingested per size")
+    parser.add_argument("--fused", action="store_true", help="use fused triage during ingest")
+    parser.add_argument("--queries", type=int, default=200, help="search/thread lookups per size")
+    parser.add_argument("--drafts", type=int, default=1000, help="drafts seeded before timing add_draft")
+    parser.add_argument("--output", type=Path, default=None,
+                        help="report path (default: benchmarks/results/<commit>.json)")
+    parser.add_argument("--compare", type=Path, default=None, help="earlier report to compare against")
+    parser.add_argument("--threshold", type=float, default=0.2, help="regression threshold for --compare")
+    args = parser.parse_args(argv)
+
+    report = run([int(s) for s in args.sizes.split(",") if s.strip()], latency=args.latency,
+                 concurrency=args.concurrency, ingest_limit=args.ingest_limit, fused=args.fused,
+                 queries=args.queries, drafts=args.drafts)
+    output = args.output or RESULTS_DIR / f"{report['commit']}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(report, indent=2), encoding="utf-8")
+    print(f"Report written to {output}")
+
+    if args.compare:
+        base = json.loads(args.compare.read_text(encoding="utf-8"))
+        regressions = compare(base, report, args.threshold)
+        print(f"Compared with {base.get('commit')}: {len(regressions)} regression(s)")
+        for line in regressions:
+            print("  " + line)
+    return report
+
+
+if __name__ == "__main__":
+    main()
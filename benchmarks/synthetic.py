@@ -0,0 +1,60 @@
+"""Deterministic synthetic inbox generator for benchmarks."""
+
+import json
+import random
+from dataclasses import asdict
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Iterator
+
+from backend.models import Email, ProcessedEmail
+
+WORDS = (
+    "report deadline meeting review budget invoice slides agenda project update client "
+    "feature release roadmap benefits enrollment offer prize reward newsletter stories "
+    "weekly summary schedule confirm request timeline dashboard filter role access team "
+    "quarter planning hiring onboarding travel expense approval contract renewal"
+).split()
+_SENDER_DOMAINS = ["company.com", "client.io", "technews.com", "spamoffers.co", "events.org", "vendor.net"]
+CATEGORIES = ["Important", "Newsletter", "Spam", "To-Do"]
+
+
+def generate_inbox(n: int, seed: int = 0, body_words: int = 80) -> Iterator[Email]:
+    """Yield ``n`` emails with realistic-ish senders, threads and timestamps."""
+    rng = random.Random(seed)
+    start = datetime(2025, 1, 1)
+    subjects = [" ".join(rng.choices(WORDS, k=rng.randint(3, 7))).capitalize() for _ in range(max(1, n // 4))]
+    for i in range(n):
+        subject = rng.choice(subjects)
+        if rng.random() < 0.3:
+            subject = "Re: " + subject
+        sender = f"user{rng.randint(0, max(1, n // 20))}@{rng.choice(_SENDER_DOMAINS)}"
+        yield Email(
+            id=str(i),
+            sender=sender,
+            subject=subject,
+            body=" ".join(rng.choices(WORDS, k=body_words)),
+            timestamp=(start + timedelta(minutes=7 * i)).isoformat(),
+        )
+
+
+def processed_for(emails, seed: int = 0):
+    """Plausible processed results for ``emails`` (no LLM involved)."""
+    rng = random.Random(seed)
+    return {
+        e.id: ProcessedEmail(
+            email_id=e.id,
+            category=rng.choice(CATEGORIES),
+            action_items=[{"task": "Follow up", "deadline": None}] if rng.random() < 0.3 else [],
+        )
+        for e in emails
+    }
+
+
+def write_jsonl(path: Path, n: int, seed: int = 0) -> Path:
+    """Write a synthetic inbox as JSONL (the streaming source format)."""
+    path = Path(path)
+    with open(path, "w", encoding="utf-8") as f:
+        for email in generate_inbox(n, seed):
+            f.write(json.dumps(asdict(email)) + "\n")
+    return path
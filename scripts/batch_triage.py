@@ -0,0 +1,114 @@
+r"""Bulk (nightly) triage through a batch backend instead of per-email calls.
+
+Run this from the repo root inside the repo venv:
+
+  python scripts/batch_triage.py create            # write requests for stale emails
+  python scripts/batch_triage.py submit JOB_ID --backend openai
+  python scripts/batch_triage.py poll JOB_ID
+  python scripts/batch_triage.py merge JOB_ID      # write results to the processed store
+  python scripts/batch_triage.py run --backend local --wait
+  python scripts/batch_triage.py list
+
+Jobs are stored under `data/batch_jobs/`. Every step can be re-run after an
+interruption. The `local` backend runs requests through the normal LLM client
+(or the mock), which makes it useful for tests and small inboxes.
+"""
+import argparse
+import sys
+import time
+from pathlib import Path
+
+# Ensure project root is on sys.path when this script is run directly from scripts/
+ROOT = Path(__file__).resolve().parent.parent
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from backend.batch import (
+    BatchJob, DEFAULT_JOBS_DIR, create_batch_job, get_backend,
+    list_jobs, merge_job, poll_job, submit_job,
+)
+from backend.rate_governor import LLMDeferred
+from backend.storage import iter_inbox, load_prompts, load_processed, upsert_processed
+
+
+def _job(job_id):
+    job = BatchJob(DEFAULT_JOBS_DIR / job_id)
+    if not job.manifest:
+        sys.exit(f"No batch job {job_id} in {DEFAULT_JOBS_DIR}")
+    return job
+
+
+def _create():
+    job = create_batch_job(iter_inbox(), load_prompts(), processed=load_processed())
+    print(f"Created job {job.id} with {job.manifest['requests']} requests "
+          f"for {len(job.manifest['email_hashes'])} emails "
+          f"({len(job.manifest['rule_results'])} decided by rules, "
+          f"{job.manifest['rejected_skipped']} rejected earlier and skipped)")
+    return job
+
+
+def _submit(job, backend):
+    try:
+        submit_job(job, backend)
+    except LLMDeferred as exc:
+        sys.exit(f"The LLM provider deferred job {job.id} ({exc.reason}); run `submit {job.id}` again to resume")
+
+
+def _merge(job):
+    processed = load_processed()
+    counts = merge_job(job, processed)
+    upsert_processed(processed[i] for i in job.manifest["merged"] if i in processed)
+    print(f"Merged {counts['merged']} emails from job {job.id} ({counts['failed']} results failed, "
+          f"{counts['rejected']} requests rejected and not retried)")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("create", help="write a job with requests for every stale email")
+    for name in ("submit", "poll", "merge"):
+        p = sub.add_parser(name)
+        p.add_argument("job_id")
+        if name != "merge":
+            p.add_argument("--backend", default=None, choices=["local", "openai"])
+    run = sub.add_parser("run", help="create, submit, and (with --wait) poll and merge")
+    run.add_argument("--backend", default="local", choices=["local", "openai"])
+    run.add_argument("--wait", action="store_true")
+    run.add_argument("--interval", type=float, default=60.0, help="seconds between polls")
+    sub.add_parser("list")
+    args = parser.parse_args(argv)
+
+    if args.command == "create":
+        _create()
+    elif args.command == "submit":
+        job = _job(args.job_id)
+        _submit(job, get_backend(args.backend or "local"))
+        print(f"Job {job.id} submitted ({job.manifest['remote_id']})")
+    elif args.command == "poll":
+        job = _job(args.job_id)
+        status = poll_job(job, get_backend(args.backend or job.manifest.get("backend", "local")))
+        print(f"Job {job.id}: {status}")
+    elif args.command == "merge":
+        _merge(_job(args.job_id))
+    elif args.command == "run":
+        job = _create()
+        if not job.manifest["email_hashes"]:
+            print("Nothing to do: every email is up to date")
+            return
+        backend = get_backend(args.backend)
+        _submit(job, backend)
+        status = poll_job(job, backend)
+        while args.wait and status not in ("completed", "failed"):
+            time.sleep(args.interval)
+            status = poll_job(job, backend)
+        print(f"Job {job.id}: {status}")
+        if status == "completed":
+            _merge(job)
+    elif args.command == "list":
+        for job in list_jobs():
+            print(f"{job.id}  {job.status:10}  {job.manifest.get('requests', 0)} requests  "
+                  f"{job.manifest.get('backend', '-')}")
+
+
+if __name__ == "__main__":
+    main()
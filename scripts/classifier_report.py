@@ -0,0 +1,50 @@
+r"""Train the local category classifier and report its precision per category.
+
+Run this from the repo root inside the repo venv:
+
+  python scripts/classifier_report.py
+  python scripts/classifier_report.py --thresholds 0.8,0.9,0.95
+
+The classifier is brought up to date with the processed store first (the
+same incremental update the UI and `demo_ingest.py` do). Precision figures
+come from scoring each example before it was learned, so they estimate how
+the classifier does on mail it has not seen. Use them to pick
+EMAIL_AGENT_CLASSIFIER_THRESHOLD.
+"""
+import argparse
+import sys
+from pathlib import Path
+
+# Ensure project root is on sys.path when this script is run directly from scripts/
+ROOT = Path(__file__).resolve().parent.parent
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from backend.classifier import classifier_threshold, get_classifier, min_examples, update_classifier
+from backend.storage import iter_inbox, load_processed, load_prompts
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--thresholds", default=None,
+                        help="comma-separated confidence thresholds (default: the configured one)")
+    args = parser.parse_args(argv)
+
+    model = get_classifier()
+    if model is None:
+        sys.exit("The local classifier is disabled (EMAIL_AGENT_CLASSIFIER=0)")
+    learned = update_classifier(iter_inbox(), load_processed(), load_prompts())
+    status = "active" if len(model) >= min_examples() else f"inactive until {min_examples()} examples"
+    print(f"Classifier: {len(model)} examples ({learned} new), {status}")
+
+    thresholds = [float(t) for t in args.thresholds.split(",")] if args.thresholds else [classifier_threshold()]
+    for threshold in thresholds:
+        print(f"\nThreshold {threshold:.2f}")
+        print(f"  {'category':14} {'examples':>8} {'answered':>8} {'precision':>9} {'coverage':>8}")
+        for label, row in model.precision_report(threshold).items():
+            precision = f"{row['precision']:.1%}" if row["precision"] is not None else "-"
+            print(f"  {label:14} {row['examples']:>8} {row['answered']:>8} {precision:>9} {row['coverage']:>8.1%}")
+
+
+if __name__ == "__main__":
+    main()
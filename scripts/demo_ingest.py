@@ -4,10 +4,24 @@ Run this from the repo root inside the repo venv:
 
   .\.venv\Scripts\python.exe scripts\demo_ingest.py
 
-It will load `data/mock_inbox.json`, run categorization and action extraction
+It will stream the inbox (`data/mock_inbox.json`, or the JSON, JSONL, mbox or
+Maildir source named by EMAIL_AGENT_INBOX), run categorization and action extraction
 using the current prompts and the LLM client (or the mock fallback), and write
-`data/processed_emails.json` so the UI can pick it up.
+`data/processed_emails.json` so the UI can pick it up. Emails are processed
+concurrently; set EMAIL_AGENT_INGEST_CONCURRENCY to change the limit. Emails
+whose content and prompts are unchanged since the last run are skipped.
+
+For large inboxes:
+
+  demo_ingest.py --workers 4                # split the run across 4 processes
+  demo_ingest.py --shard 0/3 --workers 4    # on machine 0 of 3: write data/shards/processed_shard_0_of_3.json
+  demo_ingest.py merge                      # fold every shard file into the processed store
+
+`--shard` runs leave the processed store alone; copy the shard files to one
+machine and `merge` them, which reports emails with conflicting results and
+shards with no file.
 """
+import argparse
 import sys
 from pathlib import Path
 
@@ -16,31 +30,124 @@ ROOT = Path(__file__).resolve().parent.parent
 if str(ROOT) not in sys.path:
     sys.path.insert(0, str(ROOT))
 
-from backend.storage import load_emails, load_prompts, save_processed
-from backend.agent import categorize_email, extract_action_items
-import json
+from backend.storage import iter_inbox, inbox_path, load_prompts, load_processed, save_processed
+from backend.ingest import ingest_emails, ingest_concurrency, IngestStats
+from backend.classifier import update_classifier
+from backend.dedup import get_dedup_index
+from backend.metrics import export_metrics
+from backend.search_index import get_search_index
+from backend.shards import (SHARD_GLOB, default_shard_dir, ingest_parallel, merge_shards, parse_shard,
+                            shard_path, write_shard)
+from backend.threads import get_thread_index
+
+OUT_PATH = Path("data") / "processed_emails.json"
+
+
+def _refresh_indexes(processed, prompts):
+    index = get_search_index()
+    if index.sync(iter_inbox(), processed):
+        index.save()
+    threads = get_thread_index()
+    if threads.sync(iter_inbox()):
+        threads.save()
+    learned = update_classifier(iter_inbox(), processed, prompts)
+    dedup = get_dedup_index()
+    if dedup is not None:
+        dedup.save()
+    if learned:
+        print(f"Local classifier learned {learned} new example(s)")
+
+
+def _summary(stats):
+    return (f"Reprocessed {stats.reprocessed} ({stats.rule_hits} by rules, {stats.duplicate_hits} as near-duplicates, "
+            f"{stats.classifier_hits} categorized locally), deferred {stats.deferred} "
+            f"and skipped {stats.skipped} unchanged emails")
 
 
-def main():
-    emails = load_emails()
+def ingest(args):
     prompts = load_prompts()
-    processed = {}
-    for e in emails:
-        category = categorize_email(e, prompts)
-        actions = extract_action_items(e, prompts)
-        processed[e.id] = {
-            "email_id": e.id,
-            "category": category,
-            "action_items": actions,
-            "summary": None,
-        }
+    incremental = not args.full
+    if args.shard:
+        index, count = args.shard
+        results, stats = ingest_parallel(index, count, args.workers, incremental)
+        out_path = shard_path(index, count, args.out_dir)
+        write_shard(out_path, index, count, results)
+        dedup = get_dedup_index()
+        if dedup is not None:
+            dedup.save()
+        print(f"{_summary(stats)} in shard {index}/{count} of {inbox_path()} "
+              f"({args.workers} worker(s)); wrote {len(results)} results to {out_path}")
+        return 0
+
+    if args.workers > 1:
+        results, stats = ingest_parallel(workers=args.workers, incremental=incremental)
+        processed = {**load_processed(), **results}
+    else:
+        def report(result, done):
+            print(f"[{done}] {result.email_id}: {result.category}")
+
+        stats = IngestStats()
+        processed = ingest_emails(iter_inbox(), prompts, processed=load_processed(), on_result=report,
+                                  incremental=incremental, stats=stats)
+    save_processed(processed)
+    print(f"{_summary(stats)} from {inbox_path()} "
+          f"(concurrency {ingest_concurrency()}, {args.workers} worker(s)); "
+          f"wrote {len(processed)} results to {OUT_PATH}")
+    _refresh_indexes(processed, prompts)
+    export_metrics()
+    return 0
+
+
+def merge(args):
+    paths = args.paths or sorted((args.out_dir or default_shard_dir()).glob(SHARD_GLOB))
+    if not paths:
+        print("No shard files to merge", file=sys.stderr)
+        return 1
+    results, report = merge_shards(paths)
+    processed = {**load_processed(), **results}
+    save_processed(processed)
+    print(f"Merged {report.merged} results from {len(paths)} shard file(s); "
+          f"the store now holds {len(processed)} results")
+    for conflict in report.conflicts:
+        kept, *others = conflict.paths
+        print(f"  conflict: {conflict.email_id} differs between {kept} (kept) and {', '.join(map(str, others))}")
+    if report.missing:
+        print(f"  missing shards: {', '.join(report.missing)}")
+    _refresh_indexes(processed, load_prompts())
+    return 2 if report.conflicts or report.missing else 0
+
+
+def _shard_arg(spec):
+    try:
+        return parse_shard(spec)
+    except ValueError as exc:
+        raise argparse.ArgumentTypeError(str(exc))
+
 
-    out_path = Path("data") / "processed_emails.json"
-    with out_path.open("w", encoding="utf-8") as f:
-        json.dump(processed, f, indent=2)
+def main(argv=None):
+    argv = list(sys.argv[1:] if argv is None else argv)
+    # `ingest` is the default command
+    if not argv or argv[0] not in ("ingest", "merge", "-h", "--help"):
+        argv.insert(0, "ingest")
 
-    print(f"Processed {len(processed)} emails and wrote {out_path}")
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+    run = commands.add_parser("ingest", help="ingest the inbox, or one shard of it (the default)")
+    run.add_argument("--workers", type=int, default=1, help="number of ingestion processes")
+    run.add_argument("--shard", metavar="I/N", type=_shard_arg,
+                     help="only ingest shard I of N (0-based) and write a shard file")
+    run.add_argument("--full", action="store_true", help="re-process every email, changed or not")
+    run.add_argument("--out-dir", type=Path, help="shard file directory (EMAIL_AGENT_SHARD_DIR, data/shards)")
+    run.set_defaults(handler=ingest)
+    combine = commands.add_parser("merge", help="merge shard files into the processed store")
+    combine.add_argument("paths", nargs="*", type=Path, help="shard files (default: every file in --out-dir)")
+    combine.add_argument("--out-dir", type=Path, help="shard file directory (EMAIL_AGENT_SHARD_DIR, data/shards)")
+    combine.set_defaults(handler=merge)
+    args = parser.parse_args(argv)
+    if args.command == "ingest" and args.workers < 1:
+        parser.error("--workers must be at least 1")
+    return args.handler(args)
 
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
@@ -0,0 +1,59 @@
+r"""Background worker that runs queued ingestion jobs.
+
+Run this from the repo root inside the repo venv, next to the Streamlit app:
+
+  python scripts/ingest_worker.py               # run jobs as they are queued
+  python scripts/ingest_worker.py --once        # run what is queued, then exit
+  python scripts/ingest_worker.py --submit      # queue an incremental inbox ingest first
+
+Jobs are queued by the app's "Ingest / Re-process Inbox" and "Process Selected"
+buttons in `data/jobs.sqlite` (or EMAIL_AGENT_JOBS_DB). Results are written to
+the processed store as the job runs, so stopping the worker loses at most the
+last few emails; the next worker resumes the job where it stopped.
+
+The worker writes to the processed store while the app does, which needs the
+SQLite engine: it refuses to start unless EMAIL_AGENT_STORAGE=sqlite (run
+`scripts/migrate_storage.py` once to import the JSON store). Without a worker,
+the app runs its jobs itself.
+"""
+import argparse
+import logging
+import sys
+from pathlib import Path
+
+# Ensure project root is on sys.path when this script is run directly from scripts/
+ROOT = Path(__file__).resolve().parent.parent
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from backend.job_queue import get_job_queue, work
+from backend.storage import storage_engine
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--once", action="store_true", help="exit when the queue is empty")
+    parser.add_argument("--poll", type=float, default=2.0, help="seconds between queue polls")
+    parser.add_argument("--submit", action="store_true", help="queue an incremental ingest of the inbox")
+    parser.add_argument("--full", action="store_true", help="with --submit: re-process every email")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    if storage_engine() != "sqlite":
+        print(f"The ingestion worker needs EMAIL_AGENT_STORAGE=sqlite (the {storage_engine()!r} store is "
+              "rewritten whole on every write). Run scripts/migrate_storage.py once, then set it.", file=sys.stderr)
+        return 2
+
+    queue = get_job_queue()
+    if args.submit:
+        job = queue.submit("ingest", {"incremental": not args.full})
+        print(f"Queued job {job.id}")
+    count = work(queue, once=args.once, poll_interval=args.poll)
+    print(f"Ran {count} job(s)")
+    return 0
+
+
+if __name__ == "__main__":
+    try:
+        sys.exit(main())
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,28 @@
+r"""Import the JSON processed/draft stores into the SQLite storage engine.
+
+Run this from the repo root inside the repo venv:
+
+  .\.venv\Scripts\python.exe scripts\migrate_storage.py
+
+It reads `data/processed_emails.json` and `data/drafts.json` and writes them to
+`data/email_agent.sqlite` (or `EMAIL_AGENT_DB_PATH`). Afterwards set
+`EMAIL_AGENT_STORAGE=sqlite` so the app and scripts use the database.
+"""
+import sys
+from pathlib import Path
+
+# Ensure project root is on sys.path when this script is run directly from scripts/
+ROOT = Path(__file__).resolve().parent.parent
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from backend.storage import migrate_json_to_sqlite, _db_path
+
+
+def main():
+    counts = migrate_json_to_sqlite()
+    print(f"Imported {counts['processed']} processed emails and {counts['drafts']} drafts into {_db_path()}")
+
+
+if __name__ == "__main__":
+    main()
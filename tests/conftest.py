@@ -0,0 +1,29 @@
+import pytest
+
+from backend import storage
+from backend.models import Prompts
+
+
+@pytest.fixture
+def prompts():
+    return Prompts(
+        categorization_prompt="Categorize the email. Return JSON {\"category\": \"...\"}.",
+        action_item_prompt="Extract tasks. Respond in JSON array.",
+        auto_reply_prompt="Draft a reply.",
+    )
+
+
+@pytest.fixture
+def isolated_store(monkeypatch, tmp_path):
+    """Point the storage layer at an empty ``tmp_path`` on the JSON engine.
+
+    Set ``EMAIL_AGENT_STORAGE=sqlite`` in the test to use a database there
+    instead.
+    """
+    monkeypatch.setattr(storage, "DATA_DIR", tmp_path)
+    monkeypatch.setattr(storage, "_store", None)
+    monkeypatch.setattr(storage, "_store_key", None)
+    monkeypatch.setenv("EMAIL_AGENT_STORAGE", "json")
+    monkeypatch.setenv("EMAIL_AGENT_DB_PATH", str(tmp_path / "agent.sqlite"))
+    monkeypatch.setenv("EMAIL_AGENT_METRICS_DB", str(tmp_path / "metrics.sqlite"))
+    return tmp_path
@@ -0,0 +1,180 @@
+import json
+
+import pytest
+
+import backend.batch as batch
+from backend.batch import BatchJob, LocalBatchBackend, create_batch_job, merge_job, poll_job, submit_job
+from backend.models import Email
+
+EMAILS = [
+    Email(id="1", sender="boss@x.com", subject="Report", body="Send the final report.", timestamp=""),
+    Email(id="2", sender="news@x.com", subject="Weekly newsletter", body="Top stories", timestamp=""),
+]
+
+
+def test_local_batch_job_round_trip_and_resume(monkeypatch, tmp_path, prompts):
+    calls = []
+
+    def counting_llm(system_prompt, user_prompt, use_cache=True):
+        calls.append((system_prompt, user_prompt))
+        from backend.llm_client import _mock_response
+        return _mock_response(system_prompt, user_prompt)
+
+    monkeypatch.setattr(batch, "run_llm", counting_llm)
+    monkeypatch.setenv("EMAIL_AGENT_RULES", "0")
+    job = create_batch_job(EMAILS, prompts, jobs_dir=tmp_path)
+    lines = job.requests_path.read_text().splitlines()
+    assert [json.loads(line)["custom_id"] for line in lines] == [
+        "1::category", "1::action_items", "2::category", "2::action_items"]
+
+    # Simulate a run that stopped after the first request
+    first = json.loads(lines[0])
+    job.results_path.write_text(json.dumps({
+        "custom_id": first["custom_id"],
+        "response": {"status_code": 200, "body": {"choices": [{"message": {"content": '{"category": "To-Do"}'}}]}},
+        "error": None,
+    }) + "\n")
+    backend = LocalBatchBackend()
+    submit_job(job, backend)
+    assert len(calls) == 3
+    assert poll_job(job, backend) == "completed"
+
+    job = BatchJob(job.dir)  # reload from disk, as a separate invocation would
+    processed = {}
+    assert merge_job(job, processed) == {"merged": 2, "failed": 0, "rejected": 0}
+    assert processed["1"].category == "To-Do"
+    assert processed["1"].action_items == [{"task": "Write final report", "deadline": "2025-11-21"}]
+    assert processed["2"].category == "Newsletter"
+    assert merge_job(job, processed)["merged"] == 0
+
+    # Everything is current now, so a new job has nothing to do
+    assert create_batch_job(EMAILS, prompts, processed=processed, jobs_dir=tmp_path).manifest["requests"] == 0
+
+
+def test_merge_skips_errored_results(tmp_path, prompts):
+    job = create_batch_job(EMAILS[:1], prompts, jobs_dir=tmp_path)
+    job.results_path.write_text("\n".join(json.dumps(r) for r in [
+        {"custom_id": "1::category", "response": None, "error": {"message": "rate limited"}},
+        {"custom_id": "1::action_items",
+         "response": {"status_code": 200, "body": {"choices": [{"message": {"content": "[]"}}]}}},
+    ]))
+    job.manifest["status"] = "completed"
+
+    processed = {}
+    counts = merge_job(job, processed)
+    # Without a category the email can't be stored yet; it stays stale and
+    # is counted once
+    assert counts == {"merged": 0, "failed": 1, "rejected": 0}
+    assert job.manifest["errors"]["1::category"]["message"] == "rate limited"
+    assert processed == {}
+
+
+def test_rule_decided_emails_skip_the_batch(monkeypatch, tmp_path, prompts):
+    rules = tmp_path / "rules.json"
+    rules.write_text(json.dumps({"rules": [{"name": "news", "category": "Newsletter", "senders": ["news@x.com"]}]}))
+    monkeypatch.setenv("EMAIL_AGENT_RULES_PATH", str(rules))
+    monkeypatch.setattr(batch, "run_llm", lambda *a, **k: '{"category": "To-Do"}' if "Categorize" in a[0] else "[]")
+
+    job = create_batch_job(EMAILS, prompts, jobs_dir=tmp_path / "jobs")
+    assert [json.loads(line)["custom_id"] for line in job.requests_path.read_text().splitlines()] == [
+        "1::category", "1::action_items"]
+    backend = LocalBatchBackend()
+    submit_job(job, backend)
+    assert poll_job(job, backend) == "completed"
+    processed = {}
+    assert merge_job(job, processed) == {"merged": 2, "failed": 0, "rejected": 0}
+    assert processed["2"].category == "Newsletter"
+    assert processed["2"].provenance["category"]["rule"] == "news"
+    assert processed["1"].provenance == {}
+
+    # Nothing is stale afterwards, including the rule-decided email
+    assert create_batch_job(EMAILS, prompts, processed=processed, jobs_dir=tmp_path / "jobs").manifest["requests"] == 0
+
+
+def test_local_backend_stops_when_deferred_and_records_rejections(monkeypatch, tmp_path, prompts):
+    from backend.rate_governor import LLMDeferred, LLMRejected
+
+    monkeypatch.setenv("EMAIL_AGENT_RULES", "0")
+    job = create_batch_job(EMAILS, prompts, jobs_dir=tmp_path)
+    answers = iter([LLMRejected("BadRequestError", 400), '[]', LLMDeferred("circuit_open")])
+
+    def flaky_llm(system_prompt, user_prompt, use_cache=True):
+        answer = next(answers)
+        if isinstance(answer, Exception):
+            raise answer
+        return answer
+
+    monkeypatch.setattr(batch, "run_llm", flaky_llm)
+    backend = LocalBatchBackend()
+    with pytest.raises(LLMDeferred):
+        submit_job(job, backend)
+    assert job.status == "created"
+    results = [json.loads(line) for line in job.results_path.read_text().splitlines()]
+    assert [r["custom_id"] for r in results] == ["1::category", "1::action_items"]
+    assert results[0]["error"]["code"] == "BadRequestError"
+
+    # The next submit resumes after the recorded results
+    monkeypatch.setattr(batch, "run_llm", lambda *a, **k: '{"category": "Newsletter"}' if "Categorize" in a[0] else "[]")
+    submit_job(job, backend)
+    assert poll_job(job, backend) == "completed"
+    processed = {}
+    assert merge_job(job, processed) == {"merged": 1, "failed": 1, "rejected": 1}
+    assert set(processed) == {"2"}
+    assert job.manifest["errors"]["1::category"] == {
+        "status": 400, "code": "BadRequestError", "message": "BadRequestError (HTTP 400)", "retry": False}
+
+    # The rejected email is not sent again until it or the prompt changes
+    again = create_batch_job(EMAILS, prompts, processed=processed, jobs_dir=tmp_path)
+    assert again.manifest["requests"] == 0 and again.manifest["rejected_skipped"] == 2
+    edited = Email(id="1", sender="boss@x.com", subject="Report", body="Send the final report today.", timestamp="")
+    assert create_batch_job([edited], prompts, processed=processed, jobs_dir=tmp_path).manifest["requests"] == 2
+
+
+class _Files:
+    def __init__(self, contents):
+        self.contents = contents
+        self.fetched = []
+
+    def content(self, file_id):
+        self.fetched.append(file_id)
+        return type("Content", (), {"text": self.contents[file_id]})()
+
+
+class _Batches:
+    def retrieve(self, remote_id):
+        return type("Batch", (), {"status": "completed", "output_file_id": "out", "error_file_id": "err"})()
+
+
+def test_openai_backend_downloads_and_records_the_error_file(monkeypatch, tmp_path, prompts):
+    monkeypatch.setenv("EMAIL_AGENT_RULES", "0")
+    job = create_batch_job(EMAILS, prompts, jobs_dir=tmp_path)
+    job.manifest.update(backend="openai", remote_id="batch_1", status="submitted")
+    ok = {"status_code": 200, "body": {"choices": [{"message": {"content": '{"category": "Newsletter"}'}}]}}
+    files = _Files({
+        "out": "\n".join(json.dumps({"custom_id": c, "response": ok, "error": None})
+                         for c in ("2::category", "2::action_items")),
+        "err": "\n".join([
+            json.dumps({"custom_id": "1::category", "error": None, "response": {
+                "status_code": 400, "body": {"error": {"message": "Invalid content", "code": "invalid_request"}}}}),
+            json.dumps({"custom_id": "1::action_items", "response": None,
+                        "error": {"code": "batch_expired", "message": "not run before the window ended"}}),
+        ]),
+    })
+    client = type("Client", (), {"files": files, "batches": _Batches()})()
+    backend = batch.OpenAIBatchBackend(client)
+
+    assert poll_job(job, backend) == "completed"
+    assert files.fetched == ["out", "err"]
+    processed = {}
+    assert merge_job(job, processed) == {"merged": 1, "failed": 1, "rejected": 1}
+    errors = job.manifest["errors"]
+    assert errors["1::category"] == {"status": 400, "code": "invalid_request", "message": "Invalid content",
+                                     "retry": False}
+    assert errors["1::action_items"]["code"] == "batch_expired" and errors["1::action_items"]["retry"]
+
+
+def test_requests_without_any_result_are_recorded_as_missing(tmp_path, prompts):
+    job = create_batch_job(EMAILS[:1], prompts, jobs_dir=tmp_path)
+    job.manifest["status"] = "completed"
+    assert merge_job(job, {}) == {"merged": 0, "failed": 1, "rejected": 0}
+    assert {e["code"] for e in job.manifest["errors"].values()} == {"missing"}
@@ -0,0 +1,41 @@
+from backend import storage
+from benchmarks.fake_llm import FakeLLM, patched_llm
+from benchmarks.run_benchmarks import compare, run
+from benchmarks.synthetic import generate_inbox
+
+
+def test_synthetic_inbox_is_deterministic():
+    first = [e.subject for e in generate_inbox(50, seed=3)]
+    assert first == [e.subject for e in generate_inbox(50, seed=3)]
+    assert len({e.id for e in generate_inbox(50)}) == 50
+
+
+def test_fake_llm_is_patched_and_restored():
+    import backend.agent as agent
+
+    original = agent.run_llm
+    fake = FakeLLM(latency=0)
+    with patched_llm(fake):
+        assert agent.categorize_email(next(generate_inbox(1)), storage.load_prompts()) in (
+            "Important", "Newsletter", "Spam", "To-Do")
+    assert fake.calls == 1
+    assert agent.run_llm is original
+
+
+def test_small_run_reports_every_section_and_compares():
+    store_before = storage._store
+    report = run([40], latency=0, concurrency=4, ingest_limit=10, queries=5, drafts=5, log=lambda *_: None)
+
+    section = report["results"]["40"]
+    assert set(section) == {"inbox", "ingest", "storage_json", "storage_sqlite", "search", "threads"}
+    assert section["ingest"]["emails"] == 10
+    ingest = section["ingest"]
+    assert ingest["classifier_hits"] == 0
+    assert ingest["llm_calls"] == 2 * (10 - ingest["rule_hits"] - ingest["duplicate_hits"])
+    assert section["search"]["p95_ms"] >= 0
+    assert storage._store is store_before
+
+    slower = {"results": {"40": {"ingest": {"emails_per_s": section["ingest"]["emails_per_s"] / 2}}}}
+    regressions = compare(report, slower)
+    assert len(regressions) == 1 and regressions[0].startswith("40.ingest.emails_per_s")
+    assert compare(report, report) == []
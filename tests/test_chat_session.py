@@ -0,0 +1,62 @@
+import backend.chat_session as cs
+from backend.chat_session import load_chat_session
+from backend.models import Email
+
+EMAIL = Email(id="m/1", sender="boss@company.com", subject="Quarterly review",
+              body="Please prepare the slides for Monday.", timestamp="2025-11-20T10:00:00")
+
+
+def _fake_chat(requests):
+    def run_chat(messages, use_cache=True):
+        requests.append(messages)
+        return f"answer {len(requests)}"
+    return run_chat
+
+
+def test_turns_share_a_stable_prefix_and_persist(monkeypatch, tmp_path, prompts):
+    requests = []
+    monkeypatch.setattr(cs, "run_chat", _fake_chat(requests))
+    session = load_chat_session(EMAIL, prompts, tmp_path)
+    assert session.ask("What is due?") == "answer 1"
+    assert session.ask("By when?") == "answer 2"
+
+    first, second = requests
+    assert first[0] == second[0] and "Please prepare the slides" in first[0]["content"]
+    assert [m["role"] for m in second] == ["system", "user", "assistant", "user"]
+    assert second[1:3] == [{"role": "user", "content": "What is due?"}, {"role": "assistant", "content": "answer 1"}]
+
+    reloaded = load_chat_session(EMAIL, prompts, tmp_path)
+    assert reloaded.turns == [("What is due?", "answer 1"), ("By when?", "answer 2")]
+
+    # A changed email starts over
+    edited = Email(id=EMAIL.id, sender=EMAIL.sender, subject=EMAIL.subject, body="New text.", timestamp=EMAIL.timestamp)
+    assert load_chat_session(edited, prompts, tmp_path).turns == []
+
+
+def test_stream_records_the_turn(monkeypatch, tmp_path, prompts):
+    monkeypatch.setattr(cs, "run_chat_stream", lambda messages, use_cache=True: iter(["Mon", "day"]))
+    session = load_chat_session(EMAIL, prompts, tmp_path)
+    assert "".join(session.ask_stream("When?")) == "Monday"
+    assert load_chat_session(EMAIL, prompts, tmp_path).turns == [("When?", "Monday")]
+
+
+def test_history_is_compacted_into_a_summary(monkeypatch, tmp_path, prompts):
+    monkeypatch.setenv("EMAIL_AGENT_CHAT_MAX_TURNS", "4")
+    requests, summaries = [], []
+    monkeypatch.setattr(cs, "run_chat", _fake_chat(requests))
+    monkeypatch.setattr(cs, "run_llm", lambda system, user: summaries.append(user) or "user wants slides")
+    session = load_chat_session(EMAIL, prompts, tmp_path)
+    for i in range(5):
+        session.ask(f"question {i}")
+
+    # The fifth turn went over the limit: the oldest three were folded
+    assert len(summaries) == 1 and "question 0" in summaries[0] and "question 2" in summaries[0]
+    assert session.summary == "user wants slides"
+    assert [q for q, _a in session.turns] == ["question 3", "question 4"]
+
+    session.ask("question 5")
+    assert requests[-1][1] == {"role": "system", "content": "Summary of the earlier conversation:\nuser wants slides"}
+    assert len(requests[-1]) == 2 + 2 * 2 + 1
+
+    session.reset()
+    assert load_chat_session(EMAIL, prompts, tmp_path).summary == ""
@@ -0,0 +1,104 @@
+import random
+
+import backend.ingest as ingest
+import backend.llm_client as lc
+from backend.classifier import LocalClassifier
+from backend.fingerprints import email_fingerprint, stage_fingerprints
+from backend.ingest import IngestStats, ingest_emails
+from backend.models import Email, ProcessedEmail
+
+# Stands in for the categorization prompt fingerprint
+FP = "f" * 16
+VOCAB = {
+    "Spam": ("prize winner claim reward free crypto", "lucky.biz"),
+    "Newsletter": ("weekly digest top stories read more edition", "news.org"),
+    "To-Do": ("please prepare slides deadline review report", "company.com"),
+}
+
+
+def _corpus(n, fp=FP, seed=0):
+    rng = random.Random(seed)
+    emails, processed = [], {}
+    for i in range(n):
+        label = rng.choice(sorted(VOCAB))
+        words, domain = VOCAB[label]
+        body = " ".join(rng.choices(words.split() + ["the", "and", "team", "today"], k=20))
+        email = Email(id=str(i), sender=f"user{i}@{domain}", subject=" ".join(rng.sample(words.split(), 3)),
+                      body=body, timestamp="2025-11-20T10:00:00")
+        emails.append(email)
+        processed[email.id] = ProcessedEmail(email_id=email.id, category=label, action_items=[],
+                                             email_hash=email_fingerprint(email),
+                                             prompt_fingerprints={"category": fp})
+    return emails, processed
+
+
+def test_learns_predicts_and_reports_precision(monkeypatch):
+    monkeypatch.setenv("EMAIL_AGENT_CLASSIFIER_MIN_EXAMPLES", "20")
+    emails, processed = _corpus(120)
+    model = LocalClassifier()
+    assert model.predict(emails[0]) is None
+
+    assert model.sync(emails[:100], processed, FP) == 100
+    label, confidence = model.predict(emails[110])
+    assert label == processed["110"].category and confidence > 0.9
+
+    report = model.precision_report(0.9)
+    assert set(report) == set(VOCAB)
+    assert all(row["precision"] >= 0.95 for row in report.values())
+
+    # Incremental: only the new examples are learned
+    assert model.sync(emails, processed, FP) == 20
+    assert model.sync(emails, processed, FP) == 0
+
+
+def test_only_current_llm_labels_are_learned(monkeypatch):
+    emails, processed = _corpus(30)
+    processed["0"].provenance = {"category": {"source": "rule", "rule": "x"}}
+    processed["1"].prompt_fingerprints = {"category": "old-prompt"}
+    model = LocalClassifier()
+    assert model.sync(emails, processed, FP) == 28
+
+    # A relabelled example forces a retrain from scratch
+    processed["2"].category = "Important"
+    assert model.sync(emails, processed, FP) == 28
+    assert model.sync(emails, processed, "new-prompt") == 0 and len(model) == 0
+
+
+def test_save_and_load_round_trip(tmp_path, monkeypatch):
+    monkeypatch.setenv("EMAIL_AGENT_CLASSIFIER_MIN_EXAMPLES", "10")
+    emails, processed = _corpus(60)
+    model = LocalClassifier()
+    model.sync(emails, processed, FP)
+    model.save(tmp_path / "model.json")
+
+    loaded = LocalClassifier.load(tmp_path / "model.json")
+    assert len(loaded) == 60 and loaded.prompt_fingerprint == FP
+    assert loaded.predict(emails[5]) == model.predict(emails[5])
+    assert loaded.precision_report(0.5) == model.precision_report(0.5)
+    assert loaded.sync(emails, processed, FP) == 0
+
+
+def test_ingest_uses_confident_classifier(monkeypatch, prompts):
+    monkeypatch.setenv("EMAIL_AGENT_CLASSIFIER_MIN_EXAMPLES", "20")
+    monkeypatch.setenv("EMAIL_AGENT_RULES", "0")
+    fp = stage_fingerprints(prompts)["category"]
+    emails, processed = _corpus(100, fp)
+    model = LocalClassifier()
+    model.sync(emails[:80], processed, fp)
+    monkeypatch.setattr(ingest, "get_classifier", lambda: model)
+    calls = []
+
+    def counting_llm(system_prompt, user_prompt, use_cache=True):
+        calls.append(system_prompt)
+        return lc._mock_response(system_prompt, user_prompt)
+
+    monkeypatch.setattr(lc, "run_llm", counting_llm)
+    stats = IngestStats()
+    result = ingest_emails(emails[80:], prompts, stats=stats)
+
+    assert stats.classifier_hits == 20
+    assert calls == [prompts.action_item_prompt] * 20
+    assert all(result[e.id].category == processed[e.id].category for e in emails[80:])
+    assert result["80"].provenance["category"]["source"] == "classifier"
+    # Classifier answers are never used as training labels
+    assert model.sync(emails, result, fp) == 0
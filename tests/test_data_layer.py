@@ -0,0 +1,69 @@
+import json
+import os
+
+import pytest
+
+from backend import data_layer, storage
+from backend.models import ProcessedEmail
+
+
+@pytest.fixture
+def tmp_store(monkeypatch, isolated_store):
+    tmp_path = isolated_store
+    monkeypatch.setenv("EMAIL_AGENT_INBOX", str(tmp_path / "inbox.json"))
+    (tmp_path / "inbox.json").write_text(json.dumps([
+        {"id": "1", "sender": "a@b.c", "subject": "Hi", "body": "Hello", "timestamp": "2025-11-20T10:00:00"},
+    ]), encoding="utf-8")
+    data_layer.invalidate()
+    yield tmp_path
+    data_layer.invalidate()
+
+
+def test_snapshots_are_shared_until_a_write(tmp_store):
+    first = data_layer.get_processed()
+    assert data_layer.get_processed() is first
+    with pytest.raises(TypeError):
+        first["1"] = ProcessedEmail(email_id="1", category="Spam", action_items=[])
+
+    storage.upsert_processed([ProcessedEmail(email_id="1", category="Spam", action_items=[])])
+    second = data_layer.get_processed()
+    assert second is not first and second["1"].category == "Spam"
+
+    emails = data_layer.get_emails()
+    assert data_layer.get_emails() is emails
+    assert data_layer.get_email_map()["1"] is emails[0]
+
+
+def test_external_file_change_invalidates(tmp_store):
+    assert len(data_layer.get_emails()) == 1
+    inbox = tmp_store / "inbox.json"
+    inbox.write_text(json.dumps([
+        {"id": str(i), "sender": "a@b.c", "subject": "Hi", "body": "Hello", "timestamp": ""} for i in range(3)
+    ]), encoding="utf-8")
+    st = inbox.stat()
+    os.utime(inbox, ns=(st.st_atime_ns, st.st_mtime_ns + 1_000_000_000))
+    assert len(data_layer.get_emails()) == 3
+
+
+def test_indexes_follow_processed_changes_without_reading_bodies(tmp_store, monkeypatch):
+    from backend.mail_sources import JsonArraySource
+    from backend.search_index import SearchIndex
+    from backend.threads import ThreadIndex
+
+    search, threads = SearchIndex(), ThreadIndex()
+    monkeypatch.setattr(data_layer, "get_search_index", lambda: search)
+    monkeypatch.setattr(data_layer, "get_thread_index", lambda: threads)
+    monkeypatch.setenv("EMAIL_AGENT_INDEX_SAVE_SECONDS", "3600")
+    monkeypatch.setattr(SearchIndex, "save", lambda self, path=None: None)
+    monkeypatch.setattr(ThreadIndex, "save", lambda self, path=None: None)
+    loads = []
+    real_load = JsonArraySource.load
+    monkeypatch.setattr(JsonArraySource, "load", lambda self, ref: loads.append(ref.id) or real_load(self, ref))
+
+    search_index, thread_index = data_layer.get_indexes()
+    assert loads == ["1", "1"] and thread_index.thread_of("1") == ["1"]
+
+    storage.upsert_processed([ProcessedEmail(email_id="1", category="Spam", action_items=[])])
+    search_index, _ = data_layer.get_indexes()
+    assert [h.email_id for h in search_index.search("category:spam")] == ["1"]
+    assert loads == ["1", "1"]
@@ -0,0 +1,166 @@
+import backend.ingest as ingest
+import backend.llm_client as lc
+from backend.dedup import MIN_SHINGLES, DedupIndex, shingles
+from backend.ingest import IngestStats, ingest_emails
+from backend.models import Email
+
+TEMPLATE = (
+    "Hi {name}, your order {order} has shipped and will arrive on {day} November. "
+    "Track the parcel from your account page at any time. If anything looks wrong with "
+    "the delivery address, reply to this message and our support team will help you. "
+    "Thank you for shopping with us and have a great week."
+)
+
+
+def _notification(i, name="Alex", order=None):
+    order = 1000 + i if order is None else order
+    return Email(id=f"n{i}", sender="orders@shop.example", subject=f"Order {order} shipped",
+                 body=TEMPLATE.format(name=name, order=order, day=10 + order % 15),
+                 timestamp="2025-11-20T10:00:00")
+
+
+def _other():
+    return Email(id="o1", sender="boss@company.com", subject="Quarterly planning",
+                 body="Please prepare the slides for the quarterly planning meeting and send the final "
+                      "report to the leadership team before the review on Friday afternoon.",
+                 timestamp="2025-11-20T10:00:00")
+
+
+def test_templated_emails_are_near_duplicates():
+    index = DedupIndex()
+    index.add(_notification(1))
+    index.add(_other())
+
+    matches = index.candidates(_notification(2, name="Sam"))
+    assert [m.email_id for m in matches] == ["n1"]
+    assert matches[0].distance <= 6 and matches[0].similarity >= 0.8
+    assert not matches[0].same_digits
+    assert index.candidates(_notification(2, name="Sam", order=1001))[0].same_digits
+    assert index.candidates(Email(id="x", sender="a@b.c", subject="Lunch", body="Pizza today?", timestamp="")) == []
+
+
+def test_short_emails_are_not_indexed_and_edits_reindex():
+    index = DedupIndex()
+    short = Email(id="s", sender="a@b.c", subject="Hi", body="See you soon", timestamp="")
+    assert len(shingles(short)) < MIN_SHINGLES
+    index.add(short)
+    assert "s" not in index
+
+    index.add(_notification(1))
+    changed = _other()
+    changed.id = "n1"
+    index.add(changed)
+    assert index.candidates(_notification(2)) == []
+
+
+def test_save_load_and_band_layout_change(tmp_path):
+    index = DedupIndex()
+    for i in range(3):
+        index.add(_notification(i))
+    index.save(tmp_path / "dedup.json")
+
+    loaded = DedupIndex.load(tmp_path / "dedup.json", max_distance=5)
+    assert len(loaded) == 3
+    assert {m.email_id for m in loaded.candidates(_notification(9))} == {"n0", "n1", "n2"}
+
+
+def test_entries_exported_by_a_pool_worker_merge_into_the_parent():
+    worker = DedupIndex()
+    worker.add(_notification(1))
+    worker.add(_other())
+    parent = DedupIndex()
+    parent.add(_notification(7))
+    parent._dirty = False
+
+    parent.merge(worker.export(["n1", "o1", "n7", "missing"]))
+    assert "n1" in parent and "o1" in parent and "n7" not in parent
+    assert parent._dirty
+    assert [m.email_id for m in parent.candidates(_notification(2))] == ["n1"]
+    parent._dirty = False
+    parent.merge(worker.export(["n1"]))
+    assert not parent._dirty
+
+
+def test_ingest_reuses_results_for_near_duplicates(monkeypatch, prompts):
+    monkeypatch.setenv("EMAIL_AGENT_RULES", "0")
+    monkeypatch.setattr(ingest, "get_dedup_index", lambda: index)
+    index = DedupIndex()
+    calls = []
+
+    def counting_llm(system_prompt, user_prompt, use_cache=True):
+        calls.append(user_prompt)
+        return lc._mock_response(system_prompt, user_prompt)
+
+    monkeypatch.setattr(lc, "run_llm", counting_llm)
+    emails = [_notification(i, order=1000) for i in range(6)] + [_other()]
+    stats = IngestStats()
+    result = ingest_emails(emails, prompts, concurrency=8, stats=stats)
+
+    # One triage for the template (the rest wait for it), one for the other email
+    assert len(calls) == 4 and stats.duplicate_hits == 5 and stats.reprocessed == 7
+    assert result["n3"].category == result["n0"].category
+    assert result["n3"].provenance["category"] == {
+        "source": "duplicate", "of": "n0", "distance": result["n3"].provenance["category"]["distance"],
+        "similarity": result["n3"].provenance["category"]["similarity"]}
+    assert result["o1"].provenance == {}
+
+    # A later run reuses the stored results directly
+    calls.clear()
+    more = ingest_emails([_notification(20, order=1000)], prompts, processed=result, stats=IngestStats())
+    assert calls == [] and more["n20"].provenance["action_items"]["source"] == "duplicate"
+
+
+def test_near_duplicates_with_different_numbers_get_their_own_action_items(monkeypatch, prompts):
+    monkeypatch.setenv("EMAIL_AGENT_RULES", "0")
+    monkeypatch.setattr(ingest, "get_dedup_index", lambda: index)
+    index = DedupIndex()
+    calls = []
+
+    def counting_llm(system_prompt, user_prompt, use_cache=True):
+        calls.append(system_prompt)
+        return lc._mock_response(system_prompt, user_prompt)
+
+    monkeypatch.setattr(lc, "run_llm", counting_llm)
+    stats = IngestStats()
+    result = ingest_emails([_notification(i) for i in range(3)], prompts, concurrency=8, stats=stats)
+
+    # One categorization for the template, action items for every copy
+    assert calls.count(prompts.categorization_prompt) == 1
+    assert calls.count(prompts.action_item_prompt) == 3
+    assert stats.duplicate_hits == 2 and stats.stages_run["action_items"] == 3
+    assert result["n2"].category == result["n0"].category
+    assert result["n2"].provenance["category"]["of"] == "n0"
+    assert "action_items" not in result["n2"].provenance
+
+    calls.clear()
+    more = ingest_emails([_notification(20)], prompts, processed=result, stats=IngestStats())
+    assert calls == [prompts.action_item_prompt]
+    assert more["n20"].provenance["category"]["source"] == "duplicate"
+
+
+def test_followers_of_a_failed_leader_respect_the_concurrency_limit(monkeypatch, prompts):
+    import asyncio
+
+    monkeypatch.setenv("EMAIL_AGENT_RULES", "0")
+    monkeypatch.setattr(ingest, "get_dedup_index", lambda: DedupIndex())
+    real = ingest.process_email_async
+    active, peak = [0], [0]
+
+    async def tracked(email, *args, **kwargs):
+        active[0] += 1
+        peak[0] = max(peak[0], active[0])
+        try:
+            await asyncio.sleep(0.01)
+            if email.id == "n0":
+                raise RuntimeError("provider error")
+            return await real(email, *args, **kwargs)
+        finally:
+            active[0] -= 1
+
+    monkeypatch.setattr(ingest, "process_email_async", tracked)
+    stats = IngestStats()
+    result = ingest_emails([_notification(i, order=1000) for i in range(6)], prompts, concurrency=2, stats=stats)
+
+    # The five followers are triaged themselves, two at a time
+    assert stats.failed == 1 and set(result) == {f"n{i}" for i in range(1, 6)}
+    assert peak[0] == 2
@@ -9,13 +9,15 @@ def test_demo_ingest_writes_processed(tmp_path, monkeypatch):
     # Ensure we're executing in the repo root
     repo_root = Path(__file__).resolve().parents[1]
     monkeypatch.chdir(repo_root)
+    monkeypatch.setenv("EMAIL_AGENT_METRICS_DB", str(tmp_path / "metrics.sqlite"))
 
     out_path = repo_root / "data" / "processed_emails.json"
     if out_path.exists():
         out_path.unlink()
 
     # Run the demo_ingest script which should create processed_emails.json
-    runpy.run_path("scripts/demo_ingest.py", run_name="__main__")
+    demo = runpy.run_path("scripts/demo_ingest.py")
+    assert demo["main"]([]) == 0
 
     assert out_path.exists(), "processed_emails.json should be created"
 
@@ -26,3 +28,21 @@ def test_demo_ingest_writes_processed(tmp_path, monkeypatch):
     # processed_emails.json should have same number of emails processed as inbox length
     assert isinstance(data, dict)
     assert len(data) == len(emails)
+
+
+def test_demo_ingest_shards_and_merges(tmp_path, monkeypatch):
+    repo_root = Path(__file__).resolve().parents[1]
+    monkeypatch.chdir(repo_root)
+    monkeypatch.setenv("EMAIL_AGENT_METRICS_DB", str(tmp_path / "metrics.sqlite"))
+    demo = runpy.run_path("scripts/demo_ingest.py")
+    out_path = repo_root / "data" / "processed_emails.json"
+    if out_path.exists():
+        out_path.unlink()
+
+    assert demo["main"](["--shard", "0/2", "--out-dir", str(tmp_path)]) == 0
+    assert demo["main"](["--shard", "1/2", "--workers", "2", "--out-dir", str(tmp_path)]) == 0
+    assert not out_path.exists()  # shard runs leave the store alone
+    assert demo["main"](["merge", "--out-dir", str(tmp_path)]) == 0
+
+    with out_path.open("r", encoding="utf-8") as f:
+        assert len(json.load(f)) == len(storage.load_emails())
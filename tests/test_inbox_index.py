@@ -0,0 +1,75 @@
+import mailbox
+import pickle
+import tracemalloc
+from email.message import EmailMessage
+
+import pytest
+
+from backend.inbox_index import InboxIndex
+from backend.mail_sources import iter_emails
+from backend.models import Email, ProcessedEmail
+from benchmarks.synthetic import write_jsonl
+
+
+def test_index_looks_up_headers_and_loads_bodies_lazily(tmp_path):
+    path = write_jsonl(tmp_path / "inbox.jsonl", 300)
+    emails = list(iter_emails(path))
+    inbox = InboxIndex.open(path)
+
+    assert len(inbox) == 300 and inbox.ids[:3] == ["0", "1", "2"] and inbox.ids[-1] == "299"
+    assert "42" in inbox and "300" not in inbox
+    ref = inbox.ref(inbox.position("42"))
+    assert (ref.id, ref.sender, ref.subject, ref.timestamp) == \
+        (emails[42].id, emails[42].sender, emails[42].subject, emails[42].timestamp)
+
+    loads = []
+    load = inbox.source.load
+    inbox.source.load = lambda r: loads.append(r.id) or load(r)
+    assert inbox.get("42") == emails[42]
+    assert inbox.get("42") is inbox.get("42") and loads == ["42"]
+    assert inbox.get("missing") is None
+
+
+def test_index_reads_maildir_keys(tmp_path):
+    box = mailbox.Maildir(str(tmp_path / "Maildir"))
+    for i in range(3):
+        msg = EmailMessage()
+        msg["From"] = "team@example.com"
+        msg["Subject"] = f"Subject {i}"
+        msg["Message-ID"] = f"<msg-{i}@example.com>"
+        msg.set_content(f"Body number {i}\n")
+        box.add(msg)
+    box.close()
+
+    inbox = InboxIndex.open(tmp_path / "Maildir")
+    assert sorted(inbox.ids) == ["msg-0@example.com", "msg-1@example.com", "msg-2@example.com"]
+    assert inbox.get("msg-1@example.com").body.strip() == "Body number 1"
+    assert inbox.ref(0).sender is inbox.ref(2).sender
+
+
+def test_index_is_an_order_of_magnitude_smaller(tmp_path):
+    path = write_jsonl(tmp_path / "inbox.jsonl", 2000)
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        emails = list(iter_emails(path))
+        full = tracemalloc.get_traced_memory()[0] - before
+        del emails
+        before = tracemalloc.get_traced_memory()[0]
+        inbox = InboxIndex.open(path)
+        compact = tracemalloc.get_traced_memory()[0] - before
+    finally:
+        tracemalloc.stop()
+    assert len(inbox) == 2000
+    # Synthetic bodies are short (80 words); real ones widen the gap further
+    assert compact * 5 < full
+
+
+def test_models_are_slotted_and_share_strings():
+    email = Email(id="1", sender="".join(["boss@", "company.com"]), subject="s", body="b", timestamp="")
+    with pytest.raises(AttributeError):
+        email.extra = 1
+    assert email.sender is Email(id="2", sender="boss@company.com", subject="", body="", timestamp="").sender
+    result = ProcessedEmail(email_id="1", category="".join(["To", "-Do"]), action_items=[])
+    assert result.category is ProcessedEmail(email_id="2", category="To-" + "Do".strip(), action_items=[]).category
+    assert pickle.loads(pickle.dumps(result)) == result
@@ -0,0 +1,115 @@
+import threading
+import time
+
+import backend.llm_client as lc
+from backend.ingest import ingest_emails
+from backend.models import Email
+
+
+def _emails(n):
+    return [Email(id=str(i), sender="a@b.c", subject=f"Subject {i}", body="Please review.",
+                  timestamp="2025-11-20T10:00:00") for i in range(n)]
+
+
+def test_ingest_runs_llm_calls_concurrently(monkeypatch, prompts):
+    in_flight = 0
+    peak = 0
+    lock = threading.Lock()
+
+    def slow_llm(system_prompt, user_prompt, use_cache=True):
+        nonlocal in_flight, peak
+        with lock:
+            in_flight += 1
+            peak = max(peak, in_flight)
+        time.sleep(0.05)
+        with lock:
+            in_flight -= 1
+        return lc._mock_response(system_prompt, user_prompt)
+
+    monkeypatch.setattr(lc, "run_llm", slow_llm)
+    seen = []
+
+    start = time.perf_counter()
+    result = ingest_emails(_emails(8), prompts, concurrency=8, on_result=lambda r, done: seen.append(done))
+    elapsed = time.perf_counter() - start
+
+    assert set(result) == {str(i) for i in range(8)}
+    assert seen == list(range(1, 9))
+    assert 1 < peak <= 8
+    # 16 calls of 50ms each would take 0.8s sequentially
+    assert elapsed < 0.5
+
+
+def test_ingest_consumes_generators_and_updates_existing_store(monkeypatch, prompts):
+    monkeypatch.delenv("OPENAI_API_KEY", raising=False)
+    existing = {}
+    result = ingest_emails((e for e in _emails(3)), prompts, processed=existing, concurrency=2)
+    assert result is existing
+    assert all(p.category for p in existing.values())
+
+
+def test_fused_triage_uses_one_call_per_email(monkeypatch, prompts):
+    calls = []
+
+    def counting_llm(system_prompt, user_prompt, use_cache=True):
+        calls.append(system_prompt)
+        return lc._mock_response(system_prompt, user_prompt)
+
+    monkeypatch.setattr(lc, "run_llm", counting_llm)
+    email = Email(id="1", sender="manager@company.com", subject="Deadline",
+                  body="We need the final report by Friday.", timestamp="2025-11-20T10:15:00")
+
+    result = ingest_emails([email], prompts, fused=True)
+
+    assert len(calls) == 1
+    assert result["1"].category == "To-Do"
+    assert result["1"].action_items == [{"task": "Write final report", "deadline": "2025-11-21"}]
+
+
+def test_fused_triage_falls_back_per_field(monkeypatch, prompts):
+    import backend.agent as agent
+
+    def partial_llm(system_prompt, user_prompt, use_cache=True):
+        if '"action_items"' in system_prompt:
+            return '{"category": "Important", "action_items": "not a list"}'
+        return '[{"task": "Reply", "deadline": null}]'
+
+    monkeypatch.setattr(agent, "run_llm", partial_llm)
+    email = _emails(1)[0]
+
+    category, actions = agent.triage_email(email, prompts)
+    assert category == "Important"
+    assert actions == [{"task": "Reply", "deadline": None}]
+
+
+def test_incremental_ingest_reruns_only_stale_stage(monkeypatch, prompts):
+    from dataclasses import replace
+    from backend.ingest import IngestStats
+
+    calls = []
+
+    def counting_llm(system_prompt, user_prompt, use_cache=True):
+        calls.append(system_prompt)
+        return lc._mock_response(system_prompt, user_prompt)
+
+    monkeypatch.setattr(lc, "run_llm", counting_llm)
+    emails = _emails(3)
+    store = ingest_emails(emails, prompts, incremental=True)
+    assert len(calls) == 6
+
+    calls.clear()
+    stats = IngestStats()
+    ingest_emails(emails, prompts, processed=store, incremental=True, stats=stats)
+    assert calls == [] and stats.skipped == 3 and stats.reprocessed == 0
+
+    edited = replace(prompts, action_item_prompt="Extract tasks, concisely. Respond in JSON array.")
+    stats = IngestStats()
+    ingest_emails(emails, edited, processed=store, incremental=True, stats=stats)
+    assert calls == [edited.action_item_prompt] * 3
+    assert stats.stages_run == {"category": 0, "action_items": 3}
+
+    calls.clear()
+    emails[0].body = "Changed body"
+    stats = IngestStats()
+    ingest_emails(emails, edited, processed=store, incremental=True, stats=stats)
+    assert len(calls) == 2 and stats.reprocessed == 1 and stats.skipped == 2
@@ -0,0 +1,150 @@
+import json
+import threading
+import time
+
+import backend.llm_client as lc
+from backend import storage
+from backend.job_queue import JobQueue, run_in_process, run_job, work
+
+
+def _setup(monkeypatch, tmp_path, prompts, n=5):
+    """Queue, sqlite store, inbox and prompts in ``tmp_path`` (the isolated_store fixture's)."""
+    monkeypatch.setenv("EMAIL_AGENT_STORAGE", "sqlite")
+    for name in ("EMAIL_AGENT_RULES", "EMAIL_AGENT_CLASSIFIER", "EMAIL_AGENT_DEDUP"):
+        monkeypatch.setenv(name, "0")
+    inbox = tmp_path / "inbox.json"
+    inbox.write_text(json.dumps([
+        {"id": str(i), "sender": f"user{i}@x.com", "subject": f"Subject {i}",
+         "body": f"Please prepare slides number {i}.", "timestamp": "2025-11-20T10:00:00"}
+        for i in range(n)
+    ]), encoding="utf-8")
+    monkeypatch.setenv("EMAIL_AGENT_INBOX", str(inbox))
+    storage.save_prompts(prompts)
+
+    calls = []
+
+    def counting_llm(system_prompt, user_prompt, use_cache=True):
+        calls.append(user_prompt)
+        return lc._mock_response(system_prompt, user_prompt)
+
+    monkeypatch.setattr(lc, "run_llm", counting_llm)
+    return JobQueue(tmp_path / "jobs.sqlite"), calls
+
+
+def test_submit_claim_and_stale_reclaim(tmp_path):
+    queue = JobQueue(tmp_path / "jobs.sqlite")
+    job = queue.submit("ingest", {"incremental": True})
+    assert queue.submit("ingest", {"incremental": True}).id == job.id  # double click
+
+    claimed = queue.claim("w1")
+    assert claimed.id == job.id and claimed.status == "running" and claimed.worker == "w1"
+    assert queue.claim("w2") is None
+    # w1 went silent: the job is handed to the next worker
+    assert queue.claim("w2", stale_after=-1).worker == "w2"
+
+    queue.cancel(job.id)
+    assert queue.get(job.id).cancel_requested
+    assert queue.claim("w3", stale_after=-1) is None
+    assert queue.get(job.id).status == "cancelled"
+
+
+def test_worker_runs_jobs_and_checkpoints(monkeypatch, isolated_store, prompts):
+    monkeypatch.setenv("EMAIL_AGENT_JOB_CHECKPOINT_EVERY", "2")
+    queue, calls = _setup(monkeypatch, isolated_store, prompts)
+    job = queue.submit("ingest", {"incremental": True})
+
+    assert work(queue, once=True) == 1
+    job = queue.get(job.id)
+    assert job.status == "completed" and (job.done, job.total, job.reprocessed) == (5, 5, 5)
+    assert storage.count_processed() == 5
+    assert queue.completed_items(job.id) == {str(i) for i in range(5)}
+    assert queue.live_workers() == 0
+
+
+def test_resumed_job_skips_checkpointed_emails(monkeypatch, isolated_store, prompts):
+    queue, calls = _setup(monkeypatch, isolated_store, prompts)
+    job = queue.submit("process", {"email_ids": ["0", "1", "2", "3", "4"]})
+    job = queue.claim("w1")
+    # A previous worker checkpointed two emails, then died
+    job.total, job.done, job.reprocessed = 5, 2, 2
+    queue.checkpoint(job, ["0", "1"])
+
+    job = run_job(queue, queue.claim("w2", stale_after=-1))
+    assert job.status == "completed" and job.done == 5
+    assert len(calls) == 2 * 3
+
+
+def test_cancel_stops_at_the_next_checkpoint(monkeypatch, isolated_store, prompts):
+    monkeypatch.setenv("EMAIL_AGENT_JOB_CHECKPOINT_EVERY", "1")
+    monkeypatch.setenv("EMAIL_AGENT_INGEST_CONCURRENCY", "1")
+    queue, _calls = _setup(monkeypatch, isolated_store, prompts)
+    queue.submit("ingest", {"incremental": False})
+    job = queue.claim("w1")
+    queue.cancel(job.id)
+
+    job = run_job(queue, job)
+    assert job.status == "cancelled"
+    assert storage.count_processed() == 1
+
+
+def test_completed_job_predrafts_replies(monkeypatch, isolated_store, prompts):
+    monkeypatch.setenv("EMAIL_AGENT_PREDRAFT", "1")
+    monkeypatch.setenv("EMAIL_AGENT_PREDRAFT_CATEGORIES", "To-Do")
+    queue, _calls = _setup(monkeypatch, isolated_store, prompts, n=3)
+    job = queue.submit("ingest", {"incremental": True})
+
+    assert work(queue, once=True) == 1
+    assert "pre-drafted 3 replies" in queue.get(job.id).message
+    assert {d.metadata["status"] for d in storage.load_drafts()} == {"pending"}
+
+
+def test_slow_job_keeps_its_heartbeat_between_checkpoints(monkeypatch, isolated_store, prompts):
+    monkeypatch.setenv("EMAIL_AGENT_JOB_STALE_SECONDS", "0.3")
+    monkeypatch.setenv("EMAIL_AGENT_JOB_CHECKPOINT_EVERY", "100")
+    monkeypatch.setenv("EMAIL_AGENT_INGEST_CONCURRENCY", "1")
+    queue, _calls = _setup(monkeypatch, isolated_store, prompts, n=3)
+
+    def slow_llm(system_prompt, user_prompt, use_cache=True):
+        time.sleep(0.15)
+        return lc._mock_response(system_prompt, user_prompt)
+
+    monkeypatch.setattr(lc, "run_llm", slow_llm)
+    queue.submit("ingest", {"incremental": True})
+    job = queue.claim("w1")
+    runner = threading.Thread(target=run_job, args=(queue, job))
+    runner.start()
+    stolen = []
+    while runner.is_alive():
+        stolen.append(queue.claim("w2"))
+        time.sleep(0.05)
+    runner.join()
+
+    assert not any(stolen)
+    assert queue.get(job.id).status == "completed" and queue.get(job.id).worker == "w1"
+
+
+def test_predrafting_refreshes_the_heartbeat(monkeypatch, isolated_store, prompts):
+    monkeypatch.setenv("EMAIL_AGENT_PREDRAFT", "1")
+    monkeypatch.setenv("EMAIL_AGENT_PREDRAFT_CATEGORIES", "To-Do")
+    queue, _calls = _setup(monkeypatch, isolated_store, prompts, n=3)
+    beats = []
+    monkeypatch.setattr(queue, "heartbeat", beats.append)
+    queue.submit("ingest", {"incremental": True})
+    job = run_job(queue, queue.claim("w1"))
+
+    assert job.status == "completed" and [b.id for b in beats] == [job.id] * 3
+
+
+def test_jobs_run_in_process_on_the_json_store(monkeypatch, isolated_store, prompts):
+    queue, _calls = _setup(monkeypatch, isolated_store, prompts, n=3)
+    monkeypatch.setenv("EMAIL_AGENT_STORAGE", "json")
+    other = queue.submit("ingest", {"incremental": True})
+    job = queue.submit("process", {"email_ids": ["1"]})
+    seen = []
+
+    job = run_in_process(queue, job, on_progress=lambda j: seen.append(j.done))
+    assert job.status == "completed" and seen[-1] == 1
+    assert set(storage.load_processed()) == {"1"}
+    # Only the requested job was claimed
+    assert queue.get(other.id).status == "queued"
+    assert run_in_process(queue, job).status == "completed"
@@ -0,0 +1,40 @@
+import json
+
+from backend.json_stream import PartialJsonObject, parse_partial_object
+from backend.llm_client import _stream_text
+
+
+def test_partial_string_fields_are_visible_before_completion():
+    fields, complete = parse_partial_object('{"subject": "Re: Plan", "body": "Hi Sam,\\nThanks for')
+    assert not complete
+    assert fields == {"subject": "Re: Plan", "body": "Hi Sam,\nThanks for"}
+
+
+def test_incomplete_escapes_and_values_are_held_back():
+    assert parse_partial_object('{"body": "line\\')[0] == {"body": "line"}
+    assert parse_partial_object('{"body": "caf\\u00')[0] == {"body": "caf"}
+    assert parse_partial_object('{"a": "x", "items": ["one", "tw')[0] == {"a": "x"}
+
+
+def test_streamed_chunks_reassemble_to_the_full_object():
+    payload = {"subject": 'Re: "Q4" plan', "body": "Thanks — see you {Monday}.",
+               "suggested_followups": ["Ping in 3 days", "Confirm [agenda]"]}
+    raw = "```json\n" + json.dumps(payload) + "\n```"
+    partial = PartialJsonObject()
+    bodies = []
+    for chunk in _stream_text(raw):
+        bodies.append(partial.feed(chunk).get("body"))
+    assert partial.complete
+    assert partial.fields == payload
+    # the body was readable while the stream was still going
+    assert any(b and b != payload["body"] for b in bodies)
+
+
+def test_mock_stream_matches_blocking_response(monkeypatch):
+    import backend.llm_client as lc
+
+    monkeypatch.delenv("OPENAI_API_KEY", raising=False)
+    system, user = "Draft a reply in JSON", "Original email subject: Lunch\\nOriginal email body: Free?"
+    chunks = list(lc.run_llm_stream(system, user))
+    assert len(chunks) > 1
+    assert "".join(chunks) == lc.run_llm(system, user)
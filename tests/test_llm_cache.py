@@ -0,0 +1,84 @@
+import time
+
+import backend.llm_cache as cache_mod
+import backend.llm_client as lc
+from backend.llm_cache import LLMCache, make_key
+
+
+class _FakeCompletions:
+    def __init__(self):
+        self.calls = 0
+
+    def create(self, model, messages, temperature):
+        self.calls += 1
+
+        class _Msg:
+            content = '{"category": "Important"}'
+
+        class _Choice:
+            message = _Msg()
+
+        class _Resp:
+            choices = [_Choice()]
+
+        return _Resp()
+
+
+class _FakeClient:
+    def __init__(self):
+        self.completions = _FakeCompletions()
+        self.chat = self
+
+
+def _use_fake_client(monkeypatch, tmp_path):
+    client = _FakeClient()
+    monkeypatch.setattr(lc, "get_client", lambda: client)
+    monkeypatch.setenv("EMAIL_AGENT_LLM_CACHE_PATH", str(tmp_path / "cache.sqlite"))
+    monkeypatch.setattr(cache_mod, "_cache", None)
+    return client
+
+
+def test_run_llm_second_call_is_served_from_cache(monkeypatch, tmp_path):
+    client = _use_fake_client(monkeypatch, tmp_path)
+
+    first = lc.run_llm("Categorize this", "Email subject: hi")
+    second = lc.run_llm("Categorize this", "Email subject: hi")
+
+    assert first == second
+    assert client.completions.calls == 1
+    stats = cache_mod.get_cache().stats()
+    assert stats["hits"] == 1 and stats["misses"] == 1
+
+
+def test_run_llm_cache_bypass(monkeypatch, tmp_path):
+    client = _use_fake_client(monkeypatch, tmp_path)
+    monkeypatch.setenv("EMAIL_AGENT_LLM_CACHE", "0")
+
+    lc.run_llm("Categorize this", "Email subject: hi")
+    lc.run_llm("Categorize this", "Email subject: hi")
+    assert client.completions.calls == 2
+
+
+def test_cache_key_depends_on_model_and_prompts():
+    base = make_key("m", 0.2, "sys", "user")
+    assert base == make_key("m", 0.2, "sys", "user")
+    assert base != make_key("m2", 0.2, "sys", "user")
+    assert base != make_key("m", 0.7, "sys", "user")
+    assert base != make_key("m", 0.2, "sys", "user2")
+
+
+def test_cache_eviction_by_size_and_age(tmp_path):
+    cache = LLMCache(tmp_path / "c.sqlite", max_entries=2, max_age_days=None)
+    for i in range(4):
+        cache.put(f"k{i}", "m", f"v{i}")
+        time.sleep(0.01)
+    cache.get("k0")  # touch so it is the most recently used
+    assert cache.evict() == 2
+    assert cache.get("k0") == "v0"
+    assert cache.get("k1") is None
+
+    cache.max_age_seconds = 0.001
+    time.sleep(0.01)
+    cache.evict()
+    assert cache.stats()["entries"] == 0
+    cache.close()
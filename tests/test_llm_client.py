@@ -28,3 +28,37 @@ def test_run_llm_mock_reply(monkeypatch):
     data = json.loads(out)
     assert "subject" in data and "body" in data
     assert data["subject"].startswith("Re:")
+
+
+class _FakeOpenAI:
+    def __init__(self, api_key, **kwargs):
+        self.api_key = api_key
+        self.kwargs = kwargs
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+def test_client_is_reused_and_rebuilt_on_key_change(monkeypatch):
+    monkeypatch.setattr(lc, "OpenAI", _FakeOpenAI)
+    monkeypatch.setattr(lc, "httpx", None)
+    monkeypatch.setenv("OPENAI_API_KEY", "key-1")
+    monkeypatch.setenv("OPENAI_TIMEOUT", "5")
+    lc._client_manager.reset()
+
+    first = lc.get_client()
+    assert lc.get_client() is first
+    assert first.kwargs["timeout"] == 5.0
+
+    monkeypatch.setenv("OPENAI_API_KEY", "key-2")
+    second = lc.get_client()
+    assert second is not first and second.api_key == "key-2"
+    assert first.closed
+
+    monkeypatch.setenv("OPENAI_DEFAULT_MODEL", "another-model")
+    assert lc.get_client() is not second
+
+    monkeypatch.delenv("OPENAI_API_KEY")
+    assert lc.get_client() is None
+    lc._client_manager.reset()
@@ -0,0 +1,128 @@
+import json
+import mailbox
+from email.message import EmailMessage
+
+import backend.mail_sources as ms
+from backend.mail_sources import open_source, iter_emails, JsonArraySource, JsonlSource, MboxSource, MaildirSource
+
+
+def _records(n):
+    return [{"id": str(i), "sender": f"user{i}@example.com", "subject": f"Subject {i}",
+             "body": f"Body number {i}", "timestamp": "2025-11-20T10:00:00", "extra": "ignored"}
+            for i in range(n)]
+
+
+def _message(i):
+    msg = EmailMessage()
+    msg["From"] = f"user{i}@example.com"
+    msg["Subject"] = f"Subject {i}"
+    msg["Message-ID"] = f"<msg-{i}@example.com>"
+    msg["Date"] = "Thu, 20 Nov 2025 10:15:00 +0000"
+    msg.set_content(f"Body number {i}\n")
+    return msg
+
+
+def test_jsonl_source_streams_and_loads_by_offset(tmp_path):
+    path = tmp_path / "inbox.jsonl"
+    path.write_text("\n".join(json.dumps(r) for r in _records(3)) + "\n\n", encoding="utf-8")
+
+    source = open_source(path)
+    assert isinstance(source, JsonlSource)
+    assert [e.id for e in source] == ["0", "1", "2"]
+
+    refs = list(source.refs())
+    assert refs[2].subject == "Subject 2"
+    assert source.load(refs[2]).body == "Body number 2"
+
+
+def test_json_array_source_parses_once_until_the_file_changes(tmp_path, monkeypatch):
+    path = tmp_path / "inbox.json"
+    path.write_text(json.dumps(_records(3)), encoding="utf-8")
+    parses = []
+    real_load = ms.json.load
+    monkeypatch.setattr(ms.json, "load", lambda f: parses.append(1) or real_load(f))
+
+    source = open_source(path)
+    assert isinstance(source, JsonArraySource)
+    refs = list(source.refs())
+    assert [source.load(r).body for r in refs] == ["Body number 0", "Body number 1", "Body number 2"]
+    assert len(parses) == 1
+
+    path.write_text(json.dumps(_records(4)), encoding="utf-8")
+    assert source.load(list(source.refs())[3]).id == "3"
+    assert len(parses) == 2
+
+
+def test_mbox_source(tmp_path):
+    path = tmp_path / "inbox.mbox"
+    box = mailbox.mbox(str(path))
+    for i in range(3):
+        box.add(_message(i))
+    box.close()
+
+    source = open_source(path)
+    assert isinstance(source, MboxSource)
+    emails = list(source)
+    assert [e.id for e in emails] == ["msg-0@example.com", "msg-1@example.com", "msg-2@example.com"]
+    assert emails[1].body.strip() == "Body number 1"
+    assert emails[1].timestamp.startswith("2025-11-20T10:15:00")
+
+    ref = list(source.refs())[2]
+    assert ref.sender == "user2@example.com"
+    assert source.load(ref).body.strip() == "Body number 2"
+    source.close()
+
+
+def test_maildir_source(tmp_path):
+    box = mailbox.Maildir(str(tmp_path / "Maildir"))
+    box.add(_message(7))
+    box.close()
+
+    source = open_source(tmp_path / "Maildir")
+    assert isinstance(source, MaildirSource)
+    (email,) = list(iter_emails(tmp_path / "Maildir"))
+    assert email.subject == "Subject 7"
+
+
+def test_mbox_threading_headers(tmp_path):
+    path = tmp_path / "inbox.mbox"
+    reply = _message(1)
+    reply["In-Reply-To"] = "<msg-0@example.com>"
+    box = mailbox.mbox(str(path))
+    box.add(_message(0))
+    box.add(reply)
+    box.close()
+
+    first, second = list(open_source(path))
+    assert first.message_id == "msg-0@example.com" and first.in_reply_to is None
+    assert second.in_reply_to == "msg-0@example.com"
+
+
+def test_mbox_ids_without_message_id_survive_a_rewrite(tmp_path, monkeypatch):
+    path = tmp_path / "inbox.mbox"
+    box = mailbox.mbox(str(path))
+    for i in range(3):
+        msg = _message(i)
+        del msg["Message-ID"]
+        box.add(msg)
+    box.close()
+
+    source = open_source(path)
+    ids = [e.id for e in source]
+    assert len(set(ids)) == 3 and not any(i.isdigit() for i in ids)
+    assert [r.id for r in source.refs()] == ids
+    source.close()
+
+    # Dropping the first message renumbers the mailbox keys, not the ids
+    box = mailbox.mbox(str(path))
+    box.remove(next(box.iterkeys()))
+    box.close()
+    with open_source(path) as source:
+        assert [e.id for e in source] == ids[1:]
+
+    closed = []
+    monkeypatch.setattr(MboxSource, "close", lambda self: closed.append(self.path))
+    emails = iter_emails(path)
+    next(emails)
+    emails.close()
+    assert closed == [path]
@@ -0,0 +1,126 @@
+import asyncio
+import json
+from types import SimpleNamespace
+
+import pytest
+
+import backend.llm_cache as cache_mod
+import backend.llm_client as lc
+from backend.agent import categorize_email, categorize_email_async, draft_reply_stream
+from backend.metrics import Histogram, LLMMetrics, get_metrics, llm_caller
+from backend.models import Email
+from backend.rate_governor import LLMDeferred
+from backend.storage import load_prompts
+
+EMAIL = Email(id="1", sender="boss@company.com", subject="Final report", body="Please send the final report.",
+              timestamp="2025-11-20T09:00:00")
+
+
+def _by_caller():
+    return {row["caller"]: row for row in get_metrics().summary()}
+
+
+def test_histogram_quantiles():
+    hist = Histogram([1, 2, 4])
+    for value in (0.5, 1.5, 1.5, 3, 10):
+        hist.observe(value)
+    assert hist.counts == [1, 2, 1, 1]
+    assert hist.quantile(0.5) == 1.75
+    assert hist.quantile(1.0) == 4
+    assert Histogram([1]).quantile(0.5) is None
+
+
+def test_mock_calls_are_attributed_to_agent_functions(monkeypatch):
+    monkeypatch.delenv("OPENAI_API_KEY", raising=False)
+    get_metrics().reset()
+    prompts = load_prompts()
+
+    categorize_email(EMAIL, prompts)
+    asyncio.run(categorize_email_async(EMAIL, prompts))
+    stream = draft_reply_stream(EMAIL, prompts)
+    with llm_caller("somewhere_else"):
+        "".join(stream)
+
+    rows = _by_caller()
+    assert rows["categorize_email"]["calls"] == 2
+    assert rows["categorize_email"]["mock"] == 2
+    assert rows["draft_reply"]["calls"] == 1
+    assert "somewhere_else" not in rows and "unknown" not in rows
+
+
+class _Completions:
+    def __init__(self, fail=False):
+        self.fail = fail
+
+    def create(self, model, messages, temperature):
+        if self.fail:
+            raise TimeoutError("slow")
+        return SimpleNamespace(
+            choices=[SimpleNamespace(message=SimpleNamespace(content='{"category": "Important"}'))],
+            usage=SimpleNamespace(prompt_tokens=120, completion_tokens=8),
+        )
+
+
+def test_network_cache_and_deferred_outcomes(monkeypatch, tmp_path):
+    client = SimpleNamespace(completions=_Completions())
+    client.chat = client
+    monkeypatch.setattr(lc, "get_client", lambda: client)
+    monkeypatch.setenv("EMAIL_AGENT_LLM_CACHE_PATH", str(tmp_path / "cache.sqlite"))
+    monkeypatch.setattr(cache_mod, "_cache", None)
+    monkeypatch.setenv("EMAIL_AGENT_LLM_RETRIES", "0")
+    get_metrics().reset()
+
+    prompts = load_prompts()
+    categorize_email(EMAIL, prompts)
+    categorize_email(EMAIL, prompts)  # served from the cache
+    client.completions.fail = True
+    with llm_caller("probe"), pytest.raises(LLMDeferred):
+        lc.run_llm("system", "uncached", use_cache=False)
+
+    rows = _by_caller()
+    assert rows["categorize_email"]["calls"] == 2
+    assert rows["categorize_email"]["cache_hit_rate"] == 0.5
+    assert rows["categorize_email"]["prompt_tokens"] == 120
+    assert rows["probe"]["deferred"] == 1
+
+    payload = json.loads(get_metrics().to_json())
+    assert payload["callers"]["probe"]["fallback_reasons"] == {"TimeoutError": 1}
+    cache_mod._cache.close()
+
+
+def test_prometheus_export():
+    metrics = LLMMetrics()
+    metrics.record("network", 0.3, model="gpt-x", caller="triage_email", prompt_tokens=100, completion_tokens=20)
+    metrics.record("deferred", 0.01, model="gpt-x", caller="triage_email", fallback_reason="RateLimitError")
+    text = metrics.to_prometheus()
+
+    assert 'email_agent_llm_calls_total{caller="triage_email",model="gpt-x",outcome="network"} 1' in text
+    assert 'email_agent_llm_fallbacks_total{caller="triage_email",reason="RateLimitError"} 1' in text
+    assert 'email_agent_llm_latency_seconds_bucket{caller="triage_email",le="0.5"} 2' in text
+    assert 'email_agent_llm_latency_seconds_count{caller="triage_email"} 2' in text
+    assert 'email_agent_llm_call_tokens_sum{caller="triage_email"} 120' in text
+
+
+def test_shared_metrics_add_up_every_process(monkeypatch, tmp_path):
+    import os
+
+    import backend.metrics as metrics_mod
+    from backend.metrics import export_metrics, shared_metrics
+
+    path = tmp_path / "metrics.sqlite"
+    get_metrics().reset()
+    # The worker process records and exports its triage calls
+    monkeypatch.setattr(metrics_mod, "_process", (os.getpid(), "worker"))
+    get_metrics().record("network", 0.2, model="gpt-x", caller="triage_email", prompt_tokens=100, completion_tokens=10)
+    export_metrics(path)
+    export_metrics(path)  # re-exporting replaces the row
+
+    # The app process only made a chat call so far
+    monkeypatch.setattr(metrics_mod, "_process", (os.getpid(), "app"))
+    get_metrics().reset()
+    get_metrics().record("network", 0.4, model="gpt-x", caller="chat_about_email")
+    rows = {r["caller"]: r for r in shared_metrics(path).summary()}
+    assert rows["triage_email"]["calls"] == 1 and rows["triage_email"]["prompt_tokens"] == 100
+    assert rows["chat_about_email"]["calls"] == 1
+    assert 'email_agent_llm_latency_seconds_count{caller="triage_email"} 1' in shared_metrics(path).to_prometheus()
+    get_metrics().reset()
@@ -0,0 +1,70 @@
+import json
+from dataclasses import replace
+
+import backend.predraft as pd
+from backend import storage
+from backend.models import Email, ProcessedEmail
+from backend.predraft import claim_pending_draft, pending_draft, predraft_emails
+from backend.rate_governor import LLMDeferred
+
+CATEGORIES = ["Important", "To-Do", "Newsletter", "To-Do", "Spam"]
+EMAILS = [Email(id=str(i), sender="a@b.c", subject=f"Subject {i}", body=f"Body {i}",
+                timestamp=f"2025-11-2{i}T10:00:00") for i in range(len(CATEGORIES))]
+PROCESSED = {e.id: ProcessedEmail(email_id=e.id, category=c, action_items=[]) for e, c in zip(EMAILS, CATEGORIES)}
+
+
+def _fake_drafts(monkeypatch):
+    calls = []
+
+    def fake_draft(email, prompts, extra_instruction=""):
+        calls.append(email.id)
+        return json.dumps({"subject": f"Re: {email.subject}", "body": f"Reply to {email.id}",
+                           "suggested_followups": []})
+
+    monkeypatch.setattr(pd, "draft_reply", fake_draft)
+    return calls
+
+
+def test_actionable_emails_are_drafted_within_budget(monkeypatch, isolated_store, prompts):
+    calls = _fake_drafts(monkeypatch)
+    progress = []
+    assert predraft_emails(EMAILS, PROCESSED, prompts, budget=2, on_progress=progress.append) == 2
+    assert progress == [1, 2]
+    # Important first, then the newest To-Do
+    assert sorted(calls) == ["0", "3"]
+    draft = pending_draft(EMAILS[3], prompts)
+    assert draft.body == "Reply to 3" and draft.metadata["status"] == "pending"
+
+    # Up-to-date pending drafts are not redone
+    assert predraft_emails(EMAILS, PROCESSED, prompts, budget=5) == 1
+    assert calls[2:] == ["1"]
+
+
+def test_claim_only_matches_the_same_prompt_and_tone(monkeypatch, isolated_store, prompts):
+    _fake_drafts(monkeypatch)
+    predraft_emails(EMAILS, PROCESSED, prompts)
+    assert claim_pending_draft(EMAILS[0], prompts, "very formal") is None
+    changed = replace(prompts, auto_reply_prompt="Reply like a pirate.")
+    assert pending_draft(EMAILS[1], changed) is None
+
+    # A new prompt replaces the stale pending draft instead of adding one
+    count = storage.count_drafts()
+    predraft_emails(EMAILS, PROCESSED, changed)
+    assert storage.count_drafts() == count and pending_draft(EMAILS[1], changed) is not None
+
+    claimed = claim_pending_draft(EMAILS[0], changed)
+    assert claimed.metadata["status"] == "saved" and claimed.metadata["predrafted"]
+    assert pending_draft(EMAILS[0], changed) is None
+    # The user has a draft now, so it is not pre-drafted again
+    assert predraft_emails(EMAILS[:1], PROCESSED, prompts) == 0
+
+
+def test_deferral_stops_the_stage(monkeypatch, isolated_store, prompts):
+    _fake_drafts(monkeypatch)
+
+    def busy(email, prompts, extra_instruction=""):
+        raise LLMDeferred("circuit_open")
+
+    monkeypatch.setattr(pd, "draft_reply", busy)
+    assert predraft_emails(EMAILS, PROCESSED, prompts) == 0
+    assert storage.count_drafts() == 0
@@ -0,0 +1,87 @@
+import json
+
+import backend.agent as agent
+import backend.preprocess as preprocess
+from backend.models import Email
+from backend.preprocess import chunk_text, clean_body, count_tokens, prepare_body
+
+
+def test_clean_body_strips_quotes_and_signature():
+    body = (
+        "Hi team,\n\nPlease send the final report by Friday.\n> quoted line\nAlso the slides.\n\n"
+        "Best regards,\nJane Doe\nPM | Acme\n\n"
+        "On Mon, Jan 6, 2025 at 10:00 AM Bob <bob@x.com>\nwrote:\n> the whole earlier thread\n"
+    )
+    assert clean_body(body) == "Hi team,\n\nPlease send the final report by Friday.\nAlso the slides."
+    assert clean_body("Looks good.\n\nFrom: Bob\nSent: Monday\nTo: me\n\nolder mail") == "Looks good."
+    assert clean_body("Will do.\n-- \nJane\n+1 555 0100") == "Will do."
+    assert clean_body("Will do.\nSent from my iPhone") == "Will do."
+    # A closing followed by real content is not a signature
+    assert clean_body("Thanks for the numbers.\nCan you also check the logs?") == \
+        "Thanks for the numbers.\nCan you also check the logs?"
+    # Sentences that start like a sign-off are content, after a greeting too
+    assert clean_body("Hi,\nThanks for the numbers.\nCan you also check the logs?") == \
+        "Hi,\nThanks for the numbers.\nCan you also check the logs?"
+    body = "Hi team,\nThanks for the update.\nPlease send the Q3 report by Friday.\nAlso book the room for Monday.\nJohn"
+    assert clean_body(body) == body
+    assert clean_body("Hi,\nBest to ship it Monday.\nCheers for the help on this one, truly.") == \
+        "Hi,\nBest to ship it Monday.\nCheers for the help on this one, truly."
+    assert clean_body("Hi,\nPlease review.\n\nThanks!\nJohn") == "Hi,\nPlease review."
+    assert clean_body("Please review.\nKind regards\nJohn") == "Please review."
+    # A sign-off followed by the actual request is not a signature
+    body = "Hi Bob,\nThanks!\nCan you send the Q3 report by Friday?\nThe board meets Monday."
+    assert clean_body(body) == body
+    assert clean_body("Hi,\nThanks,\nI will send it tomorrow") == "Hi,\nThanks,\nI will send it tomorrow"
+    assert clean_body("Please review.\n\nBest,\nJane Doe\nHead of Sales, Acme Inc.\n+1 555 0100\njane@acme.com") == \
+        "Please review."
+    # Nothing but a quote: keep it rather than send an empty body
+    assert clean_body("> forwarded question") == "> forwarded question"
+
+
+def test_chunks_respect_the_budget(monkeypatch):
+    monkeypatch.setattr(preprocess, "tiktoken", None)
+    preprocess._encoding.cache_clear()
+    text = "\n\n".join(f"Paragraph {i} " + "word " * 40 for i in range(20)) + "\n" + "x" * 900
+    chunks = chunk_text(text, 100)
+    assert len(chunks) > 1 and all(count_tokens(c) <= 100 for c in chunks)
+    assert "".join(chunks).replace("\n", "") == text.replace("\n", "")
+
+    prepared = prepare_body(text, budget=100)
+    assert prepared.over_budget and prepared.text.startswith(prepared.chunks[0])
+    assert "more tokens not shown" in prepared.text
+    assert not prepare_body("short body", budget=100).over_budget
+
+
+def test_long_bodies_use_map_reduce(monkeypatch, prompts):
+    monkeypatch.setenv("EMAIL_AGENT_PROMPT_TOKEN_BUDGET", "50")
+    calls = []
+
+    def fake_llm(system_prompt, user_prompt, use_cache=True):
+        calls.append((system_prompt, user_prompt))
+        if system_prompt == prompts.action_item_prompt:
+            part = user_prompt.split("(part ")[1].split(" ")[0]
+            return json.dumps([{"task": "Send report", "deadline": None}, {"task": f"Task {part}", "deadline": None}])
+        if system_prompt == agent._CHAT_MAP_PROMPT:
+            return "Deadline is Friday." if "(part 1 " in user_prompt else "NONE"
+        return "answer"
+
+    monkeypatch.setattr(agent, "run_llm", fake_llm)
+    email = Email(id="1", sender="a@b.c", subject="Logs", timestamp="",
+                  body="\n\n".join(f"Section {i}: " + "details " * 20 for i in range(4)))
+    parts = len(prepare_body(email.body).chunks)
+    assert parts > 1
+
+    items = agent.extract_action_items(email, prompts)
+    assert len(calls) == parts
+    assert [i["task"] for i in items] == ["Send report"] + [f"Task {p}" for p in range(1, parts + 1)]
+
+    calls.clear()
+    assert agent.chat_about_email(email, prompts, "When is it due?") == "answer"
+    assert len(calls) == parts + 1
+    final_user_prompt = calls[-1][1]
+    assert "Deadline is Friday." in final_user_prompt and "details details" not in final_user_prompt
+
+    # Fused triage falls back to the separate calls so extraction can map-reduce
+    calls.clear()
+    agent.triage_email(email, prompts)
+    assert len(calls) == 1 + parts
@@ -0,0 +1,152 @@
+from types import SimpleNamespace
+
+import pytest
+
+import backend.llm_client as lc
+from backend.ingest import IngestStats, ingest_emails
+from backend.models import Email
+from backend.rate_governor import (AdaptiveLimiter, LLMDeferred, LLMRejected, RateGovernor, TokenBucket, classify,
+                                   retry_after)
+
+
+class ProviderError(Exception):
+    def __init__(self, status_code, headers=None):
+        super().__init__(f"HTTP {status_code}")
+        self.status_code = status_code
+        self.response = SimpleNamespace(status_code=status_code, headers=headers or {})
+
+
+def _flaky(failures):
+    calls = []
+
+    def fn():
+        calls.append(1)
+        if len(calls) <= len(failures):
+            raise failures[len(calls) - 1]
+        return "ok"
+    return fn, calls
+
+
+def test_classify_and_retry_after():
+    assert classify(ProviderError(429)) == "overload"
+    assert classify(ProviderError(500)) == "transient"
+    assert classify(ProviderError(400)) == "fatal"
+    assert classify(ConnectionError()) == "transient"
+    assert retry_after(ProviderError(429, {"retry-after-ms": "1500"})) == 1.5
+    assert retry_after(ProviderError(429, {"retry-after": "Wed, 21 Oct 2026 07:28:00 GMT"})) is None
+
+
+def test_token_bucket_makes_callers_wait():
+    bucket = TokenBucket(rate=10, capacity=10)
+    assert bucket.reserve(10) == 0.0
+    assert bucket.reserve(5) == pytest.approx(0.5, abs=0.05)
+    bucket.adjust(-5)  # the call used less than reserved
+    assert bucket.reserve(1) == pytest.approx(0.1, abs=0.05)
+
+
+def test_retries_honour_retry_after():
+    sleeps = []
+    governor = RateGovernor(rpm=0, tpm=0, retries=3, sleep=sleeps.append)
+    fn, calls = _flaky([ProviderError(429, {"retry-after": "2"}), ProviderError(503)])
+
+    assert governor.call(fn) == "ok"
+    assert len(calls) == 3
+    assert sleeps[0] == 2.0 and 0 <= sleeps[1] <= 1.0
+    # Two overloads inside one window halve the limit only once
+    assert governor.limiter.limit == pytest.approx(16 + 1 / 16)
+
+
+def test_fatal_errors_are_rejected_without_retries_or_tripping_the_breaker():
+    governor = RateGovernor(rpm=0, tpm=0, retries=3, breaker_failures=2, sleep=lambda s: None)
+    for _ in range(3):
+        fn, calls = _flaky([ProviderError(400)])
+        with pytest.raises(LLMRejected) as info:
+            governor.call(fn)
+        assert (info.value.reason, info.value.status) == ("ProviderError", 400) and len(calls) == 1
+    assert not isinstance(info.value, LLMDeferred)
+    assert governor.breaker.state == "closed" and governor.breaker.failures == 0
+
+
+def test_limiter_halves_and_recovers():
+    limiter = AdaptiveLimiter(8)
+    limiter.acquire()
+    limiter.release(overloaded=True)
+    assert limiter.limit == 4
+    for _ in range(4):
+        limiter.acquire()
+        limiter.release()
+    assert limiter.limit == pytest.approx(5, abs=0.2)
+
+
+def test_breaker_opens_and_fails_fast():
+    governor = RateGovernor(rpm=0, tpm=0, retries=0, breaker_failures=2, breaker_cooldown=60, sleep=lambda s: None)
+    for _ in range(2):
+        with pytest.raises(LLMDeferred):
+            governor.call(_flaky([ProviderError(503)])[0])
+    assert governor.breaker.state == "open"
+
+    fn, calls = _flaky([])
+    with pytest.raises(LLMDeferred) as info:
+        governor.call(fn)
+    assert info.value.reason == "circuit_open" and calls == []
+
+    governor.breaker.cooldown = 0
+    assert governor.call(fn) == "ok"  # the half-open probe closes it again
+    assert governor.breaker.state == "closed"
+
+
+def test_ingest_counts_deferred_emails(monkeypatch, prompts):
+    for name in ("EMAIL_AGENT_RULES", "EMAIL_AGENT_CLASSIFIER", "EMAIL_AGENT_DEDUP"):
+        monkeypatch.setenv(name, "0")
+
+    def busy_llm(system_prompt, user_prompt, use_cache=True):
+        if "Subject 1" in user_prompt:
+            raise LLMDeferred("circuit_open")
+        if "Subject 2" in user_prompt:
+            raise LLMRejected("BadRequestError", 400)
+        return lc._mock_response(system_prompt, user_prompt)
+
+    monkeypatch.setattr(lc, "run_llm", busy_llm)
+    emails = [Email(id=str(i), sender="a@b.c", subject=f"Subject {i}", body=f"Please review draft {i}.",
+                    timestamp="2025-11-20T10:00:00") for i in range(4)]
+    stats = IngestStats()
+    results = ingest_emails(emails, prompts, stats=stats)
+
+    assert set(results) == {"0", "3"}
+    assert stats.deferred == 1 and stats.failed == 1
+
+
+def test_a_stream_cut_off_part_way_counts_as_a_failure(monkeypatch):
+    class ReadTimeout(Exception):
+        pass
+
+    def chunk(text):
+        return SimpleNamespace(usage=None, choices=[SimpleNamespace(delta=SimpleNamespace(content=text))])
+
+    def broken_stream():
+        yield chunk("Hel")
+        raise ReadTimeout()
+
+    client = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(
+        create=lambda **kwargs: broken_stream())))
+    governor = RateGovernor(rpm=0, tpm=0, max_concurrency=8, breaker_failures=2, sleep=lambda s: None)
+    monkeypatch.setattr(lc, "get_client", lambda: client)
+    monkeypatch.setattr(lc, "get_governor", lambda: governor)
+
+    for _ in range(2):
+        received = []
+        with pytest.raises(LLMDeferred) as info:
+            for delta in lc.run_chat_stream([{"role": "user", "content": "Hello"}], use_cache=False):
+                received.append(delta)
+        assert received == ["Hel"] and info.value.reason == "ReadTimeout"
+    assert governor.breaker.state == "open"
+    assert governor.limiter.limit == 4 and governor.limiter.inflight == 0
+
+    # A reader that stops early still gives the slot back
+    governor.breaker.record_success()
+    client.chat.completions.create = lambda **kwargs: iter([chunk("Hi"), chunk(" there")])
+    stream = lc.run_chat_stream([{"role": "user", "content": "Hello"}], use_cache=False)
+    assert next(stream) == "Hi"
+    assert governor.limiter.inflight == 1
+    stream.close()
+    assert governor.limiter.inflight == 0
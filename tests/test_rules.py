@@ -0,0 +1,93 @@
+import json
+
+import backend.llm_client as lc
+from backend.ingest import IngestStats, ingest_emails, process_email
+from backend.models import Email
+from backend.rules import Rule, RuleEngine, load_rules
+
+
+RULES = [
+    Rule(name="bulk", category="Newsletter", domains=["mailchimp.com"]),
+    Rule(name="digest", category="Newsletter", headers={"sender": r"^digest@"}),
+    Rule(name="spam-words", category="Spam", confidence=0.95, keywords=["you won", "click here"], min_matches=2),
+    Rule(name="vip", category="Important", senders=["Boss@Company.com"]),
+    Rule(name="weak", category="Spam", confidence=0.5, keywords=["offer"]),
+]
+
+
+def _email(sender="a@b.c", subject="Hello", body="Hi there", id="1"):
+    return Email(id=id, sender=sender, subject=subject, body=body, timestamp="2025-11-20T10:00:00")
+
+
+def test_matchers_and_confidence():
+    engine = RuleEngine(RULES)
+
+    match = engine.match(_email(sender="Acme <news@us5.mailchimp.com>"))
+    assert (match.rule, match.category, match.matched) == ("bulk", "Newsletter", ["domain:mailchimp.com"])
+    assert engine.match(_email(sender="digest@site.org")).rule == "digest"
+    assert engine.match(_email(sender="boss@company.com")).category == "Important"
+
+    spam = engine.match(_email(subject="YOU WON!", body="Click   here to claim"))
+    assert spam.category == "Spam" and spam.matched == ["keyword:click here", "keyword:you won"]
+    assert engine.match(_email(body="you won the raffle")) is None  # below min_matches
+    assert engine.match(_email(body="a special offer")) is None  # rule below the threshold
+    assert engine.match(_email(body="you wonder")) is None  # whole words only
+
+
+def test_conflicting_rules_defer_to_llm():
+    engine = RuleEngine(RULES)
+    assert engine.match(_email(sender="boss@mailchimp.com")) is not None
+    assert engine.match(_email(sender="boss@company.com", body="you won, click here")) is None
+
+
+def test_load_rules_and_fingerprint(tmp_path):
+    path = tmp_path / "rules.json"
+    path.write_text(json.dumps({"rules": [{"name": "x", "category": "Spam", "domains": ["a.b"]}]}))
+    rules = load_rules(path)
+    assert RuleEngine(rules).fingerprint == RuleEngine(load_rules(path)).fingerprint
+    assert RuleEngine(rules).fingerprint != RuleEngine(RULES).fingerprint
+    assert load_rules(tmp_path / "missing.json") == []
+
+
+def _use_rules(monkeypatch, tmp_path, rules):
+    path = tmp_path / "rules.json"
+    path.write_text(json.dumps({"rules": rules}))
+    monkeypatch.setenv("EMAIL_AGENT_RULES_PATH", str(path))
+    return path
+
+
+def test_ingest_skips_llm_for_rule_decided_mail(monkeypatch, tmp_path, prompts):
+    path = _use_rules(monkeypatch, tmp_path, [{"name": "bulk", "category": "Newsletter", "domains": ["bulk.io"]}])
+    calls = []
+
+    def counting_llm(system_prompt, user_prompt, use_cache=True):
+        calls.append(system_prompt)
+        return lc._mock_response(system_prompt, user_prompt)
+
+    monkeypatch.setattr(lc, "run_llm", counting_llm)
+    emails = [_email(id="1", sender="promo@bulk.io", body="Please review the final report"), _email(id="2")]
+    stats = IngestStats()
+    store = ingest_emails(emails, prompts, incremental=True, stats=stats)
+
+    assert len(calls) == 2 and stats.rule_hits == 1
+    assert store["1"].category == "Newsletter" and store["1"].action_items == []
+    assert store["1"].provenance["category"]["matched"] == ["domain:bulk.io"]
+    assert store["2"].provenance == {}
+
+    calls.clear()
+    ingest_emails(emails, prompts, processed=store, incremental=True)
+    assert calls == []
+
+    # Once the rule set changes, the email goes back through the pipeline
+    path.write_text(json.dumps({"rules": []}))
+    stats = IngestStats()
+    ingest_emails(emails, prompts, processed=store, incremental=True, stats=stats)
+    assert stats.reprocessed == 1 and len(calls) == 2
+    assert store["1"].provenance == {} and store["1"].action_items
+
+
+def test_process_email_uses_rules(monkeypatch, tmp_path, prompts):
+    _use_rules(monkeypatch, tmp_path, [{"name": "bulk", "category": "Newsletter", "domains": ["bulk.io"]}])
+    monkeypatch.setattr("backend.agent.run_llm", lambda *a, **k: (_ for _ in ()).throw(AssertionError("LLM called")))
+    result = process_email(_email(sender="x@bulk.io"), prompts)
+    assert result.category == "Newsletter" and result.provenance["action_items"]["rule"] == "bulk"
@@ -0,0 +1,93 @@
+from backend.models import Email, ProcessedEmail
+from backend.search_index import SearchIndex
+
+
+def _email(i, sender, subject, body):
+    return Email(id=str(i), sender=sender, subject=subject, body=body, timestamp="2025-11-20T10:00:00")
+
+
+EMAILS = [
+    _email(1, "manager@company.com", "Project deadline", "We need the final report by Friday."),
+    _email(2, "newsletter@technews.com", "This week in AI", "Top stories about report generation."),
+    _email(3, "hr@company.com", "Benefits enrollment", "Please enroll before the deadline."),
+]
+PROCESSED = {
+    "1": ProcessedEmail(email_id="1", category="To-Do", action_items=[]),
+    "2": ProcessedEmail(email_id="2", category="Newsletter", action_items=[]),
+    "3": ProcessedEmail(email_id="3", category="To-Do", action_items=[]),
+}
+
+
+def _index():
+    index = SearchIndex()
+    assert index.sync(EMAILS, PROCESSED) == 3
+    return index
+
+
+def test_search_ranks_subject_hits_above_body_hits():
+    hits = _index().search("deadline")
+    assert [h.email_id for h in hits] == ["1", "3"]
+
+
+def test_search_field_filters():
+    index = _index()
+    assert [h.email_id for h in index.search("report category:newsletter")] == ["2"]
+    assert [h.email_id for h in index.search("from:hr@")] == ["3"]
+    assert {h.email_id for h in index.search("category:To-Do")} == {"1", "3"}
+    assert index.search("report from:hr@") == []
+
+
+def test_incremental_updates_and_persistence(tmp_path):
+    index = _index()
+    assert index.sync(EMAILS, PROCESSED) == 0
+
+    index.update_category(EMAILS[1], "Important")
+    assert [h.email_id for h in index.search("category:important")] == ["2"]
+
+    index.sync(EMAILS[:2], PROCESSED)
+    assert index.search("enrollment") == []
+
+    index.save(tmp_path / "index.json")
+    reloaded = SearchIndex.load(tmp_path / "index.json")
+    assert len(reloaded) == 2
+    assert [h.email_id for h in reloaded.search("final report")] == ["1"]
+
+
+
+def test_categories_change_without_bodies_and_saves_are_debounced(tmp_path, monkeypatch):
+    index = _index()
+    relabelled = dict(PROCESSED, **{"2": ProcessedEmail(email_id="2", category="Important", action_items=[])})
+    assert index.sync_categories(relabelled) == 1
+    assert [h.email_id for h in index.search("category:important")] == ["2"]
+    assert index.search("category:newsletter") == []
+    assert [h.email_id for h in index.search("report category:important")] == ["2"]
+
+    monkeypatch.setenv("EMAIL_AGENT_INDEX_SAVE_SECONDS", "3600")
+    path = tmp_path / "index.json"
+    assert index.save_if_due(path) and not index.save_if_due(path)
+    index.set_category("1", "Spam")
+    assert not index.save_if_due(path)
+    assert index.save_if_due(path, force=True)
+    assert [h.email_id for h in SearchIndex.load(path).search("category:spam")] == ["1"]
+
+
+def test_sync_refs_loads_only_new_or_changed_messages():
+    from backend.mail_sources import EmailRef
+
+    refs = [EmailRef(e.id, e.sender, e.subject, e.timestamp, i) for i, e in enumerate(EMAILS)]
+    loaded = []
+
+    def load(ref):
+        loaded.append(ref.id)
+        return EMAILS[ref.location]
+
+    index = SearchIndex()
+    assert index.sync_refs(refs, load, PROCESSED) == 3 and loaded == ["1", "2", "3"]
+    assert index.sync_refs(refs, load, PROCESSED) == 0 and len(loaded) == 3
+
+    # Changed headers reload the message, a new category doesn't, a missing one is dropped
+    refs[0] = EmailRef("1", EMAILS[0].sender, "Project deadline moved", EMAILS[0].timestamp, 0)
+    relabelled = dict(PROCESSED, **{"2": ProcessedEmail(email_id="2", category="Important", action_items=[])})
+    assert index.sync_refs(refs[:2], load, relabelled) == 3 and loaded[3:] == ["1"]
+    assert [h.email_id for h in index.search("category:important")] == ["2"]
+    assert index.search("enrollment") == []
@@ -0,0 +1,46 @@
+import pytest
+
+from backend.models import ProcessedEmail
+from backend.shards import merge_shards, parse_shard, shard_of, shard_path, write_shard
+
+
+def test_shards_partition_ids_stably():
+    ids = [f"<msg{i}@example.com>" for i in range(200)]
+    shards = [shard_of(i, 4) for i in ids]
+    assert set(shards) == {0, 1, 2, 3}
+    assert shard_of(ids[0], 4) == shards[0]
+    # Pool workers split shard i/n into shards i + n*j of n*w
+    for email_id in ids:
+        assert shard_of(email_id, 4 * 3) % 4 == shard_of(email_id, 4)
+
+
+def test_parse_shard():
+    assert parse_shard("2/5") == (2, 5)
+    for bad in ("5/5", "-1/2", "1", "a/b", "0/0"):
+        with pytest.raises(ValueError):
+            parse_shard(bad)
+
+
+def _result(email_id, category):
+    return ProcessedEmail(email_id=email_id, category=category, action_items=[])
+
+
+def test_merge_reports_conflicts_and_missing_shards(tmp_path):
+    ids = [f"id{i}" for i in range(20)]
+    mine = [i for i in ids if shard_of(i, 3) == 0]
+    other = [i for i in ids if shard_of(i, 3) == 1]
+    stray = mine[0]
+    write_shard(shard_path(0, 3, tmp_path), 0, 3, {i: _result(i, "Important") for i in mine})
+    # Shard 1 also (wrongly) holds a differing result for one of shard 0's emails,
+    # and an identical copy of another, which is not a conflict
+    shard1 = {i: _result(i, "Newsletter") for i in other}
+    shard1[stray] = _result(stray, "Spam")
+    shard1[mine[1]] = _result(mine[1], "Important")
+    write_shard(shard_path(1, 3, tmp_path), 1, 3, shard1)
+
+    merged, report = merge_shards(sorted(tmp_path.glob("*.json")))
+    assert set(merged) == set(mine) | set(other)
+    assert merged[stray].category == "Important"  # the owning shard wins
+    assert [(c.email_id, c.paths) for c in report.conflicts] == [
+        (stray, [shard_path(0, 3, tmp_path), shard_path(1, 3, tmp_path)])]
+    assert report.missing == ["2/3"]
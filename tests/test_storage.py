@@ -14,3 +14,65 @@ def test_load_prompts_parsing():
     assert hasattr(prompts, "categorization_prompt")
     assert hasattr(prompts, "action_item_prompt")
     assert hasattr(prompts, "auto_reply_prompt")
+
+
+def test_sqlite_store_upserts_and_queries(monkeypatch, isolated_store):
+    from backend.models import ProcessedEmail
+
+    monkeypatch.setenv("EMAIL_AGENT_STORAGE", "sqlite")
+    storage.upsert_processed([
+        ProcessedEmail(email_id="1", category="To-Do", action_items=[{"task": "x", "deadline": None}]),
+        ProcessedEmail(email_id="2", category="Spam", action_items=[]),
+    ])
+    storage.upsert_processed([ProcessedEmail(email_id="2", category="Newsletter", action_items=[])])
+
+    assert storage.count_processed() == 2
+    assert storage.get_processed("1").action_items == [{"task": "x", "deadline": None}]
+    assert [p.email_id for p in storage.processed_by_category("Newsletter")] == ["2"]
+    assert storage.processed_by_category("Spam") == []
+
+    first = storage.add_draft("1", "Re: one", "body", {})
+    storage.add_draft("2", "Re: two", "body", {})
+    assert [d.id for d in storage.drafts_for_email("1")] == [first.id]
+    assert storage.count_drafts() == 2
+    assert not (isolated_store / "drafts.json").exists()
+
+
+def test_migrate_json_to_sqlite(monkeypatch, isolated_store):
+    from backend.models import ProcessedEmail
+
+    storage.save_processed({"1": ProcessedEmail(email_id="1", category="Important", action_items=[])})
+    storage.add_draft("1", "Re: one", "body", {"tone": "friendly"})
+
+    assert storage.migrate_json_to_sqlite() == {"processed": 1, "drafts": 1}
+    # re-running does not duplicate drafts
+    assert storage.migrate_json_to_sqlite() == {"processed": 1, "drafts": 0}
+
+    monkeypatch.setenv("EMAIL_AGENT_STORAGE", "sqlite")
+    assert storage.get_processed("1").category == "Important"
+    assert storage.load_drafts()[0].metadata == {"tone": "friendly"}
+
+
+def test_json_store_concurrent_writers_keep_every_change(monkeypatch, isolated_store):
+    from concurrent.futures import ThreadPoolExecutor
+    from backend.models import ProcessedEmail
+
+    def write(worker):
+        for i in range(10):
+            storage.upsert_processed([ProcessedEmail(email_id=f"{worker}-{i}", category="To-Do", action_items=[])])
+            storage.add_draft(f"{worker}-{i}", "Re: hi", "body", {})
+
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        list(pool.map(write, range(4)))
+    assert storage.count_processed() == 40 and storage.count_drafts() == 40
+
+
+def test_ingest_worker_refuses_the_json_store(monkeypatch, isolated_store, capsys):
+    import runpy
+    from pathlib import Path
+
+    monkeypatch.setenv("EMAIL_AGENT_JOBS_DB", str(isolated_store / "jobs.sqlite"))
+    worker = runpy.run_path(str(Path(__file__).resolve().parents[1] / "scripts" / "ingest_worker.py"))
+    assert worker["main"](["--once"]) == 2
+    assert "EMAIL_AGENT_STORAGE=sqlite" in capsys.readouterr().err
+    assert not (isolated_store / "jobs.sqlite").exists()
@@ -0,0 +1,48 @@
+from backend.models import Email
+from backend.threads import ThreadIndex, normalize_subject
+
+
+def _email(i, subject, ts, sender="a@example.com", message_id=None, in_reply_to=None):
+    return Email(id=str(i), sender=sender, subject=subject, body="", timestamp=ts,
+                 message_id=message_id, in_reply_to=in_reply_to)
+
+
+def test_normalize_subject():
+    assert normalize_subject("Re: FWD: re[2]:  Budget  review") == "budget review"
+    assert normalize_subject("Budget review") == "budget review"
+
+
+def test_threads_by_subject_not_sender():
+    index = ThreadIndex()
+    index.sync([
+        _email(1, "Budget", "2025-11-20T10:00:00"),
+        _email(2, "Re: Budget", "2025-11-20T11:00:00", sender="b@example.com"),
+        _email(3, "Lunch?", "2025-11-19T09:00:00"),
+    ])
+    assert index.thread_of("2") == ["1", "2"]
+    assert index.thread_of("3") == ["3"]
+
+
+def test_message_id_links_even_when_parent_arrives_later():
+    index = ThreadIndex()
+    index.add(_email(2, "Quick question", "2025-11-20T11:00:00", message_id="m2", in_reply_to="m1"))
+    index.add(_email(3, "Unrelated", "2025-11-20T12:00:00", message_id="m3", in_reply_to="m2"))
+    assert index.thread_of("3") == ["2", "3"]
+
+    index.add(_email(1, "Original", "2025-11-20T09:00:00", message_id="m1"))
+    assert index.thread_of("3") == ["1", "2", "3"]
+    assert index.thread_id("1") == index.thread_id("3")
+
+
+def test_sync_rebuilds_on_change_and_persists(tmp_path):
+    emails = [_email(1, "Budget", "2025-11-20T10:00:00"), _email(2, "Re: Budget", "2025-11-20T11:00:00")]
+    index = ThreadIndex()
+    assert index.sync(emails) == 2
+    assert index.sync(emails) == 0
+
+    emails[1].subject = "Something else"
+    assert index.sync(emails) == 1
+    assert index.thread_of("1") == ["1"]
+
+    index.save(tmp_path / "threads.json")
+    assert ThreadIndex.load(tmp_path / "threads.json").thread_of("2") == ["2"]